@@ -9,14 +9,18 @@ Original file is located at
 # **Loading the Data**
 """
 
-import pandas as pd
+import os
+import sys
 
-# Load JSON data into a Pandas DataFrame
-df = pd.read_json('E:\Care-connect\Model\cleaned_data.json')
+import pandas as pd
 
+# Features are engineered (and cached) by MomCareML/anc_pipeline.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from anc_pipeline import BOOTCAMP_CONFIG, build_features
 
-# Display the first few rows of the DataFrame
-print(df.head())
+# Raw survey codes of every column but the last two, and the target
+# (ANC < 4 visits -> 1), from the cache when the data has not changed
+X, y, encoder = build_features(r'E:\Care-connect\Model\cleaned_data.json', **BOOTCAMP_CONFIG)
 
 """# Importing Libraries
 
@@ -41,29 +45,10 @@ print('Libraries Imported')
 
 """# Feature Engineering"""
 
-# Function to apply transformation
-def transform_value(value):
-    if value < 4:
-        return 1
-    else:
-        return 0
-
-# Apply transformation to the ANC column and create a new column 'Target Variable'
-df['Target Variable'] = df['ANC'].apply(transform_value)
-
-# Create new features
-X = df.iloc[:, :-3].values
-
-# 'ANC' is the name of the column you want to use as y
-y = df['Target Variable'].values
-
-
 # Creating a new DataFrame with column names
-columns_to_keep = df.columns[:-3]  # Exclude the last two columns
-new_data_X = pd.DataFrame(X, columns=columns_to_keep)
+new_data_X = pd.DataFrame(X, columns=encoder.feature_names)
 
-# Initialize the 'dropout combined' column to 0
-y = y.reshape(-1, 1)  # The following code would convert the y variable to a 2-dimensional array with one row and 32156 columns:
+y = y.reshape(-1, 1)
 
 print(new_data_X.shape)
 print(y.shape)
@@ -103,13 +88,16 @@ print("Accuracy:", accuracy)
 
 """# Model Deployment"""
 
-# Save the trained model to a file for deployment
-import joblib
-joblib.dump(model, 'trained_model.pkl')
+# Save the trained model in XGBoost's native format (with its feature names)
+# for deployment; MomCareML/model.py serves dropout_model.ubj on /predict/dropout
+booster = model.get_booster()
+booster.feature_names = list(new_data_X.columns)
+booster.save_model('dropout_model.ubj')
+# The fitted feature layout, so the server encodes records the same way
+encoder.save('dropout_encoder.json')
 
 def predict_dropout():
-    # Load the trained model
-    model = joblib.load('trained_model.pkl')
+    # Uses the model trained above instead of reloading it for every prediction
 
     # Ask the user to input the variables
     user_input = []
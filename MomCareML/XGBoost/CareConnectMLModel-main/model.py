@@ -9,18 +9,16 @@ Original file is located at
 # Loading Data
 """
 
-import pandas as pd
-import json
+import os
+import sys
+
+# Features are engineered (and cached) by MomCareML/anc_pipeline.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from anc_pipeline import MODEL_CONFIG, build_features
 
 # Path to your JSON file
 json_file_path = '/content/Bootcamp data.json'
 
-# Read the JSON file into a pandas DataFrame
-df = pd.read_json(json_file_path)
-
-# Display the DataFrame (optional)
-print(df)
-
 """# Importing Libraries"""
 
 import matplotlib.pyplot as plt
@@ -62,57 +60,18 @@ print('Libraries Imported')
 
 """# Pre-Processing Data"""
 
-columns_to_drop = ['Region']
-
-# Drop the specified columns
-export default Patients;
-df = df.drop(columns=columns_to_drop)
-
-categorical_columns = [' CurrAgeGroup','Distance to health', 'Freq. of watching TV', 'Freq. of listening to radio', 'Freq. use internet', 'wealth index', 'Education level', 'Place of Residence', 'Head sex', 'Religion', 'Current marital_status']
-one_hot_encoded_data = pd.get_dummies(df, columns=categorical_columns, drop_first=True)
-
-# Replace False with 0 and True with 1
-one_hot_encoded_data.replace({False: 0, True: 1}, inplace=True)
-
-# Clean the ANC column: replace non-numeric values with NaN, then drop or fill NaNs
-one_hot_encoded_data['ANC'] = pd.to_numeric(one_hot_encoded_data['ANC'], errors='coerce')
-
-median_value = one_hot_encoded_data['ANC'].median()
-one_hot_encoded_data['ANC'] = one_hot_encoded_data['ANC'].fillna(median_value)
-
-# Convert the ANC column to integers
-one_hot_encoded_data['ANC'] = one_hot_encoded_data['ANC'].astype(int)
-
-# Apply the transformation
-one_hot_encoded_data['ANC_Binary'] = one_hot_encoded_data['ANC'].apply(lambda x: 1 if x >= 4 else 0)
-
-# Display the modified DataFrame
-one_hot_encoded_data.head()
-
-# Specify the columns to drop
-columns_to_drop = ['ANC']
-
-# Drop the specified columns
-data = one_hot_encoded_data.drop(columns=columns_to_drop)
-
-from sklearn.feature_selection import VarianceThreshold
-
-# Prepare features and target
-X = data.drop('ANC_Binary', axis=1)  #ANC_Binary is the target column
-y = data['ANC_Binary']
-
-# Initialize VarianceThreshold
-selector = VarianceThreshold(threshold=0.01)
-X_reduced = selector.fit_transform(X)
+# Drops Region, one-hot encodes the categorical columns (drop_first), labels
+# ANC >= 4 as 1 and removes features with variance <= 0.01. Re-runs over the
+# same file load the cached matrix instead of re-encoding it.
+X_reduced, y, encoder = build_features(json_file_path, **MODEL_CONFIG)
 
 # Get the selected features
-selected_features = X.columns[selector.get_support()]
+selected_features = encoder.feature_names
 
 # Print the selected features
 print("Selected features:")
 print(selected_features)
 
-
 # Split the data
 X_train, X_test, y_train, y_test = train_test_split(X_reduced, y, test_size=0.2, random_state=42)
 
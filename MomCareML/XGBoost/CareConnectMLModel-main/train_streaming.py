@@ -0,0 +1,186 @@
+"""
+Out-of-core training of the ANC dropout model.
+
+    python train_streaming.py data.json [--config bootcamp|model] [--chunk-size 50000]
+                              [--params tuning/best.json] [--encoder dropout_encoder.json]
+                              [--mode stream|memory] [--compare] [--out .]
+
+--mode stream (default) never holds the dataset in memory. anc_pipeline
+reads the JSON in chunks, fits the encoder from running counts (or reuses
+--encoder, keeping its category vocabulary) and writes encoded .npy chunks.
+XGBoost then builds an external-memory quantile matrix from them through a
+DataIter. The minority class is rebalanced with per-row sample weights
+instead of duplicating rows as RandomOverSampler did.
+
+--mode memory is the previous path for comparison: read_json the whole file,
+encode it at once, duplicate minority rows, build an in-memory DMatrix.
+
+--compare runs both modes in fresh processes and prints their peak RSS. Each
+run prints its own peak RSS and writes dropout_model.ubj and
+dropout_encoder.json to --out.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from anc_pipeline import AncEncoder, anc_target, build_feature_chunks, clean_anc, read_frame
+from tune_dropout import BASELINES, CONFIGS, xgb_params
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def class_weights(rows, positives):
+    """Per-label weights that give both classes the majority's total weight."""
+    negatives = rows - positives
+    majority = max(positives, negatives)
+    return np.array([majority / max(negatives, 1), majority / max(positives, 1)], dtype=np.float32)
+
+
+def chunk_iterator(entry, chunks, weights, cache_prefix):
+    import xgboost as xgb
+
+    class ChunkIter(xgb.DataIter):
+        """Feeds the encoded .npy chunks to XGBoost one at a time."""
+
+        def __init__(self):
+            self._n = 0
+            super().__init__(cache_prefix=cache_prefix)
+
+        def next(self, input_data):
+            if self._n == len(chunks):
+                return False
+            path = os.path.join(entry, chunks[self._n])
+            y = np.load(path + '.y.npy')
+            input_data(data=np.load(path + '.X.npy', mmap_mode='r'), label=y, weight=weights[y])
+            self._n += 1
+            return True
+
+        def reset(self):
+            self._n = 0
+
+    return ChunkIter()
+
+
+def external_matrix(entry, chunks, weights, cache_prefix, ref=None):
+    import xgboost as xgb
+
+    it = chunk_iterator(entry, chunks, weights, cache_prefix)
+    if hasattr(xgb, 'ExtMemQuantileDMatrix'):
+        return xgb.ExtMemQuantileDMatrix(it, ref=ref)
+    return xgb.DMatrix(it)
+
+
+def train_stream(args, params):
+    encoder = AncEncoder.load(args.encoder) if args.encoder else None
+    entry, manifest, encoder = build_feature_chunks(args.data, args.chunk_size, encoder=encoder,
+                                                    **CONFIGS[args.config])
+    weights = class_weights(manifest['rows'], manifest['positives'])
+    chunks = manifest['chunks']
+    # The last chunk(s) are held out for early stopping
+    held_out = min(args.eval_chunks, len(chunks) - 1)
+    train_chunks, eval_chunks = chunks[:len(chunks) - held_out], chunks[len(chunks) - held_out:]
+    print(f"{manifest['rows']} rows in {len(chunks)} chunks, {len(encoder.features)} features, "
+          f"class weights {weights.tolist()}")
+
+    with tempfile.TemporaryDirectory() as cache:
+        dtrain = external_matrix(entry, train_chunks, weights, os.path.join(cache, 'train'))
+        evals = []
+        if eval_chunks:
+            evals = [(external_matrix(entry, eval_chunks, weights, os.path.join(cache, 'eval'), ref=dtrain),
+                      'eval')]
+        booster = train(params, dtrain, evals, args)
+        # Free the matrices (and their cache pages) before the directory goes
+        del dtrain, evals
+    return encoder, booster
+
+
+def train_memory(args, params):
+    settings = dict(CONFIGS[args.config])
+    label = settings.pop('label')
+    df = read_frame(args.data)
+    encoder = AncEncoder.fit(df, **settings)
+    X = encoder.transform(df)
+    anc, _ = clean_anc(df['ANC'], encoder.anc_median)
+    y = anc_target(anc, label)
+    del df
+    # RandomOverSampler: duplicate minority rows up to the majority count
+    rng = np.random.default_rng(args.seed)
+    minority = int(y.sum() * 2 < len(y))
+    members = np.flatnonzero(y == minority)
+    extra = rng.choice(members, len(y) - 2 * len(members), replace=True)
+    X, y = np.concatenate([X, X[extra]]), np.concatenate([y, y[extra]])
+    print(f"{len(y)} rows after oversampling, {X.shape[1]} features")
+
+    import xgboost as xgb
+
+    dtrain = xgb.DMatrix(X, label=y, feature_names=encoder.feature_names)
+    return encoder, train(params, dtrain, [], args)
+
+
+def train(params, dtrain, evals, args):
+    import xgboost as xgb
+
+    kwargs = {}
+    if evals:
+        kwargs = dict(evals=evals, early_stopping_rounds=args.early_stopping, verbose_eval=False)
+    return xgb.train(params, dtrain, num_boost_round=args.rounds, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Out-of-core training for the ANC dropout model")
+    parser.add_argument('data', help="JSON array or NDJSON dataset")
+    parser.add_argument('--config', choices=sorted(CONFIGS), default='bootcamp', help="feature pipeline")
+    parser.add_argument('--mode', choices=['stream', 'memory'], default='stream')
+    parser.add_argument('--compare', action='store_true', help="run both modes and compare peak RSS")
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--eval-chunks', type=int, default=1, help="chunks held out for early stopping")
+    parser.add_argument('--encoder', help="saved AncEncoder to reuse (fixed category vocabulary)")
+    parser.add_argument('--params', help="best.json from tune_dropout.py (default: bootcamp settings)")
+    parser.add_argument('--rounds', type=int, default=190)
+    parser.add_argument('--early-stopping', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', default='.')
+    args = parser.parse_args()
+
+    if args.compare:
+        base = [a for a in sys.argv[1:] if a != '--compare']
+        print(f"{'mode':<8} {'peak RSS MB':>12} {'seconds':>8}")
+        for mode in ('memory', 'stream'):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__)] + base + ['--mode', mode],
+                                 capture_output=True, text=True, check=True).stdout
+            report = json.loads(out.strip().splitlines()[-1])
+            print(f"{mode:<8} {report['peak_rss_mb']:>12.1f} {report['seconds']:>8.1f}")
+        return
+
+    if args.params:
+        with open(args.params) as f:
+            best = json.load(f)['params']
+    else:
+        best = BASELINES[0]
+    params = xgb_params(best, 1.0, args.seed)
+    params.pop('scale_pos_weight')
+    params['nthread'] = os.cpu_count()
+
+    start = time.perf_counter()
+    encoder, booster = (train_stream if args.mode == 'stream' else train_memory)(args, params)
+    booster.feature_names = encoder.feature_names
+    os.makedirs(args.out, exist_ok=True)
+    booster.save_model(os.path.join(args.out, 'dropout_model.ubj'))
+    encoder.save(os.path.join(args.out, 'dropout_encoder.json'))
+    print(json.dumps({'mode': args.mode, 'peak_rss_mb': peak_rss_mb(),
+                      'seconds': time.perf_counter() - start, 'rounds': booster.num_boosted_rounds()}))
+
+
+if __name__ == '__main__':
+    main()
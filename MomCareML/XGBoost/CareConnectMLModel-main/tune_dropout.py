@@ -0,0 +1,262 @@
+"""
+Hyperparameter search for the ANC dropout classifier.
+
+    python tune_dropout.py data.json [--config bootcamp|model] [--search halving|random]
+                           [--trials 40] [--folds 5] [--repeats 2] [--jobs N] [--out tuning]
+
+Candidates are sampled from SPACE (the two hand-picked configurations of
+bootcamp_codes.py and model.py are always trial 0 and 1, so the leaderboard
+shows what the search gained) and scored by mean validation AUC over
+repeated stratified K-fold CV. Every fit uses the 'hist' tree method with
+early stopping on the validation fold, one thread per fit, and the fits run
+in parallel across --jobs processes (all cores by default), reading the
+features from anc_pipeline's memory-mapped cache.
+
+--search halving runs successive halving: all candidates are first fitted
+on a small stratified share of each training fold, and only the best
+1/--eta move on to the next rung with --eta times more data, up to the full
+folds. --search random fits every candidate on the full folds.
+
+Each finished candidate is appended to <out>/trials.jsonl; re-running the
+same command skips what is already there, so an interrupted search resumes.
+The winner is refitted on all rows with its mean early-stopped number of
+rounds and written as <out>/dropout_model.ubj with dropout_encoder.json,
+next to leaderboard.csv and best.json.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from anc_pipeline import BOOTCAMP_CONFIG, MODEL_CONFIG, build_features
+
+CONFIGS = {'bootcamp': BOOTCAMP_CONFIG, 'model': MODEL_CONFIG}
+
+# The hand-tuned settings of bootcamp_codes.py and model.py
+BASELINES = [
+    {'max_depth': 19, 'eta': 0.1, 'subsample': 0.7, 'colsample_bytree': 0.9, 'min_child_weight': 4,
+     'gamma': 0.0, 'lambda': 1.0},
+    {'max_depth': 17, 'eta': 0.1, 'subsample': 0.9, 'colsample_bytree': 0.6, 'min_child_weight': 8,
+     'gamma': 0.0, 'lambda': 1.0},
+]
+
+# name: (kind, low, high); 'log' samples uniformly in log space
+SPACE = {
+    'max_depth': ('int', 3, 19),
+    'eta': ('log', 0.01, 0.3),
+    'subsample': ('uniform', 0.5, 1.0),
+    'colsample_bytree': ('uniform', 0.4, 1.0),
+    'min_child_weight': ('log', 1.0, 20.0),
+    'gamma': ('uniform', 0.0, 5.0),
+    'lambda': ('log', 0.1, 10.0),
+}
+
+
+def sample_params(n, seed):
+    rng = np.random.default_rng(seed)
+    candidates = [dict(p) for p in BASELINES[:n]]
+    while len(candidates) < n:
+        params = {}
+        for name, (kind, low, high) in SPACE.items():
+            if kind == 'int':
+                params[name] = int(rng.integers(low, high + 1))
+            elif kind == 'log':
+                params[name] = float(math.exp(rng.uniform(math.log(low), math.log(high))))
+            else:
+                params[name] = float(rng.uniform(low, high))
+        candidates.append(params)
+    return candidates
+
+
+def cv_splits(y, folds, repeats, seed):
+    from sklearn.model_selection import RepeatedStratifiedKFold
+
+    cv = RepeatedStratifiedKFold(n_splits=folds, n_repeats=repeats, random_state=seed)
+    return list(cv.split(np.zeros(len(y)), y))
+
+
+def stratified_share(train, y, fraction, seed):
+    """A class-balanced ``fraction`` of the ``train`` indices."""
+    if fraction >= 1:
+        return train
+    rng = np.random.default_rng(seed)
+    parts = []
+    for label in np.unique(y[train]):
+        members = train[y[train] == label]
+        parts.append(rng.choice(members, max(1, int(round(len(members) * fraction))), replace=False))
+    return np.sort(np.concatenate(parts))
+
+
+_arrays = {}
+
+
+def _load(path):
+    # Each worker maps the cached features once
+    if path not in _arrays:
+        _arrays[path] = np.load(path, mmap_mode='r')
+    return _arrays[path]
+
+
+def fit_fold(x_path, y_path, train, val, params, max_rounds, early_stopping):
+    """``(auc, logloss, best_iteration)`` of one early-stopped fit."""
+    import xgboost as xgb
+
+    X, y = _load(x_path), _load(y_path)
+    dtrain = xgb.DMatrix(X[train], label=y[train], nthread=1)
+    dval = xgb.DMatrix(X[val], label=y[val], nthread=1)
+    history = {}
+    booster = xgb.train(params, dtrain, num_boost_round=max_rounds, evals=[(dval, 'val')],
+                        early_stopping_rounds=early_stopping, evals_result=history, verbose_eval=False)
+    best = booster.best_iteration
+    return history['val']['auc'][best], history['val']['logloss'][best], best
+
+
+def trial_key(settings, params, fraction):
+    payload = json.dumps([settings, params, fraction], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def xgb_params(params, scale_pos_weight, seed):
+    return dict(params, objective='binary:logistic', eval_metric=['logloss', 'auc'], tree_method='hist',
+                scale_pos_weight=scale_pos_weight, nthread=1, seed=seed)
+
+
+def run_rung(pool, candidates, fraction, splits, data, settings, done, log, args):
+    """Score ``candidates`` (list of (trial, params)) on ``fraction`` of each fold."""
+    x_path, y_path, y, scale_pos_weight = data
+    results, pending = {}, {}
+    for trial, params in candidates:
+        key = trial_key(settings, params, fraction)
+        if key in done:
+            results[trial] = done[key]
+            continue
+        futures = []
+        for n, (train, val) in enumerate(splits):
+            train = stratified_share(train, y, fraction, args.seed + n)
+            futures.append(pool.submit(fit_fold, x_path, y_path, train, val,
+                                       xgb_params(params, scale_pos_weight, args.seed),
+                                       args.max_rounds, args.early_stopping))
+        pending[trial] = (key, params, futures, time.perf_counter())
+
+    for trial, (key, params, futures, started) in pending.items():
+        scores = np.array([f.result() for f in futures])
+        record = {
+            'key': key, 'trial': trial, 'fraction': fraction, 'params': params,
+            'auc_mean': float(scores[:, 0].mean()), 'auc_std': float(scores[:, 0].std()),
+            'logloss_mean': float(scores[:, 1].mean()), 'rounds': float(scores[:, 2].mean() + 1),
+            'fits': len(futures), 'seconds': time.perf_counter() - started,
+        }
+        log.write(json.dumps(record) + '\n')
+        log.flush()
+        done[key] = results[trial] = record
+        print(f"  trial {trial:>3} fraction {fraction:.3f}: AUC {record['auc_mean']:.4f} "
+              f"± {record['auc_std']:.4f}, {record['rounds']:.0f} rounds", flush=True)
+    return results
+
+
+def rung_fractions(n_candidates, eta, min_fraction):
+    """Data fraction per rung, ending at 1.0, with one rung per halving."""
+    rungs = max(1, math.ceil(math.log(max(n_candidates, 1), eta)))
+    fractions = [min(1.0, min_fraction * eta ** r) for r in range(rungs)]
+    return sorted(set(fractions[:-1])) + [1.0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hyperparameter search for the ANC dropout model")
+    parser.add_argument('data', help="JSON dataset")
+    parser.add_argument('--config', choices=sorted(CONFIGS), default='bootcamp', help="feature pipeline")
+    parser.add_argument('--search', choices=['halving', 'random'], default='halving')
+    parser.add_argument('--trials', type=int, default=40)
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=2)
+    parser.add_argument('--eta', type=int, default=3, help="halving: keep 1/eta per rung")
+    parser.add_argument('--min-fraction', type=float, default=0.1, help="halving: data share of the first rung")
+    parser.add_argument('--max-rounds', type=int, default=1000)
+    parser.add_argument('--early-stopping', type=int, default=30)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', default='tuning')
+    args = parser.parse_args()
+
+    X, y, encoder = build_features(args.data, **CONFIGS[args.config])
+    if not isinstance(X, np.memmap):
+        # First run wrote the cache; map it so workers share the pages
+        X, y, encoder = build_features(args.data, **CONFIGS[args.config])
+    y_host = np.asarray(y)
+    positives = int(y_host.sum())
+    scale_pos_weight = (len(y_host) - positives) / max(positives, 1)
+    data = (X.filename, y.filename, y_host, scale_pos_weight)
+    print(f"{len(y_host)} rows, {X.shape[1]} features, {positives} positives; "
+          f"{args.folds}x{args.repeats} CV on {args.jobs} processes")
+
+    settings = {'data': os.path.basename(os.path.dirname(X.filename)), 'config': args.config,
+                'folds': args.folds, 'repeats': args.repeats, 'seed': args.seed,
+                'max_rounds': args.max_rounds, 'early_stopping': args.early_stopping}
+    splits = cv_splits(y_host, args.folds, args.repeats, args.seed)
+
+    os.makedirs(args.out, exist_ok=True)
+    log_path = os.path.join(args.out, 'trials.jsonl')
+    done = {}
+    if os.path.exists(log_path):
+        with open(log_path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    done[record['key']] = record
+        print(f"resuming: {len(done)} finished trials in {log_path}")
+
+    candidates = list(enumerate(sample_params(args.trials, args.seed)))
+    fractions = ([1.0] if args.search == 'random'
+                 else rung_fractions(len(candidates), args.eta, args.min_fraction))
+    reached = {}  # trial -> its record from the last rung it was scored in
+    with ProcessPoolExecutor(args.jobs) as pool, open(log_path, 'a') as log:
+        for rung, fraction in enumerate(fractions):
+            print(f"rung {rung}: {len(candidates)} candidates on {fraction:.0%} of each training fold")
+            results = run_rung(pool, candidates, fraction, splits, data, settings, done, log, args)
+            reached.update(results)
+            if fraction < 1.0:
+                ranked = sorted(candidates, key=lambda c: -results[c[0]]['auc_mean'])
+                candidates = ranked[:max(1, len(ranked) // args.eta)]
+
+    # Candidates that got further rank first, then by AUC
+    board = sorted(reached.values(), key=lambda r: (-r['fraction'], -r['auc_mean'], r['auc_std']))
+    with open(os.path.join(args.out, 'leaderboard.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['rank', 'trial', 'fraction', 'auc_mean', 'auc_std', 'logloss_mean', 'rounds']
+                        + list(SPACE))
+        for rank, r in enumerate(board, start=1):
+            writer.writerow([rank, r['trial'], r['fraction'], f"{r['auc_mean']:.5f}", f"{r['auc_std']:.5f}",
+                             f"{r['logloss_mean']:.5f}", round(r['rounds'])] +
+                            [r['params'][name] for name in SPACE])
+
+    print(f"\n{'rank':>4} {'trial':>5} {'data':>5} {'AUC':>8} {'±':>7} {'rounds':>6}  params")
+    for rank, r in enumerate(board[:10], start=1):
+        params = ', '.join(f"{k}={v:.3g}" for k, v in r['params'].items())
+        print(f"{rank:>4} {r['trial']:>5} {r['fraction']:>5.0%} {r['auc_mean']:>8.4f} {r['auc_std']:>7.4f} "
+              f"{r['rounds']:>6.0f}  {params}")
+
+    best = board[0]
+    import xgboost as xgb
+
+    params = xgb_params(best['params'], scale_pos_weight, args.seed)
+    params['nthread'] = args.jobs
+    dtrain = xgb.DMatrix(np.asarray(X), label=y_host, feature_names=encoder.feature_names)
+    booster = xgb.train(params, dtrain, num_boost_round=max(1, round(best['rounds'])))
+    booster.save_model(os.path.join(args.out, 'dropout_model.ubj'))
+    encoder.save(os.path.join(args.out, 'dropout_encoder.json'))
+    with open(os.path.join(args.out, 'best.json'), 'w') as f:
+        json.dump(dict(best, settings=settings, scale_pos_weight=scale_pos_weight), f, indent=1)
+    print(f"\nselected trial {best['trial']} (AUC {best['auc_mean']:.4f}); "
+          f"model written to {os.path.join(args.out, 'dropout_model.ubj')}")
+
+
+if __name__ == '__main__':
+    main()
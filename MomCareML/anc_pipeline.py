@@ -0,0 +1,377 @@
+"""
+Feature engineering for the ANC dropout models, shared by training and serving.
+
+    X, y, encoder = build_features('Bootcamp data.json', **MODEL_CONFIG)
+
+replaces the per-script preprocessing of XGBoost/CareConnectMLModel-main:
+the ANC column is coerced to numbers (median-filled), the label is derived
+with one vectorized comparison, categorical columns are one-hot encoded the
+way ``pd.get_dummies(drop_first=True)`` lays them out, and near-constant
+features are dropped like ``VarianceThreshold``. X is uint8 when every
+feature fits, float32 otherwise.
+
+The result is cached on disk as .npy files (memory-mapped on load) together
+with the fitted AncEncoder, under a key made from the source file's sha256 and
+the pipeline settings, so a re-run over unchanged data does not even parse
+the JSON. The encoder is plain JSON and encodes single records without
+pandas, which is how the serving side turns raw survey answers into the
+exact columns the model was trained on.
+
+For datasets that do not fit in memory, build_feature_chunks streams the
+source instead: a first pass fits the encoder from running counts (category
+levels, ANC histogram, column moments) and a second pass encodes the file
+chunk by chunk into .npy files, so memory is bounded by the chunk size.
+"""
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+from collections import Counter
+
+import numpy as np
+
+# Bump when the transform changes so old caches are not reused
+PIPELINE_VERSION = 1
+
+ANC_COLUMN = 'ANC'
+
+CATEGORICAL_COLUMNS = [' CurrAgeGroup', 'Distance to health', 'Freq. of watching TV',
+                       'Freq. of listening to radio', 'Freq. use internet', 'wealth index',
+                       'Education level', 'Place of Residence', 'Head sex', 'Religion',
+                       'Current marital_status']
+
+# XGBoost/CareConnectMLModel-main/model.py: one-hot, target ANC >= 4
+MODEL_CONFIG = dict(categorical=CATEGORICAL_COLUMNS, exclude=['Region'], label='complete',
+                    variance_threshold=0.01)
+
+# bootcamp_codes.py: raw codes, target ANC < 4. It took df.iloc[:, :-3] after
+# appending its 'Target Variable' column, so the label and the last two source
+# columns were dropped; the label is never a column here, hence exclude_last=2
+# for the same features. The one difference: ANC itself, which the label is
+# derived from, is always left out, where the old slice kept it as a feature.
+BOOTCAMP_CONFIG = dict(categorical=[], exclude_last=2, label='dropout', variance_threshold=None)
+
+
+def clean_anc(values, median=None):
+    """ANC visit counts as int64; non-numeric entries become the median."""
+    import pandas as pd
+
+    anc = pd.to_numeric(values, errors='coerce')
+    if median is None:
+        median = float(anc.median())
+    return anc.fillna(median).astype(np.int64).to_numpy(), median
+
+
+def anc_target(anc, label='dropout', min_visits=4):
+    """1 where fewer than ``min_visits`` ('dropout') or at least that many ('complete')."""
+    if label not in ('dropout', 'complete'):
+        raise ValueError(f"Unknown label {label!r}, expected 'dropout' or 'complete'")
+    anc = np.asarray(anc)
+    return ((anc < min_visits) if label == 'dropout' else (anc >= min_visits)).astype(np.uint8)
+
+
+class AncEncoder:
+    """
+    Fitted feature layout: each feature is either a passed-through numeric
+    column (``[column]``) or a one-hot indicator (``[column, level]``).
+    """
+
+    def __init__(self, features, anc_median, dtype='uint8'):
+        self.features = [tuple(f) for f in features]
+        self.anc_median = anc_median
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def feature_names(self):
+        # Same names as pd.get_dummies gives the indicator columns
+        return [f[0] if len(f) == 1 else f"{f[0]}_{f[1]}" for f in self.features]
+
+    @classmethod
+    def fit(cls, df, categorical=(), exclude=(), exclude_last=0, variance_threshold=None):
+        """Layout for ``df``: every column except ANC/``exclude``, one-hot where categorical."""
+        dropped = set(exclude) | {ANC_COLUMN}
+        if exclude_last:
+            dropped |= set(df.columns[-exclude_last:])
+        categorical = [c for c in categorical if c not in dropped]
+        # pd.get_dummies order: untouched columns first, then the indicators
+        features = [(c,) for c in df.columns if c not in dropped and c not in categorical]
+        for column in categorical:
+            levels = _sorted_levels(df[column].dropna().unique().tolist())
+            features.extend((column, _plain(level)) for level in levels[1:])  # drop_first
+
+        _, median = clean_anc(df[ANC_COLUMN])
+        encoder = cls(features, median, 'float32')
+        X = encoder._encode(df)
+        if variance_threshold is not None:
+            keep = X.var(axis=0) > variance_threshold
+            encoder.features = [f for f, k in zip(encoder.features, keep) if k]
+            X = X[:, keep]
+        if np.all((X >= 0) & (X <= 255) & (X == np.round(X))):
+            encoder.dtype = np.dtype(np.uint8)
+        return encoder
+
+    @classmethod
+    def fit_stream(cls, chunks, categorical=(), exclude=(), exclude_last=0, variance_threshold=None):
+        """
+        ``fit`` over an iterable of DataFrames, keeping only per-column counts
+        and moments in memory. Gives the same layout and ANC median as
+        ``fit`` on the concatenated frames.
+        """
+        import pandas as pd
+
+        passthrough = None
+        rows = 0
+        for df in chunks:
+            if passthrough is None:
+                dropped = set(exclude) | {ANC_COLUMN}
+                if exclude_last:
+                    dropped |= set(df.columns[-exclude_last:])
+                categorical = [c for c in categorical if c not in dropped]
+                passthrough = [c for c in df.columns if c not in dropped and c not in categorical]
+                levels = {c: Counter() for c in categorical}
+                moments = {c: np.zeros(2) for c in passthrough}
+                compact = dict.fromkeys(passthrough, True)
+                anc_counts = Counter()
+            rows += len(df)
+            for column in categorical:
+                for level, n in df[column].value_counts().items():
+                    levels[column][_plain(level)] += n
+            for column in passthrough:
+                values = pd.to_numeric(df[column], errors='coerce').to_numpy(np.float64)
+                moments[column] += (values.sum(), (values * values).sum())
+                compact[column] &= bool(np.all((values >= 0) & (values <= 255) & (values == np.round(values))))
+            anc = pd.to_numeric(df[ANC_COLUMN], errors='coerce')
+            anc_counts.update(anc.dropna().value_counts().to_dict())
+        if passthrough is None:
+            raise ValueError("No rows to fit the encoder on")
+
+        features = [(c,) for c in passthrough]
+        variances = [moments[c][1] / rows - (moments[c][0] / rows) ** 2 for c in passthrough]
+        for column in categorical:
+            for level in _sorted_levels(levels[column])[1:]:
+                p = levels[column][level] / rows
+                features.append((column, level))
+                variances.append(p * (1 - p))
+        if variance_threshold is not None:
+            # NaN variance (non-numeric column) is dropped, as in ``fit``
+            kept = [f for f, v in zip(features, variances) if v > variance_threshold]
+        else:
+            kept = features
+        dtype = 'uint8' if all(len(f) == 2 or compact[f[0]] for f in kept) else 'float32'
+        return cls(kept, _median(anc_counts), dtype)
+
+    def _encode(self, df):
+        import pandas as pd
+
+        X = np.zeros((len(df), len(self.features)), dtype=np.float32)
+        by_column = {}
+        for j, feature in enumerate(self.features):
+            by_column.setdefault(feature[0], []).append((j, feature))
+        for column, entries in by_column.items():
+            values = df[column] if column in df else pd.Series(np.nan, index=df.index)
+            passthrough = [j for j, f in entries if len(f) == 1]
+            if passthrough:
+                X[:, passthrough] = pd.to_numeric(values, errors='coerce').to_numpy(np.float32)[:, None]
+            indicators = [(j, f[1]) for j, f in entries if len(f) == 2]
+            if indicators:
+                # Category codes, then one comparison per kept level
+                levels = [level for _, level in indicators]
+                codes = pd.Categorical(values.map(_plain), categories=levels).codes
+                columns = [j for j, _ in indicators]
+                X[:, columns] = codes[:, None] == np.arange(len(levels))[None, :]
+        return X
+
+    def transform(self, df):
+        """Encoded matrix for a DataFrame with the training columns."""
+        return self._encode(df).astype(self.dtype)
+
+    def transform_records(self, records):
+        """
+        float32 matrix for a list of raw records (dicts), without pandas.
+        Unknown or missing categories encode as all zeros; a missing or
+        non-numeric passthrough value raises ValueError.
+        """
+        X = np.zeros((len(records), len(self.features)), dtype=np.float32)
+        for i, record in enumerate(records):
+            for j, feature in enumerate(self.features):
+                value = record.get(feature[0])
+                if len(feature) == 2:
+                    X[i, j] = _plain(value) == feature[1]
+                    continue
+                try:
+                    X[i, j] = float(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f"Field '{feature[0]}' must be a number")
+        return X
+
+    def to_dict(self):
+        return {'version': PIPELINE_VERSION, 'features': [list(f) for f in self.features],
+                'anc_median': self.anc_median, 'dtype': self.dtype.name}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['features'], data['anc_median'], data['dtype'])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def _sorted_levels(levels):
+    """Category levels in pd.get_dummies order: numbers, then strings when a column mixes them."""
+    try:
+        return sorted(levels)
+    except TypeError:
+        return sorted(levels, key=lambda v: (1, 0, v) if isinstance(v, str) else (0, v, ''))
+
+
+def _plain(value):
+    # JSON-safe level: numpy scalars to Python, whole floats to int, NaN to None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if value.is_integer():
+            return int(value)
+    return value
+
+
+def _median(counts):
+    # Median of a value histogram, averaging the middle pair like pandas
+    values = sorted(counts)
+    total = sum(counts.values())
+    if not total:
+        return float('nan')
+    wanted = [(total - 1) // 2, total // 2]
+    found, seen = [], 0
+    for value in values:
+        seen += counts[value]
+        while wanted and wanted[0] < seen:
+            found.append(value)
+            wanted.pop(0)
+    return float(sum(found) / 2)
+
+
+def read_chunks(source, chunk_size=50000):
+    """DataFrames of at most ``chunk_size`` records from a JSON array or NDJSON file."""
+    import pandas as pd
+
+    from score_file import chunks, detect_format, read_json_array, read_ndjson
+
+    with open(source) as f:
+        reader = read_ndjson if detect_format(source, None) == 'ndjson' else read_json_array
+        _, records = reader(f)
+        for chunk in chunks(records, chunk_size):
+            yield pd.DataFrame.from_records(chunk)
+
+
+def read_frame(source):
+    """The whole of a JSON array or NDJSON file as one DataFrame."""
+    import pandas as pd
+
+    from score_file import detect_format
+
+    return pd.read_json(source, lines=detect_format(source, None) == 'ndjson')
+
+
+def source_hash(path, settings):
+    """Key of the cached features: the source bytes plus the pipeline settings."""
+    digest = hashlib.sha256(json.dumps([PIPELINE_VERSION, settings], sort_keys=True).encode())
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def default_cache_dir(source):
+    return os.environ.get('MOMCARE_FEATURE_CACHE',
+                          os.path.join(os.path.dirname(os.path.abspath(source)), '.feature_cache'))
+
+
+def build_features(source, categorical=(), exclude=(), exclude_last=0, label='dropout',
+                   variance_threshold=None, cache_dir=None):
+    """
+    ``(X, y, encoder)`` for a JSON dataset, from the cache when the file and
+    settings are unchanged (X and y are then read-only memory maps).
+    """
+    settings = {'categorical': list(categorical), 'exclude': list(exclude),
+                'exclude_last': exclude_last, 'label': label, 'variance_threshold': variance_threshold}
+    cache_dir = cache_dir or default_cache_dir(source)
+    entry = os.path.join(cache_dir, source_hash(source, settings)[:24])
+    if os.path.exists(os.path.join(entry, 'encoder.json')):
+        return (np.load(os.path.join(entry, 'X.npy'), mmap_mode='r'),
+                np.load(os.path.join(entry, 'y.npy'), mmap_mode='r'),
+                AncEncoder.load(os.path.join(entry, 'encoder.json')))
+
+    df = read_frame(source)
+    encoder = AncEncoder.fit(df, categorical, exclude, exclude_last, variance_threshold)
+    X = encoder.transform(df)
+    anc, _ = clean_anc(df[ANC_COLUMN], encoder.anc_median)
+    y = anc_target(anc, label)
+
+    # Written to a scratch directory and renamed, so readers never see half an entry
+    os.makedirs(cache_dir, exist_ok=True)
+    scratch = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        np.save(os.path.join(scratch, 'X.npy'), X)
+        np.save(os.path.join(scratch, 'y.npy'), y)
+        encoder.save(os.path.join(scratch, 'encoder.json'))
+        os.replace(scratch, entry)
+    except OSError:
+        # Another run stored the same entry first
+        shutil.rmtree(scratch, ignore_errors=True)
+    return X, y, encoder
+
+
+def build_feature_chunks(source, chunk_size=50000, encoder=None, categorical=(), exclude=(),
+                         exclude_last=0, label='dropout', variance_threshold=None, cache_dir=None):
+    """
+    Stream ``source`` into encoded chunks on disk; returns ``(entry, manifest,
+    encoder)`` where ``entry`` holds ``chunk_<n>.X.npy``/``.y.npy`` and the
+    manifest lists them with the row and positive-label counts. Pass a saved
+    ``encoder`` to keep an existing category vocabulary and skip the fitting
+    pass. Cached like ``build_features``.
+    """
+    settings = {'categorical': list(categorical), 'exclude': list(exclude), 'exclude_last': exclude_last,
+                'label': label, 'variance_threshold': variance_threshold, 'chunk_size': chunk_size,
+                'encoder': encoder.to_dict() if encoder is not None else None}
+    cache_dir = cache_dir or default_cache_dir(source)
+    entry = os.path.join(cache_dir, 'chunks-' + source_hash(source, settings)[:24])
+    if os.path.exists(os.path.join(entry, 'manifest.json')):
+        with open(os.path.join(entry, 'manifest.json')) as f:
+            manifest = json.load(f)
+        return entry, manifest, AncEncoder.load(os.path.join(entry, 'encoder.json'))
+
+    if encoder is None:
+        encoder = AncEncoder.fit_stream(read_chunks(source, chunk_size), categorical, exclude,
+                                        exclude_last, variance_threshold)
+    os.makedirs(cache_dir, exist_ok=True)
+    scratch = tempfile.mkdtemp(dir=cache_dir)
+    manifest = {'chunks': [], 'rows': 0, 'positives': 0, 'features': encoder.feature_names}
+    try:
+        for n, df in enumerate(read_chunks(source, chunk_size)):
+            anc, _ = clean_anc(df[ANC_COLUMN], encoder.anc_median)
+            y = anc_target(anc, label)
+            name = f"chunk_{n:05d}"
+            np.save(os.path.join(scratch, name + '.X.npy'), encoder.transform(df))
+            np.save(os.path.join(scratch, name + '.y.npy'), y)
+            manifest['chunks'].append(name)
+            manifest['rows'] += len(y)
+            manifest['positives'] += int(y.sum())
+        encoder.save(os.path.join(scratch, 'encoder.json'))
+        with open(os.path.join(scratch, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(scratch, entry)
+    except OSError:
+        shutil.rmtree(scratch, ignore_errors=True)
+        if not os.path.exists(os.path.join(entry, 'manifest.json')):
+            raise
+    return entry, manifest, encoder
@@ -0,0 +1,218 @@
+"""
+ASGI serving mode: the /predict contract of model.py, answered in micro-batches.
+
+    uvicorn asgi_app:app --port 6000 [--workers N]
+
+Concurrent /predict requests are queued for up to MOMCARE_BATCH_MAX_WAIT_MS
+milliseconds (default 2) or until MOMCARE_BATCH_MAX_SIZE of them (default 64)
+are waiting, then scored together with one predict_many() call and answered
+individually. A request that arrives alone waits at most the max wait; 0
+disables the wait, so only requests that queued up while the previous batch
+was computing are batched together.
+
+Request parsing, validation, the prediction service (grid, rule reload) and
+/metrics are shared with model.py, so both servers give the same answers.
+The result cache is not: in the default compiled mode predict_many scores
+every row, a grid lookup being cheaper than a cache probe, so /predict here
+never reads or fills it (it does with MOMCARE_ENGINE=reference).
+benchmarks/asgi_batching.py compares this against gunicorn.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+from model import (InvalidRecord, count_error, drift, metrics, prediction_service, record_to_row,
+                   risk_result, shadow)
+from request_schema import loads
+
+MAX_BATCH = int(os.environ.get('MOMCARE_BATCH_MAX_SIZE', '64'))
+MAX_WAIT = float(os.environ.get('MOMCARE_BATCH_MAX_WAIT_MS', '2')) / 1000.0
+
+
+class MicroBatcher:
+    """
+    Collects rows submitted from concurrent requests and scores them with
+    ``score(rows)``, a list with one result per row, in batches of at most
+    ``max_batch``, waiting at most ``max_wait`` seconds for a batch to fill.
+    Runs on the event loop, so the scoring call itself blocks it for the
+    (sub-millisecond) batch compute.
+    """
+
+    def __init__(self, score, max_batch=64, max_wait=0.002):
+        if max_batch < 1:
+            raise ValueError("Max batch size must be at least 1")
+        self.score = score
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending = []
+        self._ready = None
+        self._full = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._ready = asyncio.Event()
+            self._full = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, row):
+        """What ``score`` returned for ``row``, once its batch has been scored."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((row, future))
+        self._ready.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            if len(self._pending) < self.max_batch and self.max_wait > 0:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            if not self._pending:
+                self._ready.clear()
+            if len(self._pending) < self.max_batch:
+                self._full.clear()
+            self._flush(batch)
+            # Let the handlers that arrived during the compute enqueue first
+            await asyncio.sleep(0)
+
+    def _flush(self, batch):
+        try:
+            values = self.score([row for row, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        metrics.count('momcare_batches_total')
+        metrics.count('momcare_batched_records_total', amount=len(batch))
+        for (_, future), value in zip(batch, values):
+            # A client that disconnected leaves a cancelled future behind
+            if not future.done():
+                future.set_result(value)
+
+
+def score_batch(rows):
+    """``(risk_value, model_version)`` for each row, all from one model version."""
+    state = prediction_service.state
+    return [(value, state.version) for value in prediction_service.predict_many(rows, state).tolist()]
+
+
+batcher = MicroBatcher(score_batch, MAX_BATCH, MAX_WAIT)
+
+JSON_HEADERS = [(b'content-type', b'application/json'), (b'access-control-allow-origin', b'*')]
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def respond(send, status, body, headers=JSON_HEADERS):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': headers + [(b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def is_json(content_type):
+    # Flask's rule for request.get_json()
+    mimetype = content_type.split(b';')[0].strip().lower()
+    return mimetype == b'application/json' or (
+        mimetype.startswith(b'application/') and mimetype.endswith(b'+json'))
+
+
+async def predict(scope, receive, send, started):
+    # Same status codes as the Flask /predict for unusable bodies and records
+    with metrics.phase('parse'):
+        body = await read_body(receive)
+        if not is_json(dict(scope['headers']).get(b'content-type', b'')):
+            count_error('invalid_json')
+            return await respond(send, 415, b'{"error": "Expected application/json"}')
+        try:
+            data = loads(body)
+        except ValueError:
+            count_error('invalid_json')
+            return await respond(send, 400, b'{"error": "Invalid JSON"}')
+
+    metrics.count('momcare_records_total', ('endpoint', 'predict'))
+    try:
+        with metrics.phase('bind'):
+            row = record_to_row(data)
+    except InvalidRecord as e:
+        count_error('invalid_input')
+        return await respond(send, 400, json.dumps({"error": str(e)}).encode())
+    status = 200
+    try:
+        risk_value, version = await batcher.submit(row)
+        result = dict(risk_result(risk_value), model_version=version)
+        headers = JSON_HEADERS + [(b'x-model-version', version.encode())]
+        if drift is not None:
+            drift.record(row)
+        if shadow is not None:
+            shadow.offer(row, data, result['risk_value'], version, time.perf_counter() - started)
+    except Exception as e:
+        count_error(type(e).__name__)
+        status, result, headers = 500, {"error": f"Error occurred: {str(e)}"}, JSON_HEADERS
+    with metrics.phase('serialize'):
+        body = json.dumps(result).encode()
+    await respond(send, status, body, headers)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            batcher.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await batcher.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    started = time.perf_counter()
+    path, method = scope['path'], scope['method']
+    if path == '/predict' and method == 'POST':
+        await predict(scope, receive, send, started)
+        seconds = time.perf_counter() - started
+        metrics.observe('momcare_request_seconds', ('endpoint', 'predict'), seconds)
+        if shadow is not None:
+            shadow.observe(seconds)
+    elif path == '/predict' and method == 'OPTIONS':
+        await respond(send, 204, b'', [(b'access-control-allow-origin', b'*'),
+                                      (b'access-control-allow-methods', b'POST, OPTIONS'),
+                                      (b'access-control-allow-headers', b'content-type')])
+    elif path == '/metrics' and method == 'GET':
+        await respond(send, 200, metrics.render().encode(),
+                      [(b'content-type', b'text/plain; version=0.0.4')])
+    elif path == '/debug' and method == 'GET':
+        await respond(send, 200, json.dumps({"python_version": sys.version}).encode())
+    else:
+        await respond(send, 404, b'{"error": "Not found"}')
@@ -0,0 +1,113 @@
+"""
+Load test: micro-batching ASGI server (asgi_app.py) against gunicorn.
+
+    python benchmarks/asgi_batching.py [--waits 0 1 2 5] [--max-batch 64]
+                                       [--gunicorn-threads 4] [--duration 10]
+
+Runs the same /predict load as benchmarks/thread_scaling.py (client processes
+with keep-alive connections, every answer checked) first against
+``gunicorn --threads N model:app`` and then against ``uvicorn asgi_app:app``
+once per max-wait setting, one worker each. The batch columns come from the
+server's own /metrics counters.
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from thread_scaling import ML_DIR, client_process, free_port, make_payloads
+
+
+def start(command, env, port):
+    server = subprocess.Popen(command, cwd=ML_DIR, env=dict(os.environ, **env),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/debug')
+            if conn.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{command[2]} did not start")
+
+
+def batch_counters(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request('GET', '/metrics')
+    text = conn.getresponse().read().decode()
+    counts = dict(re.findall(r'^(momcare_batch\w+) (\d+)$', text, re.M))
+    return int(counts.get('momcare_batches_total', 0)), int(counts.get('momcare_batched_records_total', 0))
+
+
+def drive(port, payloads, expected, args):
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(
+        target=client_process,
+        args=(port, payloads, expected, args.connections, args.duration, results))
+        for _ in range(args.clients)]
+    for c in clients:
+        c.start()
+    latencies, mismatches, errors = [], 0, 0
+    for _ in clients:
+        l, m, e = results.get()
+        latencies.extend(l)
+        mismatches += m
+        errors += e
+    for c in clients:
+        c.join()
+    return np.array(latencies) * 1000, mismatches, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ASGI micro-batching vs gunicorn load test for /predict")
+    parser.add_argument('--waits', type=float, nargs='+', default=[0, 1, 2, 5],
+                        help="MOMCARE_BATCH_MAX_WAIT_MS values to try")
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--gunicorn-threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--clients', type=int, default=4, help="client processes")
+    parser.add_argument('--connections', type=int, default=16, help="connections per client process")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # The server-side result cache would hide the compute being batched
+    env = {'MOMCARE_CACHE_SIZE': '0'}
+    servers = [(f"gunicorn gthread x{args.gunicorn_threads}", env,
+                [sys.executable, '-m', 'gunicorn', '-w', '1', '-k', 'gthread',
+                 '--threads', str(args.gunicorn_threads), '-b', '127.0.0.1:{port}', 'model:app'])]
+    for wait in args.waits:
+        servers.append((f"asgi wait={wait:g}ms", dict(env, MOMCARE_BATCH_MAX_WAIT_MS=str(wait),
+                                                      MOMCARE_BATCH_MAX_SIZE=str(args.max_batch)),
+                        [sys.executable, '-m', 'uvicorn', '--port', '{port}', '--log-level', 'warning',
+                         '--no-access-log', 'asgi_app:app']))
+
+    payloads, expected = make_payloads(2000, args.seed)
+    print(f"concurrency={args.clients * args.connections} duration={args.duration}s max_batch={args.max_batch}")
+    print(f"{'server':<22} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'avg batch':>9} "
+          f"{'mismatch':>8} {'errors':>6}")
+    for label, server_env, command in servers:
+        port = free_port()
+        server = start([part.format(port=port) for part in command], server_env, port)
+        try:
+            latencies, mismatches, errors = drive(port, payloads, expected, args)
+            batches, batched = batch_counters(port) if 'asgi' in label else (0, 0)
+        finally:
+            server.terminate()
+            server.wait()
+        p50, p99 = (np.percentile(latencies, [50, 99]) if latencies.size else (float('nan'),) * 2)
+        avg_batch = f"{batched / batches:9.1f}" if batches else f"{'-':>9}"
+        print(f"{label:<22} {latencies.size / args.duration:>9.1f} {p50:>8.2f} {p99:>8.2f} {avg_batch} "
+              f"{mismatches:>8} {errors:>6}")
+
+
+if __name__ == '__main__':
+    main()
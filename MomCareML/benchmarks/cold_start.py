@@ -0,0 +1,65 @@
+"""
+Startup benchmark: time from a fresh interpreter to the first /predict answer.
+
+    python benchmarks/cold_start.py [--runs 5] [--modes artifact source]
+
+Each run starts a new Python process with MOMCARE_STARTUP set to the mode
+under test, imports model.py and posts one /predict request through the Flask
+test client. Reported are the import time, the import-to-first-response time
+and the whole process wall time (interpreter start included), median of runs.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+import model
+imported = time.perf_counter()
+reply = model.app.test_client().post('/predict', json={
+    'CurrAgeGroup': 18, 'Place_of_Residence': 2, 'Education_level': 0, 'Wealth_index': 1,
+    'marital_status': 0, 'Distance_to_health': 3, 'Frequency_media_use': 0,
+    'Frequency_of_using_internet': 0, 'Antenatal_visits': 2, 'Postnatal_visits': 1})
+answered = time.perf_counter()
+assert 'predicted_risk' in reply.get_json(), reply.get_json()
+print(json.dumps({'import_s': imported - start, 'first_response_s': answered - start}))
+"""
+
+
+def measure(mode, runs):
+    """Median timings (seconds) of ``runs`` cold starts in ``mode``."""
+    env = dict(os.environ, MOMCARE_STARTUP=mode, PYTHONPATH=ML_DIR)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', CHILD], cwd=ML_DIR, env=env,
+                             capture_output=True, text=True, check=True)
+        wall = time.perf_counter() - start
+        timings = json.loads(out.stdout.strip().splitlines()[-1])
+        timings['process_s'] = wall
+        samples.append(timings)
+    return {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark for model.py")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--modes', nargs='+', default=['artifact', 'source'],
+                        choices=['artifact', 'source'])
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'import s':>9} {'first response s':>17} {'process s':>10}")
+    for mode in args.modes:
+        t = measure(mode, args.runs)
+        print(f"{mode:>8} {t['import_s']:>9.3f} {t['first_response_s']:>17.3f} {t['process_s']:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Dropout model latency: one row per call against one call per batch.
+
+    python benchmarks/dropout_batching.py [--model dropout_model.ubj] [--rows 1000]
+
+Scores the same ``--rows`` records three ways at the model level (a DMatrix
+per row, as the old predict_dropout() did after reloading the pickle;
+inplace_predict per row; inplace_predict over the whole batch) and two ways
+through the Flask app (one /predict/dropout request per record against one
+request carrying them all), and checks all five agree.
+
+Without an exported model (see bootcamp_codes.py) a synthetic booster of the
+same shape as the bootcamp one (190 trees, depth up to 19) is trained on
+random survey codes, so the timings are representative even without the data.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+# Raw survey columns used by bootcamp_codes.py
+SYNTHETIC_FEATURES = [' CurrAgeGroup', 'Region', 'Place of Residence', 'Education level', 'wealth index',
+                      'Current marital_status', 'Distance to health', 'Freq. of listening to radio',
+                      'Freq. of watching TV', 'Freq. use internet', 'Head sex', 'Religion']
+
+
+def synthetic_model(path, seed=0):
+    import xgboost as xgb
+
+    rng = np.random.default_rng(seed)
+    X = rng.integers(0, 8, size=(20000, len(SYNTHETIC_FEATURES))).astype(np.float32)
+    y = (X[:, 3] + X[:, 4] + rng.normal(0, 2, len(X)) < 7).astype(int)
+    params = {'objective': 'binary:logistic', 'max_depth': 19, 'eta': 0.1, 'subsample': 0.7,
+              'min_child_weight': 4, 'colsample_bytree': 0.9, 'tree_method': 'hist', 'seed': seed}
+    booster = xgb.train(params, xgb.DMatrix(X, y, feature_names=SYNTHETIC_FEATURES), num_boost_round=190)
+    booster.save_model(path)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-row vs batched dropout model latency")
+    parser.add_argument('--model', help="exported UBJSON model (default: MOMCARE_DROPOUT_MODEL, else synthetic)")
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    import xgboost as xgb
+
+    path = args.model or os.environ.get('MOMCARE_DROPOUT_MODEL')
+    if not path or not os.path.exists(path):
+        path = os.path.join(tempfile.mkdtemp(), 'dropout_model.ubj')
+        print("training a synthetic model of the bootcamp shape ...")
+        synthetic_model(path, args.seed)
+    os.environ['MOMCARE_DROPOUT_MODEL'] = path
+
+    from dropout_model import DropoutModel
+
+    load_s, model = timed(lambda: DropoutModel.load(path))
+    rng = np.random.default_rng(args.seed + 1)
+    X = rng.integers(0, 8, size=(args.rows, len(model.feature_names))).astype(np.float32)
+    records = [dict(zip(model.feature_names, row)) for row in X.tolist()]
+
+    model.predict_proba(X[:10])  # warm up
+    runs = {
+        'DMatrix per row': lambda: np.concatenate(
+            [model.booster.predict(xgb.DMatrix(X[i:i + 1], feature_names=model.feature_names))
+             for i in range(len(X))]),
+        'inplace per row': lambda: np.concatenate([model.predict_proba(X[i:i + 1]) for i in range(len(X))]),
+        'inplace batch': lambda: model.predict_proba(X),
+    }
+
+    from model import app
+
+    client = app.test_client()
+    runs['HTTP per record'] = lambda: np.array(
+        [client.post('/predict/dropout', json=[r]).get_json()['results'][0]['dropout_probability']
+         for r in records])
+    runs['HTTP one batch'] = lambda: np.array(
+        [r['dropout_probability'] for r in client.post('/predict/dropout', json=records).get_json()['results']])
+
+    print(f"model {path}: {len(model.feature_names)} features, loaded in {load_s * 1000:.1f} ms")
+    print(f"{args.rows} rows")
+    print(f"{'path':<16} {'total ms':>9} {'us/row':>8} {'rows/s':>10}")
+    reference = None
+    for name, run in runs.items():
+        seconds, values = timed(run)
+        if reference is None:
+            reference = values
+        elif not np.allclose(values, reference, atol=1e-6):
+            print(f"{name}: results differ from the DMatrix path", file=sys.stderr)
+            sys.exit(1)
+        print(f"{name:<16} {seconds * 1000:>9.1f} {seconds / args.rows * 1e6:>8.1f} {args.rows / seconds:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Memory and throughput: preforked workers sharing the model against workers
+that each load their own.
+
+    python benchmarks/prefork.py [--workers 4] [--threads 4] [--duration 10]
+                                 [--rounds 1] [--model dropout_model.ubj]
+
+Starts ``gunicorn model:app -w N`` (every worker imports and loads the models)
+and then ``gunicorn -c prefork.py -w N`` (loaded once in the master, see
+prefork.py), drives each with the /predict load of
+benchmarks/thread_scaling.py, and afterwards reads every worker's memory from
+/proc/<pid>/smaps_rollup (the mean over the workers is reported):
+
+    RSS   resident pages, shared ones counted in full in every process
+    PSS   resident pages, shared ones split between the processes sharing them
+    USS   pages private to the process, what another worker would add
+
+Totals are PSS summed over the master and all workers, i.e. what the server
+costs the machine. The dropout model is loaded in both layouts (--model, else
+MOMCARE_DROPOUT_MODEL, else a synthetic booster as in dropout_batching.py), so
+xgboost counts towards every worker. On a small machine req/s drifts by a
+few percent from run to run; --rounds N alternates the layouts N times so
+that drift does not favour either one. Linux only.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from asgi_batching import drive, start
+from dropout_batching import synthetic_model
+from thread_scaling import ML_DIR, free_port, make_payloads
+
+MB = 1024 * 1024
+
+
+def worker_pids(master):
+    with open(f'/proc/{master}/task/{master}/children') as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def memory(pid):
+    """``(rss, pss, uss)`` of a process, in bytes."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return fields['Rss'], fields['Pss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+
+def wait_for_workers(master, count, timeout=120):
+    # The first answer only means one worker is up
+    deadline = time.time() + timeout
+    while len(worker_pids(master)) < count and time.time() < deadline:
+        time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prefork vs per-worker model loading: memory and throughput")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--model', help="exported UBJSON dropout model (default: MOMCARE_DROPOUT_MODEL, else synthetic)")
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--rounds', type=int, default=1, help="times to run each layout, alternating")
+    parser.add_argument('--clients', type=int, default=4, help="client processes")
+    parser.add_argument('--connections', type=int, default=4, help="connections per client process")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model = args.model or os.environ.get('MOMCARE_DROPOUT_MODEL')
+        if not model:
+            model = os.path.join(tmp, 'dropout_model.ubj')
+            synthetic_model(model, args.seed)
+        env = {'MOMCARE_DROPOUT_MODEL': model}
+        payloads, expected = make_payloads(2000, args.seed)
+
+        common = ['-w', str(args.workers), '-k', 'gthread', '--threads', str(args.threads)]
+        layouts = [
+            ('per-worker', [sys.executable, '-m', 'gunicorn', *common, 'model:app']),
+            ('prefork', [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ML_DIR, 'prefork.py'), *common]),
+        ]
+        print(f"workers={args.workers} threads={args.threads} "
+              f"concurrency={args.clients * args.connections} duration={args.duration}s")
+        print(f"{'layout':>10} {'start s':>8} {'req/s':>8} {'p50 ms':>7} {'p99 ms':>7} "
+              f"{'RSS MB':>7} {'PSS MB':>7} {'USS MB':>7} {'total MB':>8} {'mismatch':>8} {'errors':>6}")
+        for name, command in layouts * args.rounds:
+            port = free_port()
+            began = time.perf_counter()
+            server = start(command + ['-b', f'127.0.0.1:{port}'], env, port)
+            started = time.perf_counter() - began
+            try:
+                wait_for_workers(server.pid, args.workers)
+                latencies, mismatches, errors = drive(port, payloads, expected, args)
+                workers = [memory(pid) for pid in worker_pids(server.pid)]
+                total = memory(server.pid)[1] + sum(pss for _, pss, _ in workers)
+            finally:
+                server.terminate()
+                server.wait()
+
+            rss, pss, uss = (np.mean(column) / MB for column in zip(*workers))
+            p50, p99 = np.percentile(latencies, [50, 99]) if latencies.size else (float('nan'),) * 2
+            print(f"{name:>10} {started:>8.2f} {latencies.size / args.duration:>8.1f} {p50:>7.2f} {p99:>7.2f} "
+                  f"{rss:>7.1f} {pss:>7.1f} {uss:>7.1f} {total / MB:>8.1f} {mismatches:>8} {errors:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Cost of decoding and validating request bodies, against the inference they guard.
+
+    python benchmarks/request_validation.py [--sizes 1 100 10000] [--invalid 0.01] [--repeat 20]
+
+For request bodies of each size (random in-universe records, an --invalid
+share of them broken in one field) times, per request:
+
+    decode json / orjson   json.loads and orjson.loads of the body bytes
+    bind (legacy)          the old per-record loop: float() and isfinite, no range check
+    bind row()             RequestSchema.row per record (the /predict path)
+    bind rows()            RequestSchema.rows, the columnar batch check
+    compute                PredictionService.predict_many over the valid rows
+
+Reported are medians of --repeat runs, in microseconds.
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+from model_artifact import FEATURES, load_compiled_risk  # noqa: E402
+from prediction_service import PredictionService  # noqa: E402
+from request_schema import InvalidRecord, RequestSchema, orjson  # noqa: E402
+
+BROKEN = [None, 'n/a', True, -1, 99, {}]
+
+
+def legacy_row(record):
+    # record_to_row before the schema: presence and numeric checks only
+    if not isinstance(record, dict):
+        raise InvalidRecord("Record must be a JSON object")
+    row = []
+    for name in FEATURES:
+        if name not in record:
+            raise InvalidRecord(f"Missing field '{name}'")
+        try:
+            value = float(record[name])
+        except (TypeError, ValueError):
+            raise InvalidRecord(f"Field '{name}' must be a number")
+        if not math.isfinite(value):
+            raise InvalidRecord(f"Field '{name}' must be a finite number")
+        row.append(value)
+    return row
+
+
+def per_record(bind, records):
+    rows = []
+    for record in records:
+        try:
+            rows.append(bind(record))
+        except InvalidRecord:
+            pass
+    return rows
+
+
+def make_records(compiled, size, invalid, rng):
+    X = rng.integers(compiled.lower.astype(int), compiled.upper.astype(int) + 1, (size, len(FEATURES)))
+    records = [dict(zip(FEATURES, row)) for row in X.tolist()]
+    for i in np.flatnonzero(rng.random(size) < invalid).tolist():
+        records[i][FEATURES[rng.integers(len(FEATURES))]] = BROKEN[rng.integers(len(BROKEN))]
+    return records
+
+
+def median_us(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Request decoding and validation overhead")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 10000])
+    parser.add_argument('--invalid', type=float, default=0.01, help="share of records with a bad field")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    compiled = load_compiled_risk()
+    schema = RequestSchema.for_system(compiled)
+    service = PredictionService(compiled)
+    rng = np.random.default_rng(args.seed)
+
+    columns = ['decode json', 'decode orjson', 'bind (legacy)', 'bind row()', 'bind rows()', 'compute']
+    print(f"{'records':>8} " + ' '.join(f"{c:>14}" for c in columns) + "   (us per request)")
+    for size in args.sizes:
+        records = make_records(compiled, size, args.invalid, rng)
+        body = json.dumps(records).encode()
+        rows, _, _ = schema.rows(records)
+        timings = [
+            median_us(lambda: json.loads(body), args.repeat),
+            median_us(lambda: orjson.loads(body), args.repeat) if orjson else math.nan,
+            median_us(lambda: per_record(legacy_row, records), args.repeat),
+            median_us(lambda: per_record(schema.row, records), args.repeat),
+            median_us(lambda: schema.rows(records), args.repeat),
+            median_us(lambda: service.predict_many(rows), args.repeat),
+        ]
+        print(f"{size:>8} " + ' '.join(f"{t:>14.1f}" for t in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Benchmark suite for the risk model, with a JSON report and regression check.
+
+    python benchmarks/suite.py [-o results.json] [--baseline baseline.json]
+                               [--threshold 0.15] [--only batch cache] [--quick]
+
+Cases (inputs are drawn from a fixed seed so runs are comparable):
+
+    flask_predict      one record through POST /predict (Flask test client)
+    compute_reference  one record through the skfuzzy simulation's compute()
+    compute_compiled   one record through CompiledFuzzySystem.compute()
+    batch_<n>          predict_many() over n records (grid + compiled engine)
+    cache_hit          predict_one() for a row already in the result cache
+    cache_miss         predict_one() for a row not in the cache
+    cold_start         fresh interpreter to first /predict answer
+
+Every case reports the median and p95 seconds per operation; batch cases also
+report rows/sec. With --baseline, each median is compared with the stored one
+and the script exits 1 if any case is slower by more than --threshold
+(default 15%). Save a baseline by writing a report with -o on a known-good
+build, on the same machine.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+# The app's own cache would turn the Flask case into a cache benchmark
+os.environ.setdefault('MOMCARE_CACHE_SIZE', '0')
+
+BATCH_SIZES = (1, 10, 100, 1000, 10000)
+
+
+def sample_rows(compiled, count, seed=0):
+    """Half integer survey codes, half fractional values, within the universes."""
+    rng = np.random.default_rng(seed)
+    lower, upper = compiled.lower, compiled.upper
+    return np.vstack([rng.integers(lower, upper + 1, size=(count // 2, lower.size)),
+                      rng.uniform(lower, upper, size=(count - count // 2, lower.size))])
+
+
+def per_call(fn, args, warmup=20):
+    """Time ``fn(arg)`` once per argument; returns the list of seconds."""
+    for arg in args[:warmup]:
+        fn(arg)
+    samples = []
+    for arg in args:
+        start = time.perf_counter()
+        fn(arg)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples, rows=1):
+    median = statistics.median(samples)
+    return {
+        'median_s': median,
+        'p95_s': float(np.percentile(samples, 95)),
+        'runs': len(samples),
+        'rows_per_s': rows / median if median else None,
+    }
+
+
+def bench_flask(rows, quick):
+    from model import FEATURES, app
+
+    client = app.test_client()
+    bodies = [dict(zip(FEATURES, row)) for row in rows[:200 if quick else 2000].tolist()]
+    return summarize(per_call(lambda body: client.post('/predict', json=body), bodies))
+
+
+def bench_reference(rows, quick):
+    try:
+        from skfuzzy import control as ctrl
+    except ImportError:
+        return None
+    from model_artifact import FEATURES
+    from risk_rules import risk_ctrl
+
+    simulation = ctrl.ControlSystemSimulation(risk_ctrl)
+
+    def compute(row):
+        for name, value in zip(FEATURES, row):
+            simulation.input[name] = value
+        try:
+            simulation.compute()
+        except ValueError:
+            pass
+
+    return summarize(per_call(compute, rows[:50 if quick else 300].tolist(), warmup=5))
+
+
+def bench_compiled(compiled, rows, quick):
+    return summarize(per_call(lambda row: compiled.compute([row]), rows[:500 if quick else 5000].tolist()))
+
+
+def bench_batches(service, rows, quick):
+    results = {}
+    for size in BATCH_SIZES:
+        batch = rows[:size]
+        repeats = max(3, min(200, 20000 // size)) if not quick else 3
+        samples = per_call(service.predict_many, [batch] * repeats, warmup=1)
+        results[f'batch_{size}'] = summarize(samples, rows=size)
+    return results
+
+
+def bench_cache(compiled, grid, rows, quick):
+    from prediction_service import PredictionService
+    from result_cache import ResultCache
+
+    count = 500 if quick else 5000
+    service = PredictionService(compiled, grid=grid, cache_factory=lambda _: ResultCache(2 * count + 100))
+    # Fractional rows miss the grid too, so a miss is a full engine evaluation
+    fresh = rows[len(rows) // 2:][:count].tolist()
+    hit_row = fresh[0]
+    return {
+        'cache_miss': summarize(per_call(service.predict_one, fresh, warmup=0)),
+        'cache_hit': summarize(per_call(service.predict_one, [hit_row] * count)),
+    }
+
+
+def bench_cold_start(quick):
+    from benchmarks.cold_start import measure
+
+    runs = 3 if quick else 5
+    timings = measure('artifact', runs)
+    return {'median_s': timings['first_response_s'], 'p95_s': None, 'runs': runs,
+            'rows_per_s': None, 'import_s': timings['import_s'], 'process_s': timings['process_s']}
+
+
+def run(only, quick):
+    from fuzzy_grid import load_grid
+    from model_artifact import load_compiled_risk
+    from prediction_service import PredictionService
+
+    compiled = load_compiled_risk()
+    grid = load_grid(compiled)
+    rows = sample_rows(compiled, 20000)
+
+    def wanted(name):
+        # ``name`` is a case or a group of cases (batch, cache)
+        return not only or any(name.startswith(p) or p.startswith(name) for p in only)
+
+    results = {}
+    if wanted('flask_predict'):
+        results['flask_predict'] = bench_flask(rows, quick)
+    if wanted('compute_reference'):
+        reference = bench_reference(rows, quick)
+        if reference is None:
+            print("skipping compute_reference: scikit-fuzzy is not installed", file=sys.stderr)
+        else:
+            results['compute_reference'] = reference
+    if wanted('compute_compiled'):
+        results['compute_compiled'] = bench_compiled(compiled, rows, quick)
+    if wanted('batch'):
+        results.update(bench_batches(PredictionService(compiled, grid=grid), rows, quick))
+    if wanted('cache'):
+        results.update(bench_cache(compiled, grid, rows, quick))
+    if wanted('cold_start'):
+        results['cold_start'] = bench_cold_start(quick)
+    if only:
+        results = {name: r for name, r in results.items() if any(name.startswith(p) for p in only)}
+    return {'meta': environment(compiled), 'results': results}
+
+
+def environment(compiled):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ML_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'model': compiled.fingerprint()[:12],
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor() or None,
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(report, baseline, threshold):
+    """Rows of (case, baseline, current, change, regressed) for shared cases."""
+    rows = []
+    for name, current in report['results'].items():
+        before = baseline['results'].get(name)
+        if not before or not before.get('median_s') or current.get('median_s') is None:
+            continue
+        change = current['median_s'] / before['median_s'] - 1
+        rows.append((name, before['median_s'], current['median_s'], change, change > threshold))
+    return rows
+
+
+def print_report(report):
+    print(f"{'case':<18} {'median':>11} {'p95':>11} {'rows/s':>11}")
+    for name, r in report['results'].items():
+        p95 = f"{r['p95_s'] * 1e6:9.1f}us" if r.get('p95_s') is not None else f"{'-':>11}"
+        rate = f"{r['rows_per_s']:11.0f}" if r.get('rows_per_s') else f"{'-':>11}"
+        print(f"{name:<18} {r['median_s'] * 1e6:9.1f}us {p95} {rate}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Risk model benchmark suite")
+    parser.add_argument('-o', '--output', help="write the JSON report here")
+    parser.add_argument('--baseline', help="JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="allowed slowdown of a median before it counts as a regression")
+    parser.add_argument('--only', nargs='+', help="run only cases starting with these names")
+    parser.add_argument('--quick', action='store_true', help="fewer iterations, for a smoke run")
+    args = parser.parse_args()
+
+    report = run(args.only, args.quick)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(report, baseline, args.threshold)
+        print(f"\nagainst {args.baseline} (commit {baseline['meta'].get('commit')}, "
+              f"threshold +{args.threshold:.0%})")
+        for name, before, after, change, regressed in rows:
+            flag = "REGRESSION" if regressed else ""
+            print(f"{name:<18} {before * 1e6:9.1f}us -> {after * 1e6:9.1f}us {change:+7.1%} {flag}".rstrip())
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Load test: /predict throughput as gunicorn worker threads are added.
+
+    python benchmarks/thread_scaling.py [--threads 1 2 4 8] [--workers 1]
+                                        [--engine compiled] [--duration 10]
+
+For each thread count a ``gunicorn --threads N model:app`` server is started on
+a local port and driven by client processes holding keep-alive connections.
+Every request carries different inputs and its response is checked against the
+value computed in-process, so any cross-talk between concurrent requests shows
+up as a mismatch rather than as a silently wrong answer.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, workers, threads, engine):
+    env = dict(os.environ, MOMCARE_ENGINE=engine, MOMCARE_POOL_SIZE=str(threads))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--chdir', ML_DIR, '-w', str(workers),
+         '-k', 'gthread', '--threads', str(threads), '-b', f'127.0.0.1:{port}', 'model:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/debug')
+            if conn.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def client_process(port, payloads, expected, connections, duration, results):
+    # One process per CPU's worth of clients so the load generator is not
+    # itself held back by a single GIL.
+    latencies, mismatches, errors = [], [0], [0]
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def run(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        i = offset
+        local = []
+        while time.perf_counter() < stop:
+            body = payloads[i % len(payloads)]
+            start = time.perf_counter()
+            try:
+                conn.request('POST', '/predict', body, {'Content-Type': 'application/json'})
+                reply = json.loads(conn.getresponse().read())
+            except (OSError, http.client.HTTPException, ValueError):
+                with lock:
+                    errors[0] += 1
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            local.append(time.perf_counter() - start)
+            want = expected[i % len(payloads)]
+            got = reply.get('risk_value')
+            if (want is None) != (got is None) or (want is not None and abs(got - want) > 1e-9):
+                with lock:
+                    mismatches[0] += 1
+            i += 7
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(connections)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    results.put((latencies, mismatches[0], errors[0]))
+
+
+def make_payloads(count, seed):
+    from model import FEATURES, compiled_risk
+
+    rng = np.random.default_rng(seed)
+    lower, upper = compiled_risk.lower, compiled_risk.upper
+    # Half on the integer grid, half fractional so both lookup paths are hit
+    X = np.vstack([rng.integers(lower, upper + 1, size=(count // 2, lower.size)),
+                   rng.uniform(lower, upper, size=(count - count // 2, lower.size))])
+    values = compiled_risk.compute(X)
+    payloads = [json.dumps(dict(zip(FEATURES, row))) for row in X.tolist()]
+    expected = [None if np.isnan(v) else float(v) for v in values]
+    return payloads, expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gunicorn thread scaling load test for /predict")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--engine', choices=['compiled', 'reference'], default='compiled')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--clients', type=int, default=4, help="client processes")
+    parser.add_argument('--connections', type=int, default=4, help="connections per client process")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    payloads, expected = make_payloads(2000, args.seed)
+    print(f"engine={args.engine} workers={args.workers} "
+          f"concurrency={args.clients * args.connections} duration={args.duration}s")
+    print(f"{'threads':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'mismatch':>8} {'errors':>6}")
+
+    for threads in args.threads:
+        port = free_port()
+        server = start_server(port, args.workers, threads, args.engine)
+        try:
+            results = multiprocessing.Queue()
+            clients = [multiprocessing.Process(
+                target=client_process,
+                args=(port, payloads, expected, args.connections, args.duration, results))
+                for _ in range(args.clients)]
+            for c in clients:
+                c.start()
+            latencies, mismatches, errors = [], 0, 0
+            for _ in clients:
+                l, m, e = results.get()
+                latencies.extend(l)
+                mismatches += m
+                errors += e
+            for c in clients:
+                c.join()
+        finally:
+            server.terminate()
+            server.wait()
+
+        latencies = np.array(latencies) * 1000
+        p50, p99 = (np.percentile(latencies, [50, 99]) if latencies.size else (float('nan'),) * 2)
+        print(f"{threads:>7} {latencies.size / args.duration:>9.1f} {p50:>8.2f} {p99:>8.2f} "
+              f"{mismatches:>8} {errors:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Compare the compiled fuzzy engine with the skfuzzy simulation it is built from.
+
+    python check_engine.py [--samples N] [--tolerance T] [--seed S]
+
+Scores random integer survey codes, random fractional values (including some
+outside the universes, which both engines clip) and every universe corner
+through both engines. Exits non-zero if any risk value differs by more than
+the tolerance or if only one engine finds that no rule fired.
+"""
+import argparse
+import sys
+
+import numpy as np
+from skfuzzy import control as ctrl
+
+from model import FEATURES, compiled_risk
+from risk_rules import risk_ctrl
+
+
+def sample_inputs(engine, samples, seed):
+    rng = np.random.default_rng(seed)
+    lower, upper = engine.lower, engine.upper
+    integers = rng.integers(lower, upper + 1, size=(samples, lower.size))
+    fractions = rng.uniform(lower - 1, upper + 1, size=(samples, lower.size))
+    corners = np.array([lower, upper])
+    return np.vstack([integers, fractions, corners]).astype(np.float64)
+
+
+def reference_values(X):
+    simulation = ctrl.ControlSystemSimulation(risk_ctrl)
+    values = np.empty(len(X))
+    for n, row in enumerate(X):
+        for name, value in zip(FEATURES, row):
+            simulation.input[name] = value
+        try:
+            simulation.compute()
+            values[n] = simulation.output['Risk']
+        except ValueError:
+            # skfuzzy raises when nothing fired; the compiled engine returns NaN
+            values[n] = np.nan
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--tolerance', type=float, default=1e-9)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    X = sample_inputs(compiled_risk, args.samples, args.seed)
+    expected = reference_values(X)
+    actual = compiled_risk.compute(X)
+
+    unfired = np.isnan(expected) != np.isnan(actual)
+    both = ~np.isnan(expected) & ~np.isnan(actual)
+    deviation = np.abs(expected[both] - actual[both]).max(initial=0.0)
+
+    print(f"Compared {len(X)} inputs: max deviation {deviation:.3e}, "
+          f"{int(np.isnan(expected).sum())} with no rule fired, "
+          f"{int(unfired.sum())} fired in only one engine")
+    if deviation > args.tolerance or unfired.any():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
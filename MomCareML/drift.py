@@ -0,0 +1,340 @@
+"""
+Drift of live /predict inputs away from the survey data the models were fit to.
+
+The baseline is a profile of the survey export, one histogram per model input
+over that input's universe points, built once with:
+
+    python drift.py "Bootcamp data.json" [--out drift_baseline.json] [--map COLUMN=FEATURE ...]
+
+Survey columns are matched to the inputs as score_file.py matches them.
+Values are counted at the nearest universe point, plus one bin below and one
+above the universe for codes the rule base does not cover (the engine clips
+them). ``python drift.py live.ndjson --compare`` scores a file against the
+saved baseline instead.
+
+DriftMonitor counts the inputs of every answered /predict, /predict/batch and
+/predict/incremental record. A request only copies its row into a fixed
+buffer; a background thread folds the buffer into the counts every
+MOMCARE_DRIFT_INTERVAL seconds (default 10) and updates the /metrics gauges.
+Two sets of counts are kept, both fixed-size: since the worker started, and
+over the last MOMCARE_DRIFT_WINDOW records (default 10000, a ring buffer of
+bin codes). Rows arriving faster than the fold keeps up with (more than
+PENDING between two folds) are dropped and counted.
+
+GET /stats/drift folds the pending rows and compares both sets of counts with
+the baseline (MOMCARE_DRIFT_BASELINE, default drift_baseline.json next to
+this file): PSI per input (< 0.1 stable, < 0.25 moderate, significant above)
+and the two-sample Kolmogorov-Smirnov statistic with its 5% critical value.
+Counts are per worker, like /metrics. MOMCARE_DRIFT=0 turns the monitor off.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from model_artifact import FEATURES
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DRIFT = os.environ.get('MOMCARE_DRIFT', '1') != '0'
+DRIFT_BASELINE = os.environ.get('MOMCARE_DRIFT_BASELINE', os.path.join(BASE_DIR, 'drift_baseline.json'))
+DRIFT_WINDOW = int(os.environ.get('MOMCARE_DRIFT_WINDOW', '10000'))
+DRIFT_INTERVAL = float(os.environ.get('MOMCARE_DRIFT_INTERVAL', '10'))
+
+# Rows held between two folds before new ones are dropped
+PENDING = 65536
+
+# Fewer live rows than this are reported, but not given a drift status
+MIN_ROWS = 100
+
+# Floor for bin shares in PSI, so empty bins do not give an infinite index
+PSI_EPSILON = 1e-4
+PSI_MODERATE = 0.1
+PSI_SIGNIFICANT = 0.25
+
+# c(alpha) of the two-sample KS test at alpha = 0.05
+KS_ALPHA_COEFFICIENT = 1.358
+
+
+class InputBins:
+    """
+    Bin layout of all inputs: per input, its points plus a bin below and one
+    above, laid end to end so one bincount covers every input.
+    """
+
+    def __init__(self, values):
+        self.values = [np.asarray(v, dtype=np.float64) for v in values]
+        self._midpoints = [(v[1:] + v[:-1]) / 2 for v in self.values]
+        self.sizes = np.array([v.size + 2 for v in self.values])
+        self.offsets = np.concatenate([[0], np.cumsum(self.sizes)[:-1]])
+        self.size = int(self.sizes.sum())
+
+    def codes(self, X):
+        """Flat bin index of every value of ``X`` (rows in FEATURES order)."""
+        codes = np.empty(X.shape, dtype=np.uint16)
+        for i, (v, mid) in enumerate(zip(self.values, self._midpoints)):
+            x = X[:, i]
+            column = np.searchsorted(mid, x) + 1
+            column[x < v[0]] = 0
+            column[x > v[-1]] = v.size + 1
+            codes[:, i] = column + self.offsets[i]
+        return codes
+
+    def count(self, codes):
+        return np.bincount(codes.ravel(), minlength=self.size)
+
+    def split(self, counts):
+        """Per-input slices of flat ``counts``."""
+        return [counts[o:o + s] for o, s in zip(self.offsets, self.sizes)]
+
+
+def compare(live, baseline):
+    """PSI and KS of one input's live bin counts against its baseline counts."""
+    n, m = live.sum(), baseline.sum()
+    result = {'rows': int(n), 'out_of_range': int(live[0] + live[-1])}
+    if n == 0 or m == 0:
+        return dict(result, psi=None, ks=None, ks_critical=None, status='no_data')
+    p = np.maximum(live / n, PSI_EPSILON)
+    q = np.maximum(baseline / m, PSI_EPSILON)
+    psi = float(((p - q) * np.log(p / q)).sum())
+    ks = float(np.abs(np.cumsum(live) / n - np.cumsum(baseline) / m).max())
+    critical = KS_ALPHA_COEFFICIENT * math.sqrt((n + m) / (n * m))
+    if n < MIN_ROWS:
+        status = 'insufficient_data'
+    elif psi >= PSI_SIGNIFICANT:
+        status = 'significant'
+    elif psi >= PSI_MODERATE:
+        status = 'moderate'
+    else:
+        status = 'stable'
+    return dict(result, psi=psi, ks=ks, ks_critical=critical, ks_exceeded=ks > critical, status=status)
+
+
+def load_baseline(path=DRIFT_BASELINE):
+    with open(path) as f:
+        return json.load(f)
+
+
+class DriftMonitor:
+    """
+    Input histograms of live traffic, compared with a baseline profile.
+
+    ``bins`` holds each input's points (FEATURES order); with a baseline they
+    are the baseline's, so both histograms line up.
+    """
+
+    def __init__(self, bins, baseline=None, window=DRIFT_WINDOW, interval=DRIFT_INTERVAL,
+                 metrics=None, pending=PENDING):
+        self.bins = InputBins(bins)
+        self.baseline = baseline
+        self.metrics = metrics
+        self.interval = interval
+        self._baseline_counts = None
+        if baseline is not None:
+            self._baseline_counts = self.bins.split(np.concatenate(
+                [baseline['inputs'][name]['counts'] for name in FEATURES]))
+        self.total = np.zeros(self.bins.size, dtype=np.int64)
+        self.window = np.zeros(self.bins.size, dtype=np.int64)
+        self._ring = np.zeros((window, len(FEATURES)), dtype=np.uint16)
+        self._position = self._filled = 0
+        self.dropped = 0
+        # Rows are copied into one of two preallocated buffers, swapped by
+        # each fold, so pending rows are neither Python objects the garbage
+        # collector has to walk nor unbounded
+        self._buffer = np.empty((pending, len(FEATURES)), dtype=np.float32)
+        self._spare = np.empty_like(self._buffer)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._fold_lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+
+    def record(self, row):
+        """One answered input row; only appended here, counted by the next fold."""
+        self._ensure_started()
+        with self._lock:
+            if self._count < len(self._buffer):
+                self._buffer[self._count] = row
+                self._count += 1
+            else:
+                self.dropped += 1
+
+    def record_many(self, rows):
+        self._ensure_started()
+        with self._lock:
+            taken = min(len(rows), len(self._buffer) - self._count)
+            if taken:
+                self._buffer[self._count:self._count + taken] = rows[:taken]
+                self._count += taken
+            self.dropped += len(rows) - taken
+
+    def _ensure_started(self):
+        # Started on first use, and again in a forked worker (threads do not survive fork)
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='drift-monitor', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.report()
+
+    def fold(self):
+        """Move the pending rows into the total and window counts."""
+        with self._fold_lock:
+            with self._lock:
+                pending, count = self._buffer, self._count
+                self._buffer, self._spare, self._count = self._spare, pending, 0
+            if not count:
+                return
+            codes = self.bins.codes(pending[:count])
+            self.total += self.bins.count(codes)
+
+            size = len(self._ring)
+            if len(codes) >= size:
+                self._ring[:] = codes[-size:]
+                self._position, self._filled = 0, size
+                self.window = self.bins.count(self._ring)
+                return
+            slots = (self._position + np.arange(len(codes))) % size
+            # Slots past the filled part of a ring that has not wrapped yet are empty
+            evicted = self._ring[slots[slots < self._filled]]
+            self.window -= self.bins.count(evicted)
+            self._ring[slots] = codes
+            self.window += self.bins.count(codes)
+            self._position = (self._position + len(codes)) % size
+            self._filled = min(size, self._filled + len(codes))
+
+    def report(self, histograms=False):
+        """Fold, then compare the window and total counts with the baseline."""
+        self.fold()
+        with self._fold_lock:
+            views = (('window', self.window.copy()), ('total', self.total.copy()))
+        result = {'baseline': None, 'window_size': len(self._ring), 'dropped': self.dropped}
+        if self.baseline is not None:
+            result['baseline'] = {'source': self.baseline.get('source'), 'rows': self.baseline.get('rows')}
+        for view, counts in views:
+            inputs = {}
+            for n, (name, live) in enumerate(zip(FEATURES, self.bins.split(counts))):
+                if self._baseline_counts is None:
+                    inputs[name] = {'rows': int(live.sum()), 'out_of_range': int(live[0] + live[-1])}
+                else:
+                    inputs[name] = compare(live, self._baseline_counts[n])
+                if histograms:
+                    inputs[name]['counts'] = live.tolist()
+            statuses = [entry.get('status') for entry in inputs.values()]
+            result[view] = {
+                'rows': int(self.bins.split(counts)[0].sum()),
+                'status': next((s for s in ('significant', 'moderate', 'stable') if s in statuses), None),
+                'drifted': [name for name, entry in inputs.items() if entry.get('status') == 'significant'],
+                'inputs': inputs,
+            }
+        if histograms:
+            result['values'] = {name: v.tolist() for name, v in zip(FEATURES, self.bins.values)}
+        if self.metrics is not None and self._baseline_counts is not None:
+            for name, entry in result['window']['inputs'].items():
+                if entry['psi'] is not None:
+                    self.metrics.set('momcare_drift_psi', entry['psi'], ('input', name))
+                    self.metrics.set('momcare_drift_ks', entry['ks'], ('input', name))
+        return result
+
+
+def drift_from_env(compiled, metrics=None, path=DRIFT_BASELINE):
+    """DriftMonitor over ``compiled``'s universes (or the baseline's bins), or None when off."""
+    if not DRIFT:
+        return None
+    baseline = None
+    if os.path.exists(path):
+        baseline = load_baseline(path)
+        bins = [baseline['inputs'][name]['values'] for name in FEATURES]
+    else:
+        print(f"{path} not found, /stats/drift reports live counts only", file=sys.stderr)
+        bins = compiled.universes
+    return DriftMonitor(bins, baseline, metrics=metrics)
+
+
+def profile_file(path, bins, fmt=None, overrides=None, chunk_size=50000):
+    """``(counts, rows, skipped)`` of a survey export binned like live inputs."""
+    from score_file import (chunks, detect_format, read_csv, read_json_array, read_ndjson,
+                            resolve_columns)
+
+    fmt = detect_format(path, fmt)
+    rows = skipped = 0
+    counts = np.zeros(bins.size, dtype=np.int64)
+    with open(path, newline='' if fmt == 'csv' else None) as source:
+        columns, records = {'csv': read_csv, 'json': read_json_array, 'ndjson': read_ndjson}[fmt](source)
+        mapping = resolve_columns(columns, overrides)
+        for chunk in chunks(records, chunk_size):
+            X = []
+            for record in chunk:
+                try:
+                    row = [float(record[mapping[name]]) for name in FEATURES]
+                except (KeyError, TypeError, ValueError):
+                    skipped += 1
+                    continue
+                if all(math.isfinite(v) for v in row):
+                    X.append(row)
+                else:
+                    skipped += 1
+            if X:
+                counts += bins.count(bins.codes(np.array(X)))
+                rows += len(X)
+    return counts, rows, skipped
+
+
+def main():
+    from model_artifact import load_compiled_risk
+    from score_file import parse_overrides
+
+    parser = argparse.ArgumentParser(description="Build or check the input drift baseline.")
+    parser.add_argument('data', help="survey export: CSV, JSON array or NDJSON")
+    parser.add_argument('--out', default=DRIFT_BASELINE, help="baseline file (default: %(default)s)")
+    parser.add_argument('--compare', action='store_true',
+                        help="compare the file with the baseline instead of writing one")
+    parser.add_argument('--format', choices=['csv', 'json', 'ndjson'])
+    parser.add_argument('--map', action='append', metavar='COLUMN=FEATURE', help="extra column mapping")
+    args = parser.parse_args()
+
+    try:
+        overrides = parse_overrides(args.map)
+        if args.compare:
+            baseline = load_baseline(args.out)
+            monitor = DriftMonitor([baseline['inputs'][name]['values'] for name in FEATURES], baseline)
+        else:
+            monitor = DriftMonitor(load_compiled_risk().universes)
+        counts, rows, skipped = profile_file(args.data, monitor.bins, args.format, overrides)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"{rows} rows profiled, {skipped} skipped", file=sys.stderr)
+
+    if not args.compare:
+        baseline = {'source': os.path.basename(args.data), 'rows': rows, 'created': time.time(),
+                    'inputs': {name: {'values': v.tolist(), 'counts': c.tolist()}
+                               for name, v, c in zip(FEATURES, monitor.bins.values,
+                                                     monitor.bins.split(counts))}}
+        with open(args.out, 'w') as f:
+            json.dump(baseline, f)
+        print(f"Wrote {args.out}")
+        return
+
+    print(f"{'input':<30} {'PSI':>8} {'KS':>7} {'KS 5%':>7} {'out':>6}  status")
+    for name, live, base in zip(FEATURES, monitor.bins.split(counts), monitor._baseline_counts):
+        r = compare(live, base)
+        if r['psi'] is None:
+            print(f"{name:<30} {'-':>8} {'-':>7} {'-':>7} {r['out_of_range']:>6}  {r['status']}")
+            continue
+        print(f"{name:<30} {r['psi']:>8.4f} {r['ks']:>7.4f} {r['ks_critical']:>7.4f} "
+              f"{r['out_of_range']:>6}  {r['status']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+ANC dropout classifier (XGBoost) served next to the fuzzy risk model.
+
+The model is trained by XGBoost/CareConnectMLModel-main/bootcamp_codes.py,
+which saves it in XGBoost's native UBJSON format (dropout_model.ubj) with its
+feature names. Copy that file here, point MOMCARE_DROPOUT_MODEL at it, or
+register and promote it with model_registry.py. Loading it needs nothing but
+xgboost (no pickle, no scikit-learn), and it is loaded once per process. Its
+version is a hash of the model (and encoder) file. If the training run also saved its fitted feature
+encoder (dropout_encoder.json, see anc_pipeline.py), records are encoded with
+it, so they may carry the raw survey answers; otherwise every record must
+supply the model's feature columns by name.
+
+Records are scored together: every request turns into one float32 matrix and
+one ``inplace_predict`` call, which skips building a DMatrix. xgboost is an
+optional dependency; without it (or without the model file) the dropout
+endpoint answers 503 and the risk model is unaffected.
+"""
+import hashlib
+import math
+import os
+import sys
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DROPOUT_MODEL = os.environ.get('MOMCARE_DROPOUT_MODEL', os.path.join(BASE_DIR, 'dropout_model.ubj'))
+DROPOUT_ENCODER = os.environ.get('MOMCARE_DROPOUT_ENCODER', os.path.join(BASE_DIR, 'dropout_encoder.json'))
+
+# bootcamp_codes.py labels ANC < 4 visits as 1 (dropout)
+THRESHOLD = 0.5
+
+
+def artifact_version(path, encoder_path=None):
+    """Content hash of the model file (and encoder), as the model registry names it."""
+    digest = hashlib.sha256()
+    for name in (path, encoder_path):
+        if name and os.path.exists(name):
+            with open(name, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+class DropoutModel:
+    """A loaded booster, the feature order it was trained with and its encoder."""
+
+    def __init__(self, booster, encoder=None, version=None):
+        if not booster.feature_names:
+            raise ValueError("Model has no feature names; export it with bootcamp_codes.py")
+        self.booster = booster
+        self.feature_names = list(booster.feature_names)
+        if encoder is not None and encoder.feature_names != self.feature_names:
+            raise ValueError("Feature encoder does not match the model's features")
+        self.encoder = encoder
+        self.version = version
+
+    @classmethod
+    def load(cls, path=DROPOUT_MODEL, encoder_path=DROPOUT_ENCODER):
+        import xgboost as xgb
+
+        from anc_pipeline import AncEncoder
+
+        booster = xgb.Booster()
+        booster.load_model(path)
+        if not (encoder_path and os.path.exists(encoder_path)):
+            encoder_path = None
+        encoder = AncEncoder.load(encoder_path) if encoder_path else None
+        return cls(booster, encoder, artifact_version(path, encoder_path))
+
+    def records_to_matrix(self, records):
+        """
+        ``(X, valid, errors)``: float32 rows for the valid records, their
+        indices in ``records``, and ``(index, message)`` for the rest.
+        """
+        X = np.empty((len(records), len(self.feature_names)), dtype=np.float32)
+        valid, errors = [], []
+        for i, record in enumerate(records):
+            if not isinstance(record, dict):
+                errors.append((i, "Record must be a JSON object"))
+                continue
+            try:
+                if self.encoder is not None:
+                    X[len(valid)] = self.encoder.transform_records([record])[0]
+                else:
+                    X[len(valid)] = [record[name] for name in self.feature_names]
+            except KeyError as e:
+                errors.append((i, f"Missing field '{e.args[0]}'"))
+                continue
+            except (TypeError, ValueError) as e:
+                errors.append((i, str(e) if self.encoder is not None else "Fields must be numbers"))
+                continue
+            valid.append(i)
+        return X[:len(valid)], valid, errors
+
+    def predict_proba(self, X):
+        """Dropout probability for each row of ``X``."""
+        X = np.ascontiguousarray(X, dtype=np.float32).reshape(-1, len(self.feature_names))
+        if not X.shape[0]:
+            return np.empty(0, dtype=np.float32)
+        return self.booster.inplace_predict(X, validate_features=False)
+
+    def score_records(self, records):
+        """Response body for each record, scored in one call."""
+        X, valid, errors = self.records_to_matrix(records)
+        results = [None] * len(records)
+        for i, message in errors:
+            results[i] = {"error": message}
+        for i, p in zip(valid, self.predict_proba(X).tolist()):
+            if math.isnan(p):
+                results[i] = {"error": "Dropout probability could not be computed"}
+            else:
+                results[i] = {"dropout_probability": p, "predicted_dropout": p >= THRESHOLD}
+        return results
+
+
+def load_dropout_model(path=DROPOUT_MODEL):
+    """The dropout model, or None (with the reason on stderr) if unavailable."""
+    if not os.path.exists(path):
+        print(f"Dropout model {path} not found; /predict/dropout is disabled", file=sys.stderr)
+        return None
+    try:
+        return DropoutModel.load(path)
+    except ImportError:
+        print("xgboost is not installed; /predict/dropout is disabled", file=sys.stderr)
+    except Exception as e:
+        print(f"Could not load dropout model {path}: {e}", file=sys.stderr)
+    return None
@@ -0,0 +1,314 @@
+"""
+Array-based evaluation of the fuzzy risk control system.
+
+skfuzzy's ControlSystemSimulation walks the rule graph for one set of inputs
+at a time. CompiledFuzzySystem flattens a ControlSystem once into plain NumPy
+arrays (membership samples per term, a rule/term index matrix and the
+consequent shapes) so that any number of records can be scored in one pass.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+EPS = np.finfo(float).eps
+
+
+class CompiledFuzzySystem:
+    """
+    Mamdani min/max system with a single centroid-defuzzified consequent.
+
+    Rows of ``X`` passed to the evaluation methods hold one value per input,
+    in the order of ``input_names``.
+    """
+
+    def __init__(self, input_names, universes, term_labels, term_input,
+                 term_mfs, rule_labels, rule_terms, rule_consequent,
+                 rule_weight, output_name, output_terms, output_universe,
+                 output_mfs):
+        self.input_names = tuple(input_names)
+        self.universes = [np.asarray(u, dtype=np.float64) for u in universes]
+        self.term_labels = tuple(term_labels)
+        self.term_input = np.asarray(term_input, dtype=np.intp)
+        self.term_mfs = [np.asarray(mf, dtype=np.float64) for mf in term_mfs]
+        self.rule_labels = tuple(rule_labels)
+        # Padded with len(term_labels), an always-true column
+        self.rule_terms = np.asarray(rule_terms, dtype=np.intp)
+        self.rule_consequent = np.asarray(rule_consequent, dtype=np.intp)
+        self.rule_weight = np.asarray(rule_weight, dtype=np.float64)
+        self.output_name = output_name
+        self.output_terms = tuple(output_terms)
+        self.output_universe = np.asarray(output_universe, dtype=np.float64)
+        self.output_mfs = np.asarray(output_mfs, dtype=np.float64)
+
+        self.lower = np.array([u.min() for u in self.universes])
+        self.upper = np.array([u.max() for u in self.universes])
+        self._consequent_rules = [np.flatnonzero(self.rule_consequent == c)
+                                  for c in range(len(self.output_terms))]
+        self._rule_table = None
+        self._precompute()
+
+    def _precompute(self):
+        # Term shapes padded to a common width so every term of every input
+        # can be interpolated with one gather.
+        width = max(u.size for u in self.universes)
+        if min(u.size for u in self.universes) < 2:
+            raise ValueError("Every input universe needs at least two points")
+        self._inputs = np.arange(len(self.universes))
+        self._last_segment = np.array([u.size - 2 for u in self.universes])
+        self._universe_table = np.full((len(self.universes), width), np.inf)
+        for i, u in enumerate(self.universes):
+            self._universe_table[i, :u.size] = u
+        self._term_rows = np.arange(len(self.term_mfs))
+        self._term_table = np.zeros((len(self.term_mfs), width))
+        for k, mf in enumerate(self.term_mfs):
+            self._term_table[k, :mf.size] = mf
+
+        # Consequent segments: start, width, start level and inverse slope of
+        # each term on each segment of the output universe.
+        x = self.output_universe
+        self._seg_x0 = x[:-1]
+        self._seg_dx = np.diff(x)
+        self._seg_y0 = self.output_mfs[:, :-1]
+        dy = np.diff(self.output_mfs, axis=1)
+        self._seg_inv_dy = np.divide(1.0, dy, out=np.zeros_like(dy), where=dy != 0)
+
+    @classmethod
+    def from_control_system(cls, control_system, input_names):
+        """Compile an skfuzzy ``ControlSystem`` built from AND-only rules."""
+        antecedents = {a.label: a for a in control_system.antecedents}
+        missing = set(antecedents) - set(input_names)
+        if missing:
+            raise ValueError(f"Inputs missing from input_names: {sorted(missing)}")
+
+        consequents = list(control_system.consequents)
+        if len(consequents) != 1:
+            raise ValueError("Only systems with a single consequent can be compiled")
+        output = consequents[0]
+        if output.defuzzify_method != 'centroid':
+            raise ValueError("Only centroid defuzzification can be compiled")
+
+        universes, term_labels, term_input, term_mfs = [], [], [], []
+        term_index = {}
+        for i, name in enumerate(input_names):
+            var = antecedents[name]
+            universes.append(var.universe)
+            for label, term in var.terms.items():
+                term_index[term.full_label] = len(term_labels)
+                term_labels.append(term.full_label)
+                term_input.append(i)
+                term_mfs.append(term.mf)
+
+        output_terms = list(output.terms)
+        rules = list(control_system.rules)
+        rule_term_lists, rule_consequent, rule_weight = [], [], []
+        for rule in rules:
+            if rule._aggregation_methods.and_func is not np.fmin:
+                raise ValueError("Only fmin AND aggregation can be compiled")
+            rule_term_lists.append([term_index[t.full_label]
+                                    for t in _and_terms(rule.antecedent)])
+            if len(rule.consequent) != 1:
+                raise ValueError("Only rules with a single consequent term can be compiled")
+            weighted = rule.consequent[0]
+            rule_consequent.append(output_terms.index(weighted.term.label))
+            rule_weight.append(weighted.weight)
+
+        width = max(len(terms) for terms in rule_term_lists)
+        pad = len(term_labels)
+        rule_terms = [terms + [pad] * (width - len(terms)) for terms in rule_term_lists]
+
+        return cls(
+            input_names=input_names,
+            universes=universes,
+            term_labels=term_labels,
+            term_input=term_input,
+            term_mfs=term_mfs,
+            rule_labels=[f"rule{n}" for n in range(1, len(rules) + 1)],
+            rule_terms=rule_terms,
+            rule_consequent=rule_consequent,
+            rule_weight=rule_weight,
+            output_name=output.label,
+            output_terms=output_terms,
+            output_universe=output.universe,
+            output_mfs=[output.terms[t].mf for t in output_terms],
+        )
+
+    def save(self, path, **metadata):
+        """Write the arrays to ``path`` (.npz) with JSON-serialisable metadata."""
+        names = {
+            'input_names': self.input_names,
+            'term_labels': self.term_labels,
+            'rule_labels': self.rule_labels,
+            'output_name': self.output_name,
+            'output_terms': self.output_terms,
+            'metadata': metadata,
+        }
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(
+                f,
+                names=np.array(json.dumps(names)),
+                universes=np.concatenate(self.universes),
+                universe_sizes=np.array([u.size for u in self.universes]),
+                term_input=self.term_input,
+                term_mfs=np.concatenate(self.term_mfs),
+                rule_terms=self.rule_terms,
+                rule_consequent=self.rule_consequent,
+                rule_weight=self.rule_weight,
+                output_universe=self.output_universe,
+                output_mfs=self.output_mfs,
+            )
+        # Readers never see a half-written file
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a system written by ``save``; returns ``(system, metadata)``."""
+        with np.load(path, allow_pickle=False) as data:
+            names = json.loads(str(data['names']))
+            universes = np.split(data['universes'], np.cumsum(data['universe_sizes'])[:-1])
+            term_input = data['term_input']
+            term_mfs = np.split(data['term_mfs'],
+                                np.cumsum([universes[i].size for i in term_input])[:-1])
+            system = cls(
+                input_names=names['input_names'],
+                universes=universes,
+                term_labels=names['term_labels'],
+                term_input=term_input,
+                term_mfs=term_mfs,
+                rule_labels=names['rule_labels'],
+                rule_terms=data['rule_terms'],
+                rule_consequent=data['rule_consequent'],
+                rule_weight=data['rule_weight'],
+                output_name=names['output_name'],
+                output_terms=names['output_terms'],
+                output_universe=data['output_universe'],
+                output_mfs=data['output_mfs'],
+            )
+        return system, names['metadata']
+
+    def fingerprint(self):
+        """Content hash of everything that affects the output."""
+        digest = hashlib.sha256()
+        for name in self.input_names + self.term_labels + self.output_terms:
+            digest.update(name.encode() + b'\0')
+        for array in (self.universes + self.term_mfs +
+                      [self.term_input, self.rule_terms, self.rule_consequent,
+                       self.rule_weight, self.output_universe, self.output_mfs]):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def memberships(self, X):
+        """Degree of every antecedent term for each row, plus a trailing 1."""
+        X = np.clip(np.atleast_2d(np.asarray(X, dtype=np.float64)), self.lower, self.upper)
+        # Linear interpolation on each input's universe, as skfuzzy does
+        index = (self._universe_table <= X[:, :, None]).sum(axis=2) - 1
+        index = np.clip(index, 0, self._last_segment)
+        left = self._universe_table[self._inputs, index]
+        right = self._universe_table[self._inputs, index + 1]
+        frac = (X - left) / (right - left)
+
+        j = index[:, self.term_input]
+        f = frac[:, self.term_input]
+        mu = np.ones((X.shape[0], len(self.term_labels) + 1))
+        mu[:, :-1] = (self._term_table[self._term_rows, j] * (1.0 - f)
+                      + self._term_table[self._term_rows, j + 1] * f)
+        return mu
+
+    def firing_strengths(self, mu):
+        """Rule activations (fmin over each rule's terms, times its weight)."""
+        return mu[:, self.rule_terms].min(axis=2) * self.rule_weight
+
+    def consequent_activations(self, firing):
+        """Cut level of each consequent term (fmax accumulation over rules)."""
+        cuts = np.zeros((firing.shape[0], len(self.output_terms)))
+        for c, rules in enumerate(self._consequent_rules):
+            if rules.size:
+                cuts[:, c] = firing[:, rules].max(axis=1)
+        return cuts
+
+    def defuzzify(self, cuts):
+        """
+        Centroid of the clipped, max-aggregated consequent for each row.
+
+        Mirrors skfuzzy: the output universe is upsampled with the points
+        where each term crosses its cut level and the resulting piecewise
+        linear shape is integrated exactly. Rows where nothing fired are NaN.
+        """
+        x = self.output_universe
+        mfs = self.output_mfs
+        n = cuts.shape[0]
+
+        # Points where each term's sampled shape reaches its cut level. Each
+        # segment contributes one candidate (clamped to its ends, where it is
+        # harmless because those points are already on the universe).
+        t = np.clip((cuts[:, :, None] - self._seg_y0) * self._seg_inv_dy, 0.0, 1.0)
+        crossings = (self._seg_x0 + t * self._seg_dx).reshape(n, -1)
+
+        points = np.concatenate([np.broadcast_to(x, (n, x.size)), crossings], axis=1)
+        points.sort(axis=1)
+        shape = np.zeros_like(points)
+        for c in range(len(self.output_terms)):
+            clipped = np.minimum(cuts[:, c:c + 1], np.interp(points, x, mfs[c]))
+            np.maximum(shape, clipped, out=shape)
+
+        # Exact area and first moment of each linear piece
+        x1, dx = points[:, :-1], np.diff(points, axis=1)
+        h1, h2 = shape[:, :-1], shape[:, 1:]
+        area = (0.5 * dx * (h1 + h2)).sum(axis=1)
+        moment = (0.5 * dx * (h1 + h2) * x1 + dx * dx * (h1 + 2.0 * h2) / 6.0).sum(axis=1)
+
+        crisp = moment / np.fmax(area, EPS)
+        crisp[shape.sum(axis=1) == 0] = np.nan
+        return crisp
+
+    def compute(self, X):
+        """Crisp output for each row of ``X``; NaN where no rule fired."""
+        mu = self.memberships(X)
+        return self.defuzzify(self.consequent_activations(self.firing_strengths(mu)))
+
+    def explain(self, X):
+        """
+        ``(memberships, firing, cuts, crisp)`` for each row of ``X``: the
+        intermediate arrays of ``compute``, kept from the same pass.
+        """
+        mu = self.memberships(X)
+        firing = self.firing_strengths(mu)
+        cuts = self.consequent_activations(firing)
+        return mu[:, :-1], firing, cuts, self.defuzzify(cuts)
+
+    def input_terms(self):
+        """``(input name, term names, term columns)`` for each input."""
+        return [(name, [_term_name(self.term_labels[k]) for k in columns], columns)
+                for name, columns in ((name, np.flatnonzero(self.term_input == i).tolist())
+                                      for i, name in enumerate(self.input_names))]
+
+    def rule_table(self):
+        """Each rule as ``{"rule", "if": {input: term}, "then", "weight"}``."""
+        if self._rule_table is None:
+            pad = len(self.term_labels)
+            self._rule_table = [
+                {"rule": label,
+                 "if": {self.input_names[self.term_input[k]]: _term_name(self.term_labels[k])
+                        for k in terms.tolist() if k != pad},
+                 "then": self.output_terms[consequent],
+                 "weight": weight}
+                for label, terms, consequent, weight in zip(self.rule_labels, self.rule_terms,
+                                                            self.rule_consequent.tolist(),
+                                                            self.rule_weight.tolist())]
+        return self._rule_table
+
+
+def _term_name(label):
+    # 'Wealth_index[Poor]' -> 'Poor'
+    return label[label.index('[') + 1:-1] if label.endswith(']') and '[' in label else label
+
+
+def _and_terms(antecedent):
+    # Flatten a rule antecedent into its terms, rejecting OR/NOT clauses
+    if hasattr(antecedent, 'kind'):
+        if antecedent.kind != 'and':
+            raise ValueError(f"Only AND rule antecedents can be compiled, got {antecedent.kind!r}")
+        return _and_terms(antecedent.term1) + _and_terms(antecedent.term2)
+    return [antecedent]
@@ -0,0 +1,200 @@
+"""
+Precomputed lookup table of risk values over the integer survey codes.
+
+Every input to the risk model is a small integer code, and every rule only
+looks at one or two inputs. The cut level of each consequent term is
+therefore the max over a handful of small per-group tables, and the centroid
+only depends on the pair of cut levels. Both are compiled offline:
+
+    python fuzzy_grid.py [--out risk_grid]
+
+which writes ``manifest.json``, ``groups.npy`` and ``risk.npy``. Workers load
+the arrays memory-mapped, so they share one copy through the page cache.
+Records with non-integer inputs are not on the grid and go to the live engine,
+and so does everything for a rule base the grid cannot tabulate (a universe
+that is not a unit-step integer range, a rule group too large): load_grid and
+compile_grid return None for it rather than raising.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+
+import numpy as np
+
+GRID_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'risk_grid')
+
+# Largest table a single rule group may need before compiling is refused
+MAX_GROUP_CELLS = 1_000_000
+
+
+class RiskGrid:
+    """
+    Lookup tables for a compiled system.
+
+    ``groups`` holds the per-group tables flattened into one uint16 array of
+    cut *level indices*; ``risk`` is indexed by one level index per
+    consequent term and holds the crisp value (NaN where nothing fired).
+    """
+
+    def __init__(self, manifest, groups, risk):
+        self.manifest = manifest
+        self.fingerprint = manifest['fingerprint']
+        self.lower = np.array(manifest['lower'], dtype=np.float64)
+        self.upper = np.array(manifest['upper'], dtype=np.float64)
+        # Plain ndarray views (still backed by the mapping); indexing np.memmap
+        # objects directly is several times slower.
+        groups, risk = np.asarray(groups), np.asarray(risk)
+        self.group_inputs = [np.array(g['inputs'], dtype=np.intp) for g in manifest['groups']]
+        self.group_tables = [
+            groups[g['offset']:g['offset'] + int(np.prod(g['shape']))].reshape(g['shape'])
+            for g in manifest['groups']
+        ]
+        self.risk = risk
+        # Plain Python copies for the single-record path
+        self._bounds = list(zip(self.lower.tolist(), self.upper.tolist()))
+        self._group_index = [tuple(int(i) for i in inputs) for inputs in self.group_inputs]
+
+    @classmethod
+    def compile(cls, engine):
+        """Build the tables for a ``CompiledFuzzySystem`` with integer universes."""
+        for name, u in zip(engine.input_names, engine.universes):
+            if not np.array_equal(u, np.arange(u[0], u[-1] + 1)):
+                raise ValueError(f"Universe of {name} is not a unit-step integer range")
+
+        # Rules grouped by the inputs they read
+        rule_inputs = [tuple(sorted({int(engine.term_input[k]) for k in terms if k < len(engine.term_labels)}))
+                       for terms in engine.rule_terms]
+        by_inputs = {}
+        for r, inputs in enumerate(rule_inputs):
+            by_inputs.setdefault(inputs, []).append(r)
+
+        n_out = len(engine.output_terms)
+        cut_tables = []
+        for inputs, rules in by_inputs.items():
+            axes = [engine.universes[i] for i in inputs]
+            shape = tuple(a.size for a in axes)
+            if int(np.prod(shape)) * n_out > MAX_GROUP_CELLS:
+                raise ValueError(f"Rule group over {[engine.input_names[i] for i in inputs]} is too large to tabulate")
+            X = np.tile(engine.lower, (int(np.prod(shape)), 1))
+            X[:, list(inputs)] = np.array(list(itertools.product(*axes)))
+            firing = engine.firing_strengths(engine.memberships(X))
+            cuts = np.zeros((X.shape[0], n_out))
+            for c in range(n_out):
+                mine = [r for r in rules if engine.rule_consequent[r] == c]
+                if mine:
+                    cuts[:, c] = firing[:, mine].max(axis=1)
+            cut_tables.append((inputs, cuts.reshape(shape + (n_out,))))
+
+        # Every cut level a consequent term can take, so tables store indices
+        levels = [np.unique(np.concatenate([[0.0]] + [t[..., c].ravel() for _, t in cut_tables]))
+                  for c in range(n_out)]
+        if max(l.size for l in levels) > np.iinfo(np.uint16).max:
+            raise ValueError("Too many distinct cut levels to tabulate")
+
+        manifest_groups, flat = [], []
+        offset = 0
+        for inputs, table in cut_tables:
+            indexed = np.stack([np.searchsorted(levels[c], table[..., c]) for c in range(n_out)], axis=-1)
+            manifest_groups.append({'inputs': list(inputs), 'shape': list(indexed.shape), 'offset': offset})
+            flat.append(indexed.astype(np.uint16).ravel())
+            offset += indexed.size
+
+        mesh = np.stack([m.ravel() for m in np.meshgrid(*levels, indexing='ij')], axis=1)
+        risk = engine.defuzzify(mesh).reshape(tuple(l.size for l in levels))
+
+        manifest = {
+            'fingerprint': engine.fingerprint(),
+            'input_names': list(engine.input_names),
+            'lower': engine.lower.tolist(),
+            'upper': engine.upper.tolist(),
+            'groups': manifest_groups,
+        }
+        return cls(manifest, np.concatenate(flat), risk)
+
+    def save(self, path=GRID_DIR):
+        os.makedirs(path, exist_ok=True)
+        groups = np.concatenate([t.ravel() for t in self.group_tables])
+        np.save(os.path.join(path, 'groups.npy'), groups)
+        np.save(os.path.join(path, 'risk.npy'), self.risk)
+        with open(os.path.join(path, 'manifest.json'), 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+
+    @classmethod
+    def load(cls, path=GRID_DIR):
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        groups = np.load(os.path.join(path, 'groups.npy'), mmap_mode='r')
+        risk = np.load(os.path.join(path, 'risk.npy'), mmap_mode='r')
+        return cls(manifest, groups, risk)
+
+    def lookup(self, X):
+        """
+        Risk values for the rows of ``X`` that sit on the integer grid.
+
+        Returns ``(values, on_grid)``; ``values`` is only meaningful where
+        ``on_grid`` is True. Inputs are clipped to their universes first, as
+        the live engine does.
+        """
+        X = np.clip(np.atleast_2d(np.asarray(X, dtype=np.float64)), self.lower, self.upper)
+        on_grid = (X == np.round(X)).all(axis=1)
+        index = (np.where(on_grid[:, None], X, self.lower) - self.lower).astype(np.intp)
+
+        levels = None
+        for inputs, table in zip(self.group_inputs, self.group_tables):
+            cut = table[tuple(index[:, i] for i in inputs)]
+            levels = cut if levels is None else np.maximum(levels, cut)
+        values = self.risk[tuple(levels[:, c] for c in range(levels.shape[1]))]
+        return np.asarray(values, dtype=np.float64), on_grid
+
+    def lookup_one(self, row):
+        """Single-record ``lookup``: the risk value, or None if off the grid."""
+        index = []
+        for value, (lower, upper) in zip(row, self._bounds):
+            value = min(max(value, lower), upper)
+            if value != int(value):
+                return None
+            index.append(int(value - lower))
+
+        levels = [0] * self.risk.ndim
+        for inputs, table in zip(self._group_index, self.group_tables):
+            cut = table[tuple(index[i] for i in inputs)].tolist()
+            levels = [max(a, b) for a, b in zip(levels, cut)]
+        return float(self.risk[tuple(levels)])
+
+
+def compile_grid(engine):
+    """``RiskGrid.compile(engine)``, or None (with the reason on stderr) if it cannot be tabulated."""
+    try:
+        return RiskGrid.compile(engine)
+    except ValueError as e:
+        print(f"No lookup grid, every record goes to the compiled engine: {e}", file=sys.stderr)
+        return None
+
+
+def load_grid(engine, path=GRID_DIR):
+    """Grid for ``engine``: the saved one if it matches, else built in memory, else None."""
+    if os.path.exists(os.path.join(path, 'manifest.json')):
+        grid = RiskGrid.load(path)
+        if grid.fingerprint == engine.fingerprint():
+            return grid
+    return compile_grid(engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the risk lookup grid.")
+    parser.add_argument('--out', default=GRID_DIR, help="Output directory (default: %(default)s)")
+    args = parser.parse_args()
+
+    from model_artifact import build_compiled_risk
+
+    grid = RiskGrid.compile(build_compiled_risk())
+    grid.save(args.out)
+    cells = sum(t.size for t in grid.group_tables) + grid.risk.size
+    print(f"Wrote {args.out}: {len(grid.group_tables)} rule groups, "
+          f"risk table {grid.risk.shape}, {cells} cells in total")
+
+
+if __name__ == '__main__':
+    main()
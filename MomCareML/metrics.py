@@ -0,0 +1,175 @@
+"""
+In-process request metrics in the Prometheus text format.
+
+Histograms have fixed buckets, counters are plain integers and gauges hold
+the last value set, all updated under one lock, so recording a value costs about a microsecond and memory
+never grows with traffic. Values are per process: under gunicorn each worker
+keeps and serves its own.
+
+SamplingProfiler is the per-request profiler behind the X-Profile header: a
+background thread snapshots the request thread's stack at a fixed interval and
+counts the distinct stacks, written out in the folded format flamegraph tools
+read.
+"""
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Seconds; from a grid lookup (~10us) up to a large batch
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                   0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Caller holds the Metrics lock
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Named histograms and counters, each with at most one label."""
+
+    HELP = {
+        'momcare_phase_seconds': "Time spent in each phase of a prediction request",
+        'momcare_request_seconds': "Total request handling time",
+        'momcare_records_total': "Records received for scoring",
+        'momcare_errors_total': "Failed requests and records, by error type",
+        'momcare_risk_not_identified_total': "Records where no rule fired (defaulted to Low risk)",
+        'momcare_batches_total': "Micro-batches scored by the ASGI server",
+        'momcare_batched_records_total': "Requests answered through ASGI micro-batches",
+        'momcare_incremental_records_total': "Incremental records answered from the store or recomputed",
+        'momcare_shadow_records_total': "Requests scored by the shadow model",
+        'momcare_shadow_dropped_total': "Sampled requests not shadowed, by reason",
+        'momcare_shadow_seconds': "Shadow model time per scored request (batch time / batch size)",
+        'momcare_shadow_rate': "Share of requests currently sampled for shadow scoring",
+        'momcare_shadow_p99_overhead_seconds': "p99 request latency with shadow scoring minus without",
+        'momcare_drift_psi': "Population stability index of recent inputs against the survey baseline",
+        'momcare_drift_ks': "Kolmogorov-Smirnov statistic of recent inputs against the survey baseline",
+    }
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        # Present from the start so a rate over it is defined before the first one
+        self._counters = {('momcare_risk_not_identified_total', None): 0}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, label, seconds):
+        key = (name, label)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def observe_phase(self, phase, seconds):
+        self.observe('momcare_phase_seconds', ('phase', phase), seconds)
+
+    @contextmanager
+    def phase(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, time.perf_counter() - start)
+
+    def count(self, name, label=None, amount=1):
+        key = (name, label)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name, value, label=None):
+        with self._lock:
+            self._gauges[(name, label)] = value
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {k: (list(h.counts), h.sum, h.count, h.buckets) for k, h in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, label), (counts, total, count, buckets) in sorted(histograms.items()):
+            describe(name, 'histogram')
+            prefix = f'{label[0]}="{label[1]}",' if label else ''
+            cumulative = 0
+            for bound, n in zip(buckets, counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{prefix}le="{bound:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {count}')
+            labels = f'{{{prefix[:-1]}}}' if label else ''
+            lines.append(f'{name}_sum{labels} {total!r}')
+            lines.append(f'{name}_count{labels} {count}')
+
+        for (name, label), value in sorted(counters.items(), key=lambda item: (item[0][0], item[0][1] or ())):
+            describe(name, 'counter')
+            labels = f'{{{label[0]}="{label[1]}"}}' if label else ''
+            lines.append(f'{name}{labels} {value}')
+
+        for (name, label), value in sorted(gauges.items(), key=lambda item: (item[0][0], item[0][1] or ())):
+            describe(name, 'gauge')
+            labels = f'{{{label[0]}="{label[1]}"}}' if label else ''
+            lines.append(f'{name}{labels} {value!r}')
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """Counts the stacks of one thread, sampled every ``interval`` seconds."""
+
+    def __init__(self, thread_id=None, interval=0.0005):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        """Write the samples as folded stacks (``frame;frame;frame count``)."""
+        with open(path, 'w') as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
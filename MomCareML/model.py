@@ -1,168 +1,390 @@
+import os
 import sys
+import json
+import math
+import time
+import uuid
+from operator import itemgetter
 import numpy as np
-import skfuzzy as fuzz
-from skfuzzy import control as ctrl
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 
+from dropout_model import load_dropout_model
+from drift import drift_from_env
+from fuzzy_grid import compile_grid, load_grid
+from metrics import Metrics, SamplingProfiler
+from model_artifact import FEATURES, RULES_SOURCE, compile_risk_spec, load_compiled_risk
+from model_registry import ModelRegistry
+from prediction_service import PredictionService
+from request_schema import InvalidRecord, loads
+from result_cache import cache_from_env
+from rule_spec import SpecWatcher, build_control_system
+from score_store import ScoreStore, ScoreStoreError, row_fingerprint
+from shadow import shadow_from_env
+from shared_model import share_arrays
+
 app = Flask(__name__)
 CORS(app)
 
-# Define fuzzy variables
-CurrAgeGroup = ctrl.Antecedent(np.arange(0, 50, 1), 'CurrAgeGroup')
-Place_of_Residence = ctrl.Antecedent(np.arange(1, 3, 1), 'Place_of_Residence')
-Education_level = ctrl.Antecedent(np.arange(0, 4, 1), 'Education_level')
-Wealth_index = ctrl.Antecedent(np.arange(1, 6, 1), 'Wealth_index')
-marital_status = ctrl.Antecedent(np.arange(0, 6, 1), 'marital_status')
-Distance_to_health = ctrl.Antecedent(np.arange(1, 4, 1), 'Distance_to_health')
-Frequency_media_use = ctrl.Antecedent(np.arange(0, 4, 1), 'Frequency_media_use')
-Frequency_of_using_internet = ctrl.Antecedent(np.arange(0, 4, 1), 'Frequency_of_using_internet')
-Antenatal_visits = ctrl.Antecedent(np.arange(0, 15, 1), 'Antenatal_visits')
-Postnatal_visits = ctrl.Antecedent(np.arange(0, 15, 1), 'Postnatal_visits')
-
-# Define the 'risk' fuzzy variable
-risk = ctrl.Consequent(np.arange(0, 11, 1), 'Risk')
-
-# Age fuzzy sets
-CurrAgeGroup['Young'] = fuzz.trimf(CurrAgeGroup.universe, [0, 0, 25])
-CurrAgeGroup['Middle-aged'] = fuzz.trimf(CurrAgeGroup.universe, [20, 30, 40])
-CurrAgeGroup['Old'] = fuzz.trimf(CurrAgeGroup.universe, [30, 50, 50])
-
-# Place of Residence fuzzy sets
-Place_of_Residence['Urban'] = fuzz.trimf(Place_of_Residence.universe, [1, 1, 2])
-Place_of_Residence['Rural'] = fuzz.trimf(Place_of_Residence.universe, [1, 2, 2])
-
-# Education level fuzzy sets
-Education_level['Low'] = fuzz.trimf(Education_level.universe, [0, 0, 1])
-Education_level['Medium'] = fuzz.trimf(Education_level.universe, [1, 2, 2])
-Education_level['High'] = fuzz.trimf(Education_level.universe, [2, 3, 3])
-
-# Wealth index fuzzy sets
-Wealth_index['Poor'] = fuzz.trimf(Wealth_index.universe, [1, 1, 3])
-Wealth_index['Middle'] = fuzz.trimf(Wealth_index.universe, [2, 3, 4])
-Wealth_index['Rich'] = fuzz.trimf(Wealth_index.universe, [3, 5, 5])
-
-# Marital status fuzzy sets
-marital_status['Single'] = fuzz.trimf(marital_status.universe, [0, 0, 1])
-marital_status['Married'] = fuzz.trimf(marital_status.universe, [1, 1, 2])
-marital_status['Living with partner'] = fuzz.trimf(marital_status.universe, [1, 2, 2])
-marital_status['Divorced'] = fuzz.trimf(marital_status.universe, [3, 4, 5])
-marital_status['Widowed'] = fuzz.trimf(marital_status.universe, [4, 5, 5])
-
-# Distance to health fuzzy sets
-Distance_to_health['Very Far'] = fuzz.trimf(Distance_to_health.universe, [1, 2, 3])
-Distance_to_health['Far'] = fuzz.trimf(Distance_to_health.universe, [1, 1, 2])
-Distance_to_health['Close'] = fuzz.trimf(Distance_to_health.universe, [2, 2, 3])
-
-# Frequency of media use fuzzy sets
-Frequency_media_use['Low'] = fuzz.trimf(Frequency_media_use.universe, [0, 0, 1])
-Frequency_media_use['Medium'] = fuzz.trimf(Frequency_media_use.universe, [1, 2, 2])
-Frequency_media_use['High'] = fuzz.trimf(Frequency_media_use.universe, [2, 3, 3])
-
-# Frequency of using internet fuzzy sets
-Frequency_of_using_internet['Never'] = fuzz.trimf(Frequency_of_using_internet.universe, [0, 0, 1])
-Frequency_of_using_internet['Occasional'] = fuzz.trimf(Frequency_of_using_internet.universe, [1, 2, 2])
-Frequency_of_using_internet['Regular'] = fuzz.trimf(Frequency_of_using_internet.universe, [2, 3, 3])
-
-# Antenatal visits fuzzy sets
-Antenatal_visits['Low'] = fuzz.trimf(Antenatal_visits.universe, [0, 0, 5])
-Antenatal_visits['Medium'] = fuzz.trimf(Antenatal_visits.universe, [5, 6, 8])
-Antenatal_visits['High'] = fuzz.trimf(Antenatal_visits.universe, [8, 12, 12])
-
-# Postnatal visits fuzzy sets
-Postnatal_visits['Low'] = fuzz.trimf(Postnatal_visits.universe, [0, 0, 3])
-Postnatal_visits['Medium'] = fuzz.trimf(Postnatal_visits.universe, [3, 4, 6])
-Postnatal_visits['High'] = fuzz.trimf(Postnatal_visits.universe, [6, 8, 10])
-
-# Risk fuzzy sets
-risk['Low'] = fuzz.trimf(risk.universe, [0, 0, 5])
-risk['High'] = fuzz.trimf(risk.universe, [5, 10, 10])
-
-# Define fuzzy rules for Low and High risk only
-
-# Age & Education Rules
-rule1 = ctrl.Rule(CurrAgeGroup['Young'] & Education_level['Low'], risk['High'])
-rule2 = ctrl.Rule(CurrAgeGroup['Young'] & Education_level['Medium'], risk['High'])
-rule3 = ctrl.Rule(CurrAgeGroup['Young'] & Education_level['High'], risk['Low'])
-rule4 = ctrl.Rule(CurrAgeGroup['Middle-aged'] & Education_level['Low'], risk['High'])
-rule5 = ctrl.Rule(CurrAgeGroup['Middle-aged'] & Education_level['Medium'], risk['High'])
-rule6 = ctrl.Rule(CurrAgeGroup['Middle-aged'] & Education_level['High'], risk['Low'])
-rule7 = ctrl.Rule(CurrAgeGroup['Old'] & Education_level['Low'], risk['High'])
-rule8 = ctrl.Rule(CurrAgeGroup['Old'] & Education_level['Medium'], risk['High'])
-rule9 = ctrl.Rule(CurrAgeGroup['Old'] & Education_level['High'], risk['Low'])
-
-# Wealth & Distance to Health Rules
-rule10 = ctrl.Rule(Wealth_index['Poor'] & Distance_to_health['Very Far'], risk['High'])
-rule11 = ctrl.Rule(Wealth_index['Poor'] & Distance_to_health['Far'], risk['High'])
-rule12 = ctrl.Rule(Wealth_index['Poor'] & Distance_to_health['Close'], risk['High'])
-rule13 = ctrl.Rule(Wealth_index['Middle'] & Distance_to_health['Very Far'], risk['High'])
-rule14 = ctrl.Rule(Wealth_index['Middle'] & Distance_to_health['Far'], risk['High'])
-rule15 = ctrl.Rule(Wealth_index['Middle'] & Distance_to_health['Close'], risk['Low'])
-rule16 = ctrl.Rule(Wealth_index['Rich'] & Distance_to_health['Very Far'], risk['High'])
-rule17 = ctrl.Rule(Wealth_index['Rich'] & Distance_to_health['Far'], risk['Low'])
-rule18 = ctrl.Rule(Wealth_index['Rich'] & Distance_to_health['Close'], risk['Low'])
-
-# Marital Status & Education Rules
-rule19 = ctrl.Rule(marital_status['Single'] & Education_level['Low'], risk['High'])
-rule20 = ctrl.Rule(marital_status['Single'] & Education_level['Medium'], risk['High'])
-rule21 = ctrl.Rule(marital_status['Single'] & Education_level['High'], risk['Low'])
-rule22 = ctrl.Rule(marital_status['Married'] & Education_level['Low'], risk['High'])
-rule23 = ctrl.Rule(marital_status['Married'] & Education_level['Medium'], risk['High'])
-rule24 = ctrl.Rule(marital_status['Married'] & Education_level['High'], risk['Low'])
-rule25 = ctrl.Rule(marital_status['Divorced'] & Education_level['Low'], risk['High'])
-rule26 = ctrl.Rule(marital_status['Divorced'] & Education_level['Medium'], risk['High'])
-rule27 = ctrl.Rule(marital_status['Divorced'] & Education_level['High'], risk['Low'])
-rule28 = ctrl.Rule(marital_status['Widowed'] & Education_level['Low'], risk['High'])
-rule29 = ctrl.Rule(marital_status['Widowed'] & Education_level['Medium'], risk['High'])
-rule30 = ctrl.Rule(marital_status['Widowed'] & Education_level['High'], risk['Low'])
-
-# Antenatal & Postnatal Visits Rules
-rule31 = ctrl.Rule(Antenatal_visits['Low'], risk['High'])
-rule32 = ctrl.Rule(Antenatal_visits['Medium'], risk['High'])
-rule33 = ctrl.Rule(Antenatal_visits['High'], risk['Low'])
-rule34 = ctrl.Rule(Postnatal_visits['Low'], risk['High'])
-rule35 = ctrl.Rule(Postnatal_visits['Medium'], risk['High'])
-rule36 = ctrl.Rule(Postnatal_visits['High'], risk['Low'])
-
-# Media Use & Wealth Rules
-rule37 = ctrl.Rule(Frequency_media_use['Low'] & Wealth_index['Poor'], risk['High'])
-rule38 = ctrl.Rule(Frequency_media_use['Low'] & Wealth_index['Middle'], risk['High'])
-rule39 = ctrl.Rule(Frequency_media_use['Low'] & Wealth_index['Rich'], risk['Low'])
-rule40 = ctrl.Rule(Frequency_media_use['Medium'] & Wealth_index['Poor'], risk['High'])
-rule41 = ctrl.Rule(Frequency_media_use['Medium'] & Wealth_index['Middle'], risk['High'])
-rule42 = ctrl.Rule(Frequency_media_use['Medium'] & Wealth_index['Rich'], risk['Low'])
-rule43 = ctrl.Rule(Frequency_media_use['High'] & Wealth_index['Poor'], risk['High'])
-rule44 = ctrl.Rule(Frequency_media_use['High'] & Wealth_index['Middle'], risk['Low'])
-rule45 = ctrl.Rule(Frequency_media_use['High'] & Wealth_index['Rich'], risk['Low'])
-
-# Internet Use & Distance to Health Rules
-rule46 = ctrl.Rule(Frequency_of_using_internet['Never'] & Distance_to_health['Very Far'], risk['High'])
-rule47 = ctrl.Rule(Frequency_of_using_internet['Never'] & Distance_to_health['Far'], risk['High'])
-rule48 = ctrl.Rule(Frequency_of_using_internet['Never'] & Distance_to_health['Close'], risk['High'])
-rule49 = ctrl.Rule(Frequency_of_using_internet['Occasional'] & Distance_to_health['Very Far'], risk['High'])
-rule50 = ctrl.Rule(Frequency_of_using_internet['Occasional'] & Distance_to_health['Far'], risk['High'])
-rule51 = ctrl.Rule(Frequency_of_using_internet['Occasional'] & Distance_to_health['Close'], risk['High'])
-rule52 = ctrl.Rule(Frequency_of_using_internet['Regular'] & Distance_to_health['Very Far'], risk['High'])
-rule53 = ctrl.Rule(Frequency_of_using_internet['Regular'] & Distance_to_health['Far'], risk['Low'])
-rule54 = ctrl.Rule(Frequency_of_using_internet['Regular'] & Distance_to_health['Close'], risk['Low'])
-
-# Place of Residence & Education Rules
-rule55 = ctrl.Rule(Place_of_Residence['Urban'] & Education_level['Low'], risk['High'])
-rule56 = ctrl.Rule(Place_of_Residence['Urban'] & Education_level['Medium'], risk['High'])
-rule57 = ctrl.Rule(Place_of_Residence['Urban'] & Education_level['High'], risk['Low'])
-rule58 = ctrl.Rule(Place_of_Residence['Rural'] & Education_level['Low'], risk['High'])
-rule59 = ctrl.Rule(Place_of_Residence['Rural'] & Education_level['Medium'], risk['High'])
-rule60 = ctrl.Rule(Place_of_Residence['Rural'] & Education_level['High'], risk['Low'])  # Higher risk in rural areas with high education
-
-# Control system and simulation
-risk_ctrl = ctrl.ControlSystem([rule1, rule2, rule3, rule4, rule5, rule6, rule7, rule8, rule9, rule10, rule11, rule12, rule13,
-                               rule14, rule15, rule16, rule17, rule18, rule19, rule20, rule21, rule22, rule23, rule24, 
-                               rule25, rule26, rule27, rule28, rule29, rule30, rule31, rule32, rule33, rule34, rule35, 
-                               rule36, rule37, rule38, rule39, rule40, rule41, rule42, rule43, rule44, rule45, rule46, 
-                               rule47, rule48, rule49, rule50, rule51, rule52, rule53, rule54, rule55, rule56, rule57, 
-                               rule58, rule59, rule60])
-
-risk_prediction = ctrl.ControlSystemSimulation(risk_ctrl)
+# Versions promoted in the model registry (see model_registry.py) are served
+# in preference to risk_model.npz and dropout_model.ubj.
+registry = ModelRegistry()
+
+
+def load_registered(kind):
+    """The promoted version of ``kind`` as registry.load returns it, or None."""
+    version = registry.current(kind)
+    if version is None:
+        return None
+    try:
+        return registry.load(kind, version)
+    except (OSError, ValueError) as e:
+        print(f"Could not load promoted {kind} version {version}: {e}", file=sys.stderr)
+        return None
+
+# Rule base from risk_rules.json as arrays, used to score any number of
+# records in one pass. MOMCARE_STARTUP=artifact (default) loads the prebuilt
+# risk_model.npz; 'source' always compiles the spec.
+registered_risk = load_registered('risk')
+if registered_risk is not None:
+    risk_spec, compiled_risk, risk_grid = registered_risk
+else:
+    risk_spec = None
+    compiled_risk = load_compiled_risk(os.environ.get('MOMCARE_STARTUP', 'artifact'))
+    # Precompiled answers for integer survey codes (see fuzzy_grid.py)
+    risk_grid = load_grid(compiled_risk)
+
+# Engine behind the predict routes: 'compiled' (the arrays above) or
+# 'reference' (a pool of skfuzzy simulations, MOMCARE_POOL_SIZE of them).
+# Both are safe to call from concurrent threads.
+ENGINE = os.environ.get('MOMCARE_ENGINE', 'compiled')
+if ENGINE == 'reference' and risk_spec is not None:
+    risk_ctrl = build_control_system(risk_spec)
+elif ENGINE == 'reference':
+    from risk_rules import risk_ctrl
+else:
+    risk_ctrl = None
+
+# XGBoost ANC dropout classifier behind /predict/dropout; None when xgboost
+# or the exported model file is missing (see dropout_model.py)
+dropout_model = load_registered('dropout') or load_dropout_model()
+
+# Phase timings and error counters, served on /metrics
+metrics = Metrics()
+
+# With MOMCARE_PROFILE_DIR set, a request carrying an X-Profile header is
+# profiled by sampling its stack every MOMCARE_PROFILE_INTERVAL seconds and
+# the folded stacks are written to that directory.
+PROFILE_DIR = os.environ.get('MOMCARE_PROFILE_DIR')
+PROFILE_INTERVAL = float(os.environ.get('MOMCARE_PROFILE_INTERVAL', '0.0005'))
+
+prediction_service = PredictionService(
+    compiled_risk,
+    grid=risk_grid,
+    control_system=risk_ctrl,
+    mode=ENGINE,
+    pool_size=int(os.environ.get('MOMCARE_POOL_SIZE', '4')),
+    cache_factory=cache_from_env,
+    observe=metrics.observe_phase,
+)
+
+
+def reload_rules(spec, compiled, grid=None, source=RULES_SOURCE):
+    """Swap a new version of the rule spec into the running service."""
+    control_system = build_control_system(spec) if ENGINE == 'reference' else None
+    prediction_service.load(compiled, grid or compile_grid(compiled), control_system)
+    print(f"Loaded rule base {prediction_service.version} from {source}", file=sys.stderr)
+
+
+def promoted(kind, loaded):
+    """Swap a newly promoted registry version into the running service."""
+    global dropout_model
+    if kind == 'risk':
+        spec, compiled, grid = loaded
+        reload_rules(spec, compiled, grid, source=registry.path('risk', compiled.fingerprint()[:12]))
+    else:
+        # Requests read the global once, so they finish on the model they started with
+        dropout_model = loaded
+        print(f"Loaded dropout model {loaded.version} from the registry", file=sys.stderr)
+
+# With MOMCARE_RULES_RELOAD=<seconds>, every worker polls the spec and swaps in
+# valid new versions without a restart; in-flight requests finish on the old one.
+RULES_RELOAD = float(os.environ.get('MOMCARE_RULES_RELOAD', '0'))
+
+# MOMCARE_REGISTRY_RELOAD=<seconds> does the same for versions promoted in the
+# model registry, for both models.
+REGISTRY_RELOAD = float(os.environ.get('MOMCARE_REGISTRY_RELOAD', '0'))
+
+
+def start_watchers():
+    """Start the reload pollers configured above, in this process."""
+    if RULES_RELOAD > 0:
+        SpecWatcher(RULES_SOURCE, reload_rules, RULES_RELOAD, compiler=compile_risk_spec).start()
+    if REGISTRY_RELOAD > 0:
+        for kind in ('risk', 'dropout'):
+            SpecWatcher(registry.pointer(kind), lambda _, loaded, kind=kind: promoted(kind, loaded), REGISTRY_RELOAD,
+                        compiler=lambda pointer, kind=kind: registry.load(kind, pointer['version'])).start()
+
+
+# Under prefork.py this module is imported once in the gunicorn master and the
+# workers are forked from it: the model arrays go to shared memory, and the
+# pollers (threads do not survive fork) are started by each worker instead.
+PREFORK = os.environ.get('MOMCARE_PREFORK') == '1'
+if PREFORK:
+    share_arrays(compiled_risk, risk_grid)
+else:
+    start_watchers()
+
+
+# MOMCARE_SHADOW=dropout|risk:<version> also scores sampled /predict inputs
+# with a second model, off the response path, and logs both (see shadow.py)
+shadow = shadow_from_env(registry, lambda: dropout_model, metrics)
+
+# Histograms of the inputs answered by the predict routes, compared with the
+# survey baseline on /stats/drift (see drift.py); MOMCARE_DRIFT=0 turns it off
+drift = drift_from_env(compiled_risk, metrics)
+
+
+def count_error(kind):
+    metrics.count('momcare_errors_total', ('type', kind))
+
+
+def versioned(response, version):
+    """Tag a prediction response with the model version that computed it."""
+    response.headers['X-Model-Version'] = version
+    return response
+
+
+def risk_result(risk_value):
+    """Response body for one crisp Risk value (NaN when no rule fired)."""
+    if math.isnan(risk_value):
+        metrics.count('momcare_risk_not_identified_total')
+        return {"error": "Risk not identified, defaulting to Low risk.", "risk_value": None}
+    risk_category = 'Low' if risk_value <= 5 else 'High'
+    return {"predicted_risk": risk_category, "risk_value": risk_value}
+
+
+def record_to_row(record, state=None):
+    """
+    The model inputs of one request record, in FEATURES order, checked
+    against the universes of ``state`` (default: the current model version).
+    """
+    return (state or prediction_service.state).schema.row(record)
+
+
+def bind_records(records, state=None):
+    """
+    ``(rows, positions, results)``: the input rows of the valid records (an
+    array), their indices, and a result list holding the errors of the others.
+    """
+    results = [None] * len(records)
+    with metrics.phase('bind'):
+        rows, positions, errors = (state or prediction_service.state).schema.rows(records)
+    for i, message in errors.items():
+        results[i] = {"error": message}
+    if errors:
+        metrics.count('momcare_errors_total', ('type', 'invalid_input'), len(errors))
+    return rows, positions, results
+
+
+def json_body():
+    """The request body decoded as JSON (orjson when installed); ValueError if it is not JSON."""
+    if not request.is_json:
+        raise ValueError("Expected application/json")
+    return loads(request.get_data())
+
+
+def json_array():
+    """The request body if it is a JSON array, else None."""
+    try:
+        records = json_body()
+    except ValueError:
+        return None
+    return records if isinstance(records, list) else None
+
+
+def score_records(records, state=None):
+    """
+    Score a list of request records in one vectorized pass, preserving order,
+    with ``state`` (default: the current model version).
+    """
+    rows, positions, results = bind_records(records, state)
+    if len(rows):
+        values = prediction_service.predict_many(rows, state)
+        for i, value in zip(positions, values):
+            results[i] = risk_result(float(value))
+        if drift is not None:
+            drift.record_many(rows)
+    metrics.count('momcare_records_total', ('endpoint', 'predict_batch'), len(records))
+    return results
+
+
+def explain_records(records, top=None, state=None):
+    """
+    Results of score_records plus, for each record, the membership degree of
+    every antecedent term, the Low/High activations and either the firing
+    strength of every rule (in /explain/rules order) or, with ``top``, the
+    ``top`` strongest rules that fired, from the same vectorized pass. The
+    ``top`` form is the compact one: memberships are only the non-zero ones,
+    keyed by term label ('Wealth_index[Poor]').
+    """
+    state = state or prediction_service.state
+    compiled = state.compiled
+    rows, positions, results = bind_records(records, state)
+    metrics.count('momcare_records_total', ('endpoint', 'explain'), len(records))
+    if not len(rows):
+        return results
+
+    memberships, firing, cuts, risk = prediction_service.explain_many(rows, state)
+    inputs = [(name, terms, itemgetter(*columns)) for name, terms, columns in compiled.input_terms()]
+    if top:
+        rules = compiled.rule_table()
+        labels = compiled.term_labels
+        # Non-zero memberships of each row, found for all rows at once
+        nonzero_rows, nonzero_terms = np.nonzero(memberships)
+        nonzero = np.split(nonzero_terms, np.searchsorted(nonzero_rows, np.arange(1, len(rows))))
+        # Strongest first; a rule is decisive when it sets its consequent's activation
+        order = np.argsort(-firing, axis=1, kind='stable')[:, :top]
+        decisive = firing >= cuts[:, compiled.rule_consequent]
+    for n, (i, mu, activations, risk_value) in enumerate(zip(positions, memberships.tolist(), cuts.tolist(),
+                                                              risk.tolist())):
+        result = risk_result(risk_value)
+        if top:
+            result['memberships'] = {labels[k]: mu[k] for k in nonzero[n].tolist()}
+        else:
+            result['memberships'] = {name: dict(zip(terms, pick(mu))) for name, terms, pick in inputs}
+        result['activations'] = dict(zip(compiled.output_terms, activations))
+        if top:
+            result['top_rules'] = [dict(rules[r], strength=float(firing[n, r]), decisive=bool(decisive[n, r]))
+                                   for r in order[n].tolist() if firing[n, r] > 0]
+        else:
+            result['firing_strengths'] = firing[n].tolist()
+        results[i] = result
+    return results
+
+
+def top_argument():
+    """The ``top`` query argument: None, or a positive number of rules."""
+    top = request.args.get('top')
+    if top is None:
+        return None
+    if not top.isdigit() or int(top) < 1:
+        raise InvalidRecord("'top' must be a positive integer")
+    return int(top)
+
+
+_score_store = None
+
+
+def score_store():
+    """The per-id store behind /predict/incremental, opened on first use."""
+    global _score_store
+    if _score_store is None:
+        _score_store = ScoreStore()
+    return _score_store
+
+
+def score_incremental(records, state=None):
+    """
+    Results for records with an ``id`` and ``fingerprint``, recomputing only
+    those that are new, changed or scored by another model version (see
+    score_store.py). Returns ``(results, skipped, recomputed)``.
+    """
+    state = state or prediction_service.state
+    store = score_store()
+    results = [None] * len(records)
+    keyed = []
+    for i, record in enumerate(records):
+        key = record.get('id') if isinstance(record, dict) else None
+        if isinstance(key, bool) or not isinstance(key, (str, int)):
+            count_error('invalid_input')
+            results[i] = {"error": "Record must be a JSON object with a string or integer 'id'"}
+        else:
+            # Type-tagged, so id 1 and id "1" are different records
+            keyed.append((i, json.dumps(key), record))
+    stored = store.get_many([key for _, key, _ in keyed])
+
+    skipped = 0
+    rows, pending = [], []
+    with metrics.phase('bind'):
+        for i, key, record in keyed:
+            fingerprint = record.get('fingerprint')
+            row = None
+            if any(name in record for name in FEATURES):
+                try:
+                    row = record_to_row(record, state)
+                except InvalidRecord as e:
+                    count_error('invalid_input')
+                    results[i] = {"id": record['id'], "error": str(e)}
+                    continue
+                if fingerprint is None:
+                    fingerprint = row_fingerprint(row)
+            previous = stored.get(key)
+            if previous is not None and fingerprint is not None and previous.fingerprint == str(fingerprint):
+                if previous.version == state.version:
+                    results[i] = dict(risk_result(previous.risk_value), id=record['id'], recomputed=False)
+                    skipped += 1
+                    continue
+                # Unchanged inputs, new model version: rescore what is stored
+                row = row or previous.row
+            if row is None:
+                count_error('invalid_input')
+                results[i] = {"id": record['id'], "error": "Unknown id or changed fingerprint; send the inputs"}
+                continue
+            rows.append(row)
+            pending.append((i, key, str(fingerprint), record['id']))
+
+    if rows:
+        values = prediction_service.predict_many(rows, state).tolist()
+        entries = []
+        for (i, key, fingerprint, record_id), row, value in zip(pending, rows, values):
+            results[i] = dict(risk_result(value), id=record_id, recomputed=True)
+            entries.append((key, fingerprint, row, value, state.version))
+        store.put_many(entries)
+        if drift is not None:
+            drift.record_many(rows)
+    metrics.count('momcare_records_total', ('endpoint', 'predict_incremental'), len(records))
+    metrics.count('momcare_incremental_records_total', ('outcome', 'skipped'), skipped)
+    metrics.count('momcare_incremental_records_total', ('outcome', 'recomputed'), len(rows))
+    return results, skipped, len(rows)
+
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    if PROFILE_DIR and request.headers.get('X-Profile'):
+        g.profiler = SamplingProfiler(interval=PROFILE_INTERVAL).start()
+
+
+def finish_profile():
+    """Stop this request's profiler, if any, and write its profile. Returns ``(file name, samples)`` or None."""
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return None
+    profiler.stop()
+    name = f"{request.endpoint}-{uuid.uuid4().hex[:12]}.folded"
+    profiler.write(os.path.join(PROFILE_DIR, name))
+    return name, sum(profiler.stacks.values())
+
+
+@app.after_request
+def record_request(response):
+    profile = finish_profile()
+    if profile is not None:
+        response.headers['X-Profile-File'] = profile[0]
+        response.headers['X-Profile-Samples'] = str(profile[1])
+    if request.endpoint:
+        seconds = time.perf_counter() - g.started
+        metrics.observe('momcare_request_seconds', ('endpoint', request.endpoint), seconds)
+        if shadow is not None and request.endpoint == 'predict':
+            shadow.observe(seconds)
+    return response
+
+
+@app.teardown_request
+def stop_profiler(exc):
+    # after_request is skipped when a view raises; the sampler thread must not outlive the request
+    finish_profile()
 
 # New route for homepage with success message
 @app.route('/')
@@ -265,32 +487,178 @@ def debug():
 # Existing predict endpoint
 @app.route('/predict', methods=['POST'])
 def predict():
-    data = request.get_json()
+    with metrics.phase('parse'):
+        try:
+            data = json_body()
+        except ValueError:
+            count_error('invalid_json')
+            if not request.is_json:
+                return jsonify({"error": "Expected application/json"}), 415
+            return jsonify({"error": "Invalid JSON"}), 400
+    metrics.count('momcare_records_total', ('endpoint', 'predict'))
+    state = prediction_service.state
+    # Malformed records are refused before any inference runs
     try:
-        risk_prediction.input['CurrAgeGroup'] = data['CurrAgeGroup']
-        risk_prediction.input['Place_of_Residence'] = data['Place_of_Residence']
-        risk_prediction.input['Education_level'] = data['Education_level']
-        risk_prediction.input['Wealth_index'] = data['Wealth_index']
-        risk_prediction.input['marital_status'] = data['marital_status']
-        risk_prediction.input['Distance_to_health'] = data['Distance_to_health']
-        risk_prediction.input['Frequency_media_use'] = data['Frequency_media_use']
-        risk_prediction.input['Frequency_of_using_internet'] = data['Frequency_of_using_internet']
-        risk_prediction.input['Antenatal_visits'] = data['Antenatal_visits']
-        risk_prediction.input['Postnatal_visits'] = data['Postnatal_visits']
-
-        risk_prediction.compute()
-
-        if 'Risk' in risk_prediction.output:
-            if risk_prediction.output['Risk'] <= 5:
-                risk_category = 'Low'
-            else:
-                risk_category = 'High'
-            return jsonify({"predicted_risk": risk_category, "risk_value": risk_prediction.output['Risk']})
-        else:
-            return jsonify({"error": "Risk not identified, defaulting to Low risk.", "risk_value": risk_prediction.output})
-
+        with metrics.phase('bind'):
+            row = record_to_row(data, state)
+    except InvalidRecord as e:
+        count_error('invalid_input')
+        return jsonify({"error": str(e)}), 400
+    try:
+        result = risk_result(prediction_service.predict_one(row, state))
     except Exception as e:
-        return jsonify({"error": f"Error occurred: {str(e)}"})
+        count_error(type(e).__name__)
+        return jsonify({"error": f"Error occurred: {str(e)}"}), 500
+    result['model_version'] = state.version
+    if drift is not None:
+        drift.record(row)
+    if shadow is not None:
+        shadow.offer(row, data, result['risk_value'], state.version, time.perf_counter() - g.started)
+    with metrics.phase('serialize'):
+        return versioned(jsonify(result), state.version)
+
+# Batch endpoint: a JSON array of records, or one record per line as NDJSON
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    if request.mimetype == 'application/x-ndjson':
+        with metrics.phase('parse'):
+            lines = [line for line in request.get_data(as_text=True).splitlines() if line.strip()]
+            records, invalid = [], []
+            for i, line in enumerate(lines):
+                try:
+                    records.append(loads(line))
+                except ValueError:
+                    invalid.append(i)
+        state = prediction_service.state
+        results = score_records(records, state)
+        # Put the unparseable lines back in place, in ascending order
+        for i in invalid:
+            count_error('invalid_json')
+            results.insert(i, {"error": "Invalid JSON"})
+        with metrics.phase('serialize'):
+            body = ''.join(json.dumps(result) + '\n' for result in results)
+            return versioned(Response(body, mimetype='application/x-ndjson'), state.version)
+
+    with metrics.phase('parse'):
+        records = json_array()
+    if not isinstance(records, list):
+        count_error('invalid_json')
+        return jsonify({"error": "Expected a JSON array of records"}), 400
+    state = prediction_service.state
+    results = score_records(records, state)
+    with metrics.phase('serialize'):
+        return versioned(jsonify({"results": results, "model_version": state.version}), state.version)
+
+# ANC dropout probabilities for a JSON array of records, in one model call
+@app.route('/predict/dropout', methods=['POST'])
+def predict_dropout():
+    model = dropout_model
+    if model is None:
+        return jsonify({"error": "Dropout model is not available"}), 503
+    with metrics.phase('parse'):
+        records = json_array()
+    if not isinstance(records, list):
+        count_error('invalid_json')
+        return jsonify({"error": "Expected a JSON array of records"}), 400
+    metrics.count('momcare_records_total', ('endpoint', 'predict_dropout'), len(records))
+    results = model.score_records(records)
+    with metrics.phase('serialize'):
+        return versioned(jsonify({"results": results, "model_version": model.version}), model.version)
+
+# Why a record got its risk: memberships, rule firing strengths and the
+# Low/High activations, optionally only the top-k rules (?top=k)
+@app.route('/explain', methods=['POST'])
+def explain():
+    try:
+        data = json_body()
+    except ValueError:
+        data = None
+    state = prediction_service.state
+    try:
+        top = top_argument()
+    except InvalidRecord as e:
+        return jsonify({"error": str(e)}), 400
+    result, = explain_records([data], top, state)
+    if 'error' in result and 'risk_value' not in result:
+        return jsonify(result), 400
+    result['model_version'] = state.version
+    with metrics.phase('serialize'):
+        return versioned(jsonify(result), state.version)
+
+@app.route('/explain/batch', methods=['POST'])
+def explain_batch():
+    with metrics.phase('parse'):
+        records = json_array()
+    if not isinstance(records, list):
+        count_error('invalid_json')
+        return jsonify({"error": "Expected a JSON array of records"}), 400
+    state = prediction_service.state
+    try:
+        top = top_argument()
+    except InvalidRecord as e:
+        return jsonify({"error": str(e)}), 400
+    results = explain_records(records, top, state)
+    with metrics.phase('serialize'):
+        return versioned(jsonify({"results": results, "model_version": state.version}), state.version)
+
+# The rules (and input terms) the explanations refer to
+@app.route('/explain/rules')
+def explain_rules():
+    state = prediction_service.state
+    compiled = state.compiled
+    return versioned(jsonify({
+        "model_version": state.version,
+        "inputs": {name: terms for name, terms, _ in compiled.input_terms()},
+        "outputs": list(compiled.output_terms),
+        "rules": compiled.rule_table(),
+    }), state.version)
+
+# Change-driven scoring: records with an id and input fingerprint; only new or
+# changed ones are recomputed, the rest are answered from the score store
+@app.route('/predict/incremental', methods=['POST'])
+def predict_incremental():
+    with metrics.phase('parse'):
+        records = json_array()
+    if not isinstance(records, list):
+        count_error('invalid_json')
+        return jsonify({"error": "Expected a JSON array of records"}), 400
+    state = prediction_service.state
+    try:
+        results, skipped, recomputed = score_incremental(records, state)
+    except ScoreStoreError as e:
+        count_error('score_store')
+        return jsonify({"error": str(e)}), 503
+    with metrics.phase('serialize'):
+        return versioned(jsonify({"results": results, "skipped": skipped, "recomputed": recomputed,
+                                  "model_version": state.version}), state.version)
+
+# Hit/miss/eviction counters of the prediction cache
+@app.route('/stats/cache')
+def cache_stats():
+    cache = prediction_service.cache
+    if cache is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(cache.stats(), enabled=True))
+
+# Size of the per-id score store behind /predict/incremental
+@app.route('/stats/scores')
+def score_store_stats():
+    try:
+        return jsonify(score_store().stats())
+    except ScoreStoreError as e:
+        return jsonify({"error": str(e)}), 503
+
+# PSI/KS of this worker's live inputs against the survey baseline
+@app.route('/stats/drift')
+def drift_stats():
+    if drift is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(drift.report(histograms=request.args.get('histograms') == '1'), enabled=True))
+
+# Latency histograms and error counters of this worker, Prometheus text format
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     app.run(port=6000)
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""
+Prebuilt, serialized form of the risk model for fast cold starts.
+
+The rule base is defined in risk_rules.json. Rather than parsing, validating
+and compiling it on every start, the compiled arrays are written once to
+risk_model.npz, together with the lookup grid:
+
+    python model_artifact.py
+
+Neither path imports scikit-fuzzy (and with it matplotlib, networkx and
+scipy), which used to dominate startup time. The artifact records a hash of
+the spec and is ignored once the rules change, so a stale artifact costs a
+slower start rather than wrong answers.
+"""
+import hashlib
+import os
+import sys
+
+from fuzzy_engine import CompiledFuzzySystem
+from rule_spec import RuleSpecError, compile_spec, load_spec
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RULES_SOURCE = os.environ.get('MOMCARE_RULES', os.path.join(BASE_DIR, 'risk_rules.json'))
+MODEL_ARTIFACT = os.environ.get('MOMCARE_MODEL_ARTIFACT', os.path.join(BASE_DIR, 'risk_model.npz'))
+
+# Order of the model inputs in request bodies and in the compiled arrays
+FEATURES = ('CurrAgeGroup', 'Place_of_Residence', 'Education_level', 'Wealth_index',
+            'marital_status', 'Distance_to_health', 'Frequency_media_use',
+            'Frequency_of_using_internet', 'Antenatal_visits', 'Postnatal_visits')
+
+
+def source_hash(path=RULES_SOURCE):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def compile_risk_spec(spec):
+    """Compile a rule spec, checking it has the inputs the API accepts."""
+    if tuple(spec.get('inputs', ())) != FEATURES:
+        raise RuleSpecError(f"Spec inputs must be, in order: {', '.join(FEATURES)}")
+    return compile_spec(spec)
+
+
+def build_compiled_risk(path=RULES_SOURCE):
+    """Compile the rule base from the spec file."""
+    return compile_risk_spec(load_spec(path))
+
+
+def load_compiled_risk(startup='artifact', path=MODEL_ARTIFACT):
+    """
+    The compiled rule base, read from the artifact when ``startup`` is
+    'artifact' and it matches the current rules, otherwise built from source.
+    """
+    if startup not in ('artifact', 'source'):
+        raise ValueError(f"Unknown startup mode {startup!r}, expected 'artifact' or 'source'")
+    if startup == 'artifact':
+        if os.path.exists(path):
+            compiled, metadata = CompiledFuzzySystem.load(path)
+            if metadata.get('source_hash') == source_hash():
+                return compiled
+            print(f"{path} is stale, building the model from {RULES_SOURCE}", file=sys.stderr)
+        else:
+            print(f"{path} not found, building the model from {RULES_SOURCE}", file=sys.stderr)
+    return build_compiled_risk()
+
+
+def main():
+    from fuzzy_grid import GRID_DIR, compile_grid
+
+    compiled = build_compiled_risk()
+    compiled.save(MODEL_ARTIFACT, source_hash=source_hash(), fingerprint=compiled.fingerprint())
+    grid = compile_grid(compiled)
+    if grid is not None:
+        grid.save(GRID_DIR)
+    print(f"Wrote {MODEL_ARTIFACT}{f' and {GRID_DIR}' if grid is not None else ''} ({compiled.fingerprint()[:12]})")
+
+
+if __name__ == '__main__':
+    main()
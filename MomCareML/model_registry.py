@@ -0,0 +1,409 @@
+"""
+Local registry of model versions: the fuzzy rule base and the XGBoost
+dropout classifier.
+
+    python model_registry.py register risk [--spec risk_rules.json] [--promote]
+    python model_registry.py register dropout dropout_model.ubj [--encoder dropout_encoder.json]
+                                      [--metrics best.json] [--validate data.json] [--promote]
+    python model_registry.py list [risk|dropout]
+    python model_registry.py promote risk|dropout VERSION
+    python model_registry.py rollback risk|dropout
+
+Every version lives in its own directory, named after a content hash, under
+MOMCARE_REGISTRY (default registry/ next to this file):
+
+    registry/risk/<version>/        rules.json, risk_model.npz, grid/, metadata.json
+    registry/dropout/<version>/     dropout_model.ubj, dropout_encoder.json, metadata.json
+    registry/<kind>/CURRENT.json    {"version": ...}, the promoted version
+    registry/<kind>/history.jsonl   one line per promotion or rollback
+
+A risk version is the first 12 hex digits of the compiled rule base's
+fingerprint, so the same rules get the same version however they were loaded.
+A dropout version hashes the model and encoder files. metadata.json records
+the sha256 of every file (checked again on load) and the validation metrics.
+Versions are written to a temporary directory and renamed into place, and
+CURRENT.json is replaced atomically, so readers never see half a version.
+
+model.py serves the promoted versions. With MOMCARE_REGISTRY_RELOAD=<seconds>
+every worker polls CURRENT.json and swaps a newly promoted version in without
+a restart; requests already running finish on the version they started with.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_DIR = os.environ.get('MOMCARE_REGISTRY', os.path.join(BASE_DIR, 'registry'))
+
+KINDS = ('risk', 'dropout')
+
+# Integer survey answers scored to describe a risk version
+VALIDATION_ROWS = 20000
+
+
+class RegistryError(ValueError):
+    """Unknown version, or a version whose files do not match its metadata."""
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _tree(path):
+    """Relative paths of every file under ``path``."""
+    for root, _, files in os.walk(path):
+        for name in files:
+            yield os.path.relpath(os.path.join(root, name), path)
+
+
+def _write_json(path, data):
+    # Write then rename, so readers see the old or the new file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+
+def risk_metrics(compiled, previous=None, rows=VALIDATION_ROWS, seed=0):
+    """
+    Behaviour of a rule base on random integer survey answers: the share
+    where no rule fires and the share rated High, plus how often its category
+    agrees with ``previous`` (the version it would replace) on the same rows.
+    """
+    rng = np.random.default_rng(seed)
+    lower, upper = compiled.lower, compiled.upper
+    X = rng.integers(np.ceil(lower), np.floor(upper) + 1, size=(rows, len(lower))).astype(np.float64)
+    values = compiled.compute(X)
+    fired = ~np.isnan(values)
+    result = {'rows': rows, 'unfired_fraction': float(1 - fired.mean()),
+              'high_fraction': float((values[fired] > 5).mean()) if fired.any() else 0.0}
+    if previous is not None:
+        old = previous.compute(X)
+        same = np.where(np.isnan(values) | np.isnan(old), np.isnan(values) & np.isnan(old),
+                        (values > 5) == (old > 5))
+        result['agreement_with_previous'] = float(same.mean())
+    return result
+
+
+def roc_auc(y, p):
+    """Area under the ROC curve (Mann-Whitney U, ties averaged)."""
+    positives = int(y.sum())
+    negatives = len(y) - positives
+    if not positives or not negatives:
+        return float('nan')
+    _, inverse, counts = np.unique(p, return_inverse=True, return_counts=True)
+    # Rank of each distinct value is the mean of the positions it occupies
+    ends = np.cumsum(counts)
+    ranks = (ends - (counts - 1) / 2)[inverse]
+    return float((ranks[y == 1].sum() - positives * (positives + 1) / 2) / (positives * negatives))
+
+
+def dropout_metrics(model, source, label='dropout', chunk_size=50000):
+    """AUC, log loss and accuracy of a DropoutModel on a labelled dataset."""
+    from anc_pipeline import ANC_COLUMN, anc_target, clean_anc, read_chunks
+
+    scores, labels = [], []
+    for df in read_chunks(source, chunk_size):
+        if model.encoder is not None:
+            X, median = model.encoder.transform(df), model.encoder.anc_median
+        else:
+            X, median = df[model.feature_names].to_numpy(np.float32), None
+        anc, _ = clean_anc(df[ANC_COLUMN], median)
+        labels.append(anc_target(anc, label))
+        scores.append(model.predict_proba(X))
+    y, p = np.concatenate(labels), np.concatenate(scores).astype(np.float64)
+    clipped = np.clip(p, 1e-7, 1 - 1e-7)
+    return {'rows': int(len(y)), 'label': label, 'auc': roc_auc(y, p),
+            'logloss': float(-np.mean(y * np.log(clipped) + (1 - y) * np.log(1 - clipped))),
+            'accuracy': float(((p >= 0.5) == y).mean())}
+
+
+class ModelRegistry:
+
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+
+    def path(self, kind, version=None):
+        if kind not in KINDS:
+            raise RegistryError(f"Unknown model kind {kind!r}, expected one of {KINDS}")
+        return os.path.join(self.root, kind, version) if version else os.path.join(self.root, kind)
+
+    def pointer(self, kind):
+        """File naming the promoted version; what workers poll."""
+        return os.path.join(self.path(kind), 'CURRENT.json')
+
+    def metadata(self, kind, version):
+        try:
+            with open(os.path.join(self.path(kind, version), 'metadata.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise RegistryError(f"No {kind} version {version}")
+
+    def versions(self, kind):
+        """Metadata of every registered version, oldest first."""
+        base = self.path(kind)
+        if not os.path.isdir(base):
+            return []
+        found = [self.metadata(kind, name) for name in os.listdir(base)
+                 if os.path.exists(os.path.join(base, name, 'metadata.json'))]
+        return sorted(found, key=lambda m: m['created'])
+
+    def resolve(self, kind, prefix):
+        """The full version a (unique) prefix refers to."""
+        matches = [m['version'] for m in self.versions(kind) if m['version'].startswith(prefix)]
+        if len(matches) != 1:
+            raise RegistryError(f"{prefix!r} matches {len(matches)} {kind} versions")
+        return matches[0]
+
+    def current(self, kind):
+        """The promoted version, or None."""
+        try:
+            with open(self.pointer(kind)) as f:
+                return json.load(f)['version']
+        except FileNotFoundError:
+            return None
+
+    def promote(self, kind, version):
+        """Make ``version`` the one served; returns the version it replaced."""
+        return self._promote(kind, version)
+
+    def rollback(self, kind):
+        """
+        Undo the latest promotion still in effect: each rollback steps one
+        promotion further back through the history.
+        """
+        promotions = self.promotions(kind)
+        if not promotions:
+            raise RegistryError(f"No {kind} promotion to roll back")
+        last = promotions[-1]
+        if last['previous'] is None:
+            raise RegistryError(f"{kind} version {last['version']} was the first one promoted")
+        self._promote(kind, last['previous'], rollback=True)
+        return last['previous']
+
+    def promotions(self, kind):
+        """History entries of the promotions in effect, oldest first; rolled-back ones are left out."""
+        try:
+            with open(os.path.join(self.path(kind), 'history.jsonl')) as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+        stack = []
+        for entry in entries:
+            if entry.get('rollback'):
+                if stack:
+                    stack.pop()
+            else:
+                stack.append(entry)
+        return stack
+
+    def _promote(self, kind, version, rollback=False):
+        self.verify(kind, version)
+        previous = self.current(kind)
+        _write_json(self.pointer(kind), {'version': version, 'promoted': time.time()})
+        entry = {'version': version, 'previous': previous, 'at': time.time()}
+        if rollback:
+            entry['rollback'] = True
+        with open(os.path.join(self.path(kind), 'history.jsonl'), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        return previous
+
+    def verify(self, kind, version):
+        """Metadata of ``version``, after checking its files against it."""
+        metadata = self.metadata(kind, version)
+        base = self.path(kind, version)
+        for name, digest in metadata['files'].items():
+            path = os.path.join(base, name)
+            if not os.path.exists(path) or file_sha256(path) != digest:
+                raise RegistryError(f"{kind} version {version}: {name} does not match its hash")
+        return metadata
+
+    def _add(self, kind, version, write, metadata):
+        """Write a version with ``write(directory)`` and publish it atomically."""
+        target = self.path(kind, version)
+        if os.path.exists(os.path.join(target, 'metadata.json')):
+            return self.metadata(kind, version), False
+        os.makedirs(self.path(kind), exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self.path(kind), prefix='.staging-')
+        try:
+            write(staging)
+            files = {name: file_sha256(os.path.join(staging, name)) for name in sorted(_tree(staging))}
+            metadata = dict(metadata, kind=kind, version=version, created=time.time(), files=files)
+            with open(os.path.join(staging, 'metadata.json'), 'w') as f:
+                json.dump(metadata, f, indent=1)
+            os.rename(staging, target)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return metadata, True
+
+    def register_risk(self, spec_path, metrics=None, note=None):
+        """
+        Validate, compile and store a rule spec. Returns ``(metadata, added)``;
+        registering the same rules twice returns the existing version.
+        """
+        from fuzzy_grid import compile_grid
+        from model_artifact import compile_risk_spec, source_hash
+        from rule_spec import load_spec
+
+        spec = load_spec(spec_path)
+        compiled = compile_risk_spec(spec)
+        fingerprint = compiled.fingerprint()
+        current = self.current('risk')
+        previous = self.load_risk(current)[1] if current else None
+
+        def write(directory):
+            with open(os.path.join(directory, 'rules.json'), 'w') as f:
+                json.dump(spec, f, indent=1)
+            compiled.save(os.path.join(directory, 'risk_model.npz'), source_hash=source_hash(spec_path),
+                          fingerprint=fingerprint)
+            # A rule base the grid cannot tabulate is stored (and served) without one
+            grid = compile_grid(compiled)
+            if grid is not None:
+                grid.save(os.path.join(directory, 'grid'))
+
+        metrics = dict(risk_metrics(compiled, previous), **(metrics or {}))
+        if current:
+            metrics['compared_with'] = current
+        return self._add('risk', fingerprint[:12], write,
+                         {'source': os.path.abspath(spec_path), 'fingerprint': fingerprint,
+                          'metrics': metrics, 'note': note})
+
+    def register_dropout(self, model_path, encoder_path=None, metrics=None, validate=None,
+                         label='dropout', note=None):
+        """Store an exported dropout model (and its encoder), like register_risk."""
+        from dropout_model import DropoutModel, artifact_version
+
+        # Loading checks the feature names and that the encoder matches them
+        model = DropoutModel.load(model_path, encoder_path)
+        metrics = dict(metrics or {})
+        if validate:
+            metrics.update(dropout_metrics(model, validate, label))
+            metrics['validated_on'] = os.path.abspath(validate)
+
+        def write(directory):
+            shutil.copyfile(model_path, os.path.join(directory, 'dropout_model.ubj'))
+            if encoder_path:
+                shutil.copyfile(encoder_path, os.path.join(directory, 'dropout_encoder.json'))
+
+        return self._add('dropout', artifact_version(model_path, encoder_path), write,
+                         {'source': os.path.abspath(model_path), 'features': model.feature_names,
+                          'metrics': metrics, 'note': note})
+
+    def load_risk(self, version):
+        """``(spec, compiled, grid)`` of a stored rule base; grid is None if it was stored without one."""
+        from fuzzy_engine import CompiledFuzzySystem
+        from fuzzy_grid import RiskGrid
+
+        self.verify('risk', version)
+        base = self.path('risk', version)
+        with open(os.path.join(base, 'rules.json')) as f:
+            spec = json.load(f)
+        compiled, _ = CompiledFuzzySystem.load(os.path.join(base, 'risk_model.npz'))
+        grid = RiskGrid.load(os.path.join(base, 'grid')) if os.path.isdir(os.path.join(base, 'grid')) else None
+        if not compiled.fingerprint().startswith(version) or (grid is not None
+                                                               and grid.fingerprint != compiled.fingerprint()):
+            raise RegistryError(f"risk version {version}: artifacts do not match the version")
+        return spec, compiled, grid
+
+    def load_dropout(self, version):
+        """The stored DropoutModel."""
+        from dropout_model import DropoutModel
+
+        self.verify('dropout', version)
+        base = self.path('dropout', version)
+        try:
+            model = DropoutModel.load(os.path.join(base, 'dropout_model.ubj'),
+                                      os.path.join(base, 'dropout_encoder.json'))
+        except ImportError:
+            raise RegistryError("xgboost is not installed")
+        if model.version != version:
+            raise RegistryError(f"dropout version {version}: artifacts do not match the version")
+        return model
+
+    def load(self, kind, version):
+        return self.load_risk(version) if kind == 'risk' else self.load_dropout(version)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Register, list and promote model versions.")
+    parser.add_argument('--registry', default=REGISTRY_DIR, help="Registry directory (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    register = commands.add_parser('register', help="store a new version")
+    register.add_argument('kind', choices=KINDS)
+    register.add_argument('model', nargs='?', help="dropout: exported .ubj model")
+    register.add_argument('--spec', help="risk: rule spec (default: MOMCARE_RULES)")
+    register.add_argument('--encoder', help="dropout: saved AncEncoder")
+    register.add_argument('--metrics', help="JSON file of metrics to record (e.g. tune_dropout's best.json)")
+    register.add_argument('--validate', help="dropout: labelled JSON/NDJSON dataset to score")
+    register.add_argument('--label', choices=['dropout', 'complete'], default='dropout',
+                          help="dropout: what the model predicts (default: %(default)s)")
+    register.add_argument('--note')
+    register.add_argument('--promote', action='store_true', help="promote the version once stored")
+
+    listing = commands.add_parser('list', help="show registered versions")
+    listing.add_argument('kind', nargs='?', choices=KINDS)
+
+    promote = commands.add_parser('promote', help="serve a registered version")
+    promote.add_argument('kind', choices=KINDS)
+    promote.add_argument('version', help="version or unique prefix")
+
+    rollback = commands.add_parser('rollback', help="serve the previously promoted version")
+    rollback.add_argument('kind', choices=KINDS)
+
+    args = parser.parse_args()
+    registry = ModelRegistry(args.registry)
+    try:
+        if args.command == 'register':
+            metrics = None
+            if args.metrics:
+                with open(args.metrics) as f:
+                    metrics = json.load(f)
+            if args.kind == 'risk':
+                from model_artifact import RULES_SOURCE
+
+                metadata, added = registry.register_risk(args.spec or RULES_SOURCE, metrics, args.note)
+            elif not args.model:
+                parser.error("register dropout needs the model file")
+            else:
+                metadata, added = registry.register_dropout(args.model, args.encoder, metrics, args.validate,
+                                                            args.label, args.note)
+            print(f"{'Registered' if added else 'Already registered'} {args.kind} {metadata['version']}")
+            print(json.dumps(metadata['metrics'], indent=1))
+            if args.promote:
+                registry.promote(args.kind, metadata['version'])
+                print(f"Promoted {args.kind} {metadata['version']}")
+        elif args.command == 'list':
+            for kind in [args.kind] if args.kind else KINDS:
+                current = registry.current(kind)
+                for m in registry.versions(kind):
+                    created = time.strftime('%Y-%m-%d %H:%M', time.localtime(m['created']))
+                    shown = {k: round(v, 4) if isinstance(v, float) else v for k, v in m['metrics'].items()
+                             if isinstance(v, (int, float)) and not isinstance(v, bool)}
+                    print(f"{'*' if m['version'] == current else ' '} {kind:<8} {m['version']}  {created}  "
+                          f"{json.dumps(shown)}{'  ' + m['note'] if m.get('note') else ''}")
+        elif args.command == 'promote':
+            version = registry.resolve(args.kind, args.version)
+            previous = registry.promote(args.kind, version)
+            print(f"Promoted {args.kind} {version} (was {previous})")
+        else:
+            print(f"Rolled {args.kind} back to {registry.rollback(args.kind)}")
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
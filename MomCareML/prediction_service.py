@@ -0,0 +1,232 @@
+"""
+Prediction service shared by the Flask routes.
+
+The compiled engine and lookup grid are read-only arrays, so any number of
+threads or greenlets can use them at once. The reference skfuzzy simulation is
+not: skfuzzy keeps per-simulation state on the Antecedent/Term objects of the
+ControlSystem itself (including a single 'current' input slot), so even two
+ControlSystemSimulation objects over one ControlSystem overwrite each other.
+SimulationPool therefore gives every simulation its own deep copy of the
+control system and hands them out one request at a time.
+"""
+import copy
+import math
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from request_schema import RequestSchema
+
+ENGINES = ('compiled', 'reference')
+
+
+class SimulationPool:
+    """At most ``size`` independent simulations, created on first use."""
+
+    def __init__(self, control_system, size):
+        if size < 1:
+            raise ValueError("Simulation pool size must be at least 1")
+        self.control_system = control_system
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def simulation(self):
+        """Borrow a simulation, waiting for one if all are in use."""
+        try:
+            simulation = self._idle.get_nowait()
+        except queue.Empty:
+            simulation = self._create() or self._idle.get()
+        try:
+            yield simulation
+        finally:
+            self._idle.put(simulation)
+
+    def _create(self):
+        from skfuzzy import control as ctrl
+
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        return ctrl.ControlSystemSimulation(copy.deepcopy(self.control_system))
+
+
+class ModelState:
+    """Everything one model version needs to answer; replaced as a whole."""
+
+    def __init__(self, compiled, grid, simulations, cache, fingerprint):
+        self.compiled = compiled
+        self.grid = grid
+        self.simulations = simulations
+        self.cache = cache
+        # Reported with every answer; the model registry names versions the same way
+        self.version = fingerprint[:12]
+        self.bounds = list(zip(compiled.lower.tolist(), compiled.upper.tolist()))
+        # Requests are checked against this version's universes
+        self.schema = RequestSchema.for_system(compiled)
+
+    def cache_key(self, row):
+        """Input row clipped to the universes, as the engines see it."""
+        return tuple(min(max(float(v), lower), upper) for v, (lower, upper) in zip(row, self.bounds))
+
+
+class PredictionService:
+    """
+    Scores rows of model inputs (in ``engine.input_names`` order).
+
+    ``mode`` picks the compiled engine (with the lookup grid in front of it,
+    if given) or a pool of reference simulations. A cache from
+    ``cache_factory(fingerprint)`` sits in front of single rows on either,
+    and of batches on the reference engine only: a compiled batch is cheaper
+    to evaluate in one vectorized pass than to look up row by row, and would
+    evict the hot single-request entries. Results are crisp risk values, NaN
+    where no rule fired.
+
+    ``load`` swaps in a new rule base atomically: requests already running
+    finish on the version they started with, later ones use the new one. To
+    report which version answered, take ``state`` once and pass it to the
+    predict call; its ``version`` is the one that computed the result.
+
+    If given, ``observe(phase, seconds)`` is called with the time spent
+    evaluating the rules ('compute') and, on the compiled engine, turning the
+    consequent cuts into a crisp value ('defuzzify'). Grid lookups and the
+    reference engine report a single 'compute' phase.
+    """
+
+    def __init__(self, compiled, grid=None, control_system=None, mode='compiled', pool_size=4,
+                 cache_factory=None, observe=None):
+        if mode not in ENGINES:
+            raise ValueError(f"Unknown engine {mode!r}, expected one of {ENGINES}")
+        self.mode = mode
+        self.pool_size = pool_size
+        self.cache_factory = cache_factory
+        self.observe = observe
+        self.load(compiled, grid, control_system)
+
+    def load(self, compiled, grid=None, control_system=None):
+        if self.mode == 'reference' and control_system is None:
+            raise ValueError("The reference engine needs the skfuzzy control system")
+        simulations = SimulationPool(control_system, self.pool_size) if self.mode == 'reference' else None
+        fingerprint = compiled.fingerprint()
+        cache = self.cache_factory(fingerprint) if self.cache_factory else None
+        # A single attribute assignment, so readers see the old or new state
+        self._state = ModelState(compiled, grid, simulations, cache, fingerprint)
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def version(self):
+        return self._state.version
+
+    @property
+    def compiled(self):
+        return self._state.compiled
+
+    @property
+    def cache(self):
+        return self._state.cache
+
+    def predict_one(self, row, state=None):
+        state = state or self._state
+        if state.cache is None:
+            return self._compute_one(state, row)
+        key = state.cache_key(row)
+        found, risk_value = state.cache.get(key)
+        if not found:
+            risk_value = self._compute_one(state, row)
+            state.cache.put(key, risk_value)
+        return risk_value
+
+    def predict_many(self, rows, state=None):
+        state = state or self._state
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(state.compiled.input_names))
+        if state.cache is None or self.mode == 'compiled':
+            return self._compute_many(state, rows)
+
+        keys = [state.cache_key(row) for row in rows.tolist()]
+        values = np.empty(len(keys))
+        missing = []
+        for i, key in enumerate(keys):
+            found, risk_value = state.cache.get(key)
+            if found:
+                values[i] = risk_value
+            else:
+                missing.append(i)
+        if missing:
+            computed = self._compute_many(state, rows[missing])
+            values[missing] = computed
+            for i, risk_value in zip(missing, computed.tolist()):
+                state.cache.put(keys[i], risk_value)
+        return values
+
+    def explain_many(self, rows, state=None):
+        """
+        ``(memberships, firing, cuts, risk)`` arrays for the rows (see
+        CompiledFuzzySystem.explain), from one pass of the compiled engine
+        whatever the mode: the grid and the cache keep no intermediates.
+        """
+        state = state or self._state
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(state.compiled.input_names))
+        start = time.perf_counter()
+        result = state.compiled.explain(rows)
+        if self.observe is not None:
+            self.observe('compute', time.perf_counter() - start)
+        return result
+
+    def _compute_one(self, state, row):
+        start = time.perf_counter()
+        if self.mode == 'reference':
+            risk_value = self._reference(state, row)
+        else:
+            risk_value = state.grid.lookup_one(row) if state.grid is not None else None
+            if risk_value is None:
+                return float(self._evaluate(state.compiled, [row], start)[0])
+        if self.observe is not None:
+            self.observe('compute', time.perf_counter() - start)
+        return risk_value
+
+    def _compute_many(self, state, rows):
+        start = time.perf_counter()
+        if self.mode == 'reference':
+            values = np.array([self._reference(state, row) for row in rows.tolist()])
+        elif state.grid is None:
+            return self._evaluate(state.compiled, rows, start)
+        else:
+            values, on_grid = state.grid.lookup(rows)
+            if not on_grid.all():
+                values[~on_grid] = self._evaluate(state.compiled, rows[~on_grid], start)
+                return values
+        if self.observe is not None:
+            self.observe('compute', time.perf_counter() - start)
+        return values
+
+    def _evaluate(self, compiled, rows, start):
+        # compiled.compute(), timed as rule evaluation (since ``start``) and
+        # defuzzification
+        if self.observe is None:
+            return compiled.compute(rows)
+        cuts = compiled.consequent_activations(compiled.firing_strengths(compiled.memberships(rows)))
+        split = time.perf_counter()
+        values = compiled.defuzzify(cuts)
+        self.observe('compute', split - start)
+        self.observe('defuzzify', time.perf_counter() - split)
+        return values
+
+    def _reference(self, state, row):
+        with state.simulations.simulation() as simulation:
+            for name, value in zip(state.compiled.input_names, row):
+                simulation.input[name] = value
+            try:
+                simulation.compute()
+            except ValueError:
+                # Raised by skfuzzy's defuzzifier when no rule fired
+                return math.nan
+            return float(simulation.output[state.compiled.output_name])
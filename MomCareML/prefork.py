@@ -0,0 +1,52 @@
+"""
+gunicorn configuration for the preforking serving mode.
+
+    gunicorn -c prefork.py [-w N] [--threads T]
+
+``gunicorn model:app -w N`` imports model.py in every worker, so each one loads
+the rule base and grid, the dropout model and all of their imports on its own.
+Here the app is loaded once, in the master (preload_app), before the workers
+are forked from it:
+
+- the compiled rule base and lookup grid are moved into one read-only shared
+  mapping (see shared_model.py), which every worker uses in place;
+- everything else the master loaded (modules, the dropout model) is shared
+  copy-on-write, and gc.freeze keeps the workers' garbage collector from
+  writing to those objects and so copying the pages they sit on;
+- threads do not survive fork, so the reload pollers are started per worker
+  in post_fork. The shadow scorer and drift monitor already start their
+  threads on first use in each process.
+
+A rule base or registry version swapped in later by a worker's poller is
+compiled into that worker's own memory, as it is without prefork.
+
+benchmarks/prefork.py compares memory and throughput with the per-worker
+layout.
+"""
+import gc
+import multiprocessing
+import os
+
+# Read by model.py while the master imports it
+os.environ['MOMCARE_PREFORK'] = '1'
+
+wsgi_app = 'model:app'
+preload_app = True
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = os.environ.get('BIND', '0.0.0.0:' + os.environ.get('PORT', '8000'))
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+
+
+def when_ready(server):
+    # The app is loaded by now; move what it allocated out of the collector's
+    # reach before the first fork
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import model
+
+    model.start_watchers()
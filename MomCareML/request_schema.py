@@ -0,0 +1,153 @@
+"""
+Schema of the model inputs accepted by the predict routes, checked before
+any inference runs.
+
+A record is a JSON object holding each of the ten inputs as a finite number
+(or a numeric string); booleans, nulls and other types are rejected. By
+default (MOMCARE_INPUT_RANGE=clip) any finite value is accepted and clipped
+to its universe by the engine, as it always has been: the mobile app sends
+0-based option indices, so its first answer to the Place_of_Residence,
+Wealth_index and Distance_to_health questions arrives as 0, below universes
+that start at 1. MOMCARE_INPUT_RANGE=reject also refuses values outside
+[lower, upper] of the rule base being served, for clients that send the
+survey codes themselves.
+
+RequestSchema.row checks one record in a single pass over its fields.
+RequestSchema.rows checks a batch column by column: each field is gathered
+from all records, its types are checked as a set and it is written into a
+float64 column of the batch array, then every column is range-checked at
+once. Only records that fail a check (or need coercing from strings) are
+walked one by one, through row, which words the error. Request bodies are
+decoded with orjson when it is installed, else with json.
+"""
+import json
+import math
+import os
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+INPUT_RANGE = os.environ.get('MOMCARE_INPUT_RANGE', 'clip')
+
+# Smaller batches are checked record by record; NumPy's fixed costs dominate below this
+COLUMNAR_MIN = 16
+
+# bool is not in here: type() is compared exactly, so True and False are refused
+NUMBER_TYPES = {int, float}
+
+
+class InvalidRecord(ValueError):
+    """A request record is not an object, lacks a field or has a bad value."""
+
+
+def loads(body):
+    """Decode a JSON request body; ValueError if it is not valid JSON."""
+    if orjson is not None:
+        # orjson.JSONDecodeError is a ValueError too
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class RequestSchema:
+    """Field names and universe bounds of the model inputs, in row order."""
+
+    def __init__(self, names, lower, upper, input_range=INPUT_RANGE):
+        if input_range not in ('reject', 'clip'):
+            raise ValueError(f"Unknown MOMCARE_INPUT_RANGE {input_range!r}, expected 'reject' or 'clip'")
+        self.names = tuple(names)
+        self.clip = input_range == 'clip'
+        # Clipping still needs a finite value (and an int that fits a float)
+        largest = np.finfo(np.float64).max
+        self.lower = np.full(len(self.names), -largest) if self.clip else np.asarray(lower, dtype=np.float64)
+        self.upper = np.full(len(self.names), largest) if self.clip else np.asarray(upper, dtype=np.float64)
+        self._fields = list(zip(self.names, self.lower.tolist(), self.upper.tolist()))
+
+    @classmethod
+    def for_system(cls, compiled, input_range=INPUT_RANGE):
+        return cls(compiled.input_names, compiled.lower, compiled.upper, input_range)
+
+    def row(self, record):
+        """The record's inputs as a list of numbers, or InvalidRecord."""
+        if not isinstance(record, dict):
+            raise InvalidRecord("Record must be a JSON object")
+        row = []
+        for name, lower, upper in self._fields:
+            try:
+                value = record[name]
+            except KeyError:
+                raise InvalidRecord(f"Missing field '{name}'")
+            kind = type(value)
+            if kind is not float and kind is not int:
+                # bool is a subclass of int, so it lands here and is refused
+                if kind is not str:
+                    raise InvalidRecord(f"Field '{name}' must be a number")
+                try:
+                    value = float(value)
+                except ValueError:
+                    raise InvalidRecord(f"Field '{name}' must be a number")
+            # NaN fails both comparisons
+            if not lower <= value <= upper:
+                if self.clip or value != value:
+                    raise InvalidRecord(f"Field '{name}' must be a finite number")
+                raise InvalidRecord(f"Field '{name}' must be between {lower:g} and {upper:g}")
+            row.append(value)
+        return row
+
+    def rows(self, records):
+        """
+        ``(X, positions, errors)`` for a list of records: the float64 rows of
+        the valid ones, their indices, and an error message per index of the
+        others.
+        """
+        if len(records) < COLUMNAR_MIN:
+            return self._rows_one_by_one(records)
+        errors = {}
+        objects = [i for i, record in enumerate(records) if type(record) is dict]
+        if len(objects) < len(records):
+            for i in set(range(len(records))).difference(objects):
+                errors[i] = "Record must be a JSON object"
+            records = [records[i] for i in objects]
+
+        X = np.empty((len(records), len(self.names)), dtype=np.float64)
+        for j, name in enumerate(self.names):
+            try:
+                column = [record[name] for record in records]
+            except KeyError:
+                # None stands in for a missing field and fails the type check
+                column = [record.get(name) for record in records]
+            if not set(map(type, column)) <= NUMBER_TYPES:
+                # Anything but an int or float becomes NaN, so the range check
+                # sends its record through row()
+                column = [v if type(v) in NUMBER_TYPES else math.nan for v in column]
+            try:
+                X[:, j] = column
+            except OverflowError:
+                # An int beyond float range; row() reports it as out of range
+                X[:, j] = [v if type(v) is float or abs(v) <= 2 ** 1023 else math.nan for v in column]
+        # Range (and NaN) check over whole columns
+        recheck = ~((X >= self.lower) & (X <= self.upper)).all(axis=1)
+
+        valid = ~recheck
+        for k in np.flatnonzero(recheck).tolist():
+            try:
+                X[k] = self.row(records[k])
+                valid[k] = True
+            except InvalidRecord as e:
+                errors[objects[k]] = str(e)
+        if not valid.all():
+            X = X[valid]
+        return X, [i for i, ok in zip(objects, valid.tolist()) if ok], errors
+
+    def _rows_one_by_one(self, records):
+        rows, positions, errors = [], [], {}
+        for i, record in enumerate(records):
+            try:
+                rows.append(self.row(record))
+                positions.append(i)
+            except InvalidRecord as e:
+                errors[i] = str(e)
+        return np.array(rows, dtype=np.float64).reshape(len(rows), len(self.names)), positions, errors
@@ -0,0 +1,175 @@
+"""
+In-process LRU cache of risk values, with an optional shared SQLite tier.
+
+Keys are the normalized input row (floats clipped to the antecedent universes,
+so inputs the engine treats identically share an entry). The shared tier lets
+several gunicorn workers on one machine reuse each other's results; its keys
+are prefixed with the model fingerprint so a changed rule base never reads
+values computed by an older one.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+
+# The shared store drops expired rows (and rows beyond its cap) every this many puts
+PURGE_EVERY = 1000
+
+
+class SharedResultStore:
+    """
+    Risk values in a local SQLite file, one connection per thread. Expired
+    rows, and the oldest rows beyond ``max_rows``, are deleted every
+    PURGE_EVERY puts, so the file stays bounded.
+    """
+
+    def __init__(self, path, namespace, ttl=None, max_rows=None):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._puts = count(1)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS results "
+                         "(key TEXT PRIMARY KEY, value REAL, expires REAL)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection must not be used across fork: the thread that forks
+        # keeps its thread-locals in the child, so they are tagged with the pid
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _key(self, key):
+        return self.namespace + ':' + ','.join(repr(v) for v in key)
+
+    def get(self, key):
+        """``(found, value)``; NaN is stored as NULL."""
+        row = self._connect().execute(
+            "SELECT value, expires FROM results WHERE key = ?", (self._key(key),)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return False, None
+        return True, math.nan if row[0] is None else row[0]
+
+    def put(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        self._connect().execute(
+            "INSERT OR REPLACE INTO results (key, value, expires) VALUES (?, ?, ?)",
+            (self._key(key), None if math.isnan(value) else value, expires))
+        if next(self._puts) % PURGE_EVERY == 0:
+            self.purge()
+
+    def purge(self):
+        conn = self._connect()
+        conn.execute("DELETE FROM results WHERE expires < ?", (time.time(),))
+        if self.max_rows:
+            # A replaced row gets a new rowid, so the lowest ones were written longest ago
+            conn.execute("DELETE FROM results WHERE rowid <= (SELECT MAX(rowid) FROM results) - ?",
+                         (self.max_rows,))
+
+
+class ResultCache:
+    """
+    Bounded LRU of risk values with an optional time-to-live (seconds).
+
+    Safe to share between threads. Counters are exposed through ``stats()``.
+    """
+
+    def __init__(self, max_size=4096, ttl=None, shared=None):
+        if max_size < 1:
+            raise ValueError("Cache size must be at least 1")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """``(found, value)`` for a normalized input row."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+                self.expirations += 1
+
+        if self.shared is not None:
+            found, value = self.shared.get(key)
+            if found:
+                self._store(key, value)
+                with self._lock:
+                    self.shared_hits += 1
+                return True, value
+
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        self._store(key, value)
+        if self.shared is not None:
+            self.shared.put(key, value)
+
+    def _store(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "shared": self.shared.path if self.shared is not None else None,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+
+def cache_from_env(namespace):
+    """
+    Cache configured by MOMCARE_CACHE_SIZE (0 disables it), MOMCARE_CACHE_TTL,
+    MOMCARE_CACHE_DB (path of the shared SQLite store, off by default) and
+    MOMCARE_CACHE_DB_ROWS (rows the shared store keeps, 0 for no cap).
+    """
+    size = int(os.environ.get('MOMCARE_CACHE_SIZE', '4096'))
+    if size <= 0:
+        return None
+    ttl = float(os.environ['MOMCARE_CACHE_TTL']) if os.environ.get('MOMCARE_CACHE_TTL') else None
+    shared = None
+    if os.environ.get('MOMCARE_CACHE_DB'):
+        max_rows = int(os.environ.get('MOMCARE_CACHE_DB_ROWS', '1000000'))
+        shared = SharedResultStore(os.environ['MOMCARE_CACHE_DB'], namespace, ttl=ttl, max_rows=max_rows)
+    return ResultCache(size, ttl=ttl, shared=shared)
@@ -0,0 +1,11 @@
+"""
+scikit-fuzzy ControlSystem for the maternal risk model.
+
+The fuzzy sets and rules are defined in risk_rules.json (see rule_spec.py).
+Importing this module pulls in scikit-fuzzy, which is slow; the server only
+needs it for the reference engine and check_engine.py.
+"""
+from model_artifact import RULES_SOURCE
+from rule_spec import build_control_system, load_spec
+
+risk_ctrl = build_control_system(load_spec(RULES_SOURCE))
@@ -0,0 +1,330 @@
+"""
+Declarative definition of the fuzzy rule base.
+
+The membership functions and rules live in a JSON (or YAML) spec, by default
+risk_rules.json:
+
+    {"inputs": {"Wealth_index": {"universe": [1, 6, 1],
+                                 "terms": {"Poor": [1, 1, 3], ...}}, ...},
+     "output": {"name": "Risk", "universe": [0, 11, 1], "terms": {...}},
+     "rules": [{"if": {"Wealth_index": "Poor", "Distance_to_health": "Far"},
+                "then": "High"}, ...]}
+
+Universes are ``np.arange`` arguments, terms are triangles (3 points) or
+trapezoids (4 points) sampled exactly as skfuzzy's trimf/trapmf do, and rule
+conditions are AND-ed. The spec compiles straight into a CompiledFuzzySystem
+without importing scikit-fuzzy. Check a spec with:
+
+    python rule_spec.py [path]
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+from fuzzy_engine import CompiledFuzzySystem
+
+
+class RuleSpecError(ValueError):
+    """The spec is malformed or refers to inputs/terms it does not define."""
+
+
+def load_spec(path):
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def universe(args):
+    return np.arange(*args).astype(np.float64)
+
+
+def membership(x, points):
+    """Sampled triangle/trapezoid, matching skfuzzy.trimf and skfuzzy.trapmf."""
+    if len(points) == 4:
+        a, b, c, d = points
+        y = np.ones(len(x))
+        left, right = x <= b, x >= c
+        y[left] = membership(x[left], [a, b, b])
+        y[right] = membership(x[right], [c, c, d])
+        y[(x < a) | (x > d)] = 0.0
+        return y
+    a, b, c = points
+    y = np.zeros(len(x))
+    if a != b:
+        idx = (a < x) & (x < b)
+        y[idx] = (x[idx] - a) / float(b - a)
+    if b != c:
+        idx = (b < x) & (x < c)
+        y[idx] = (c - x[idx]) / float(c - b)
+    y[x == b] = 1
+    return y
+
+
+def _is_number(value):
+    # bool is an int subclass, but true/false are not numbers in a spec
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and np.isfinite(value)
+
+
+def _check_variable(name, var):
+    if not isinstance(var, dict) or 'universe' not in var or 'terms' not in var:
+        raise RuleSpecError(f"{name}: needs 'universe' and 'terms'")
+    args = var['universe']
+    if not (isinstance(args, list) and len(args) == 3 and all(map(_is_number, args)) and args[2] > 0):
+        raise RuleSpecError(f"{name}: universe must be [start, stop, step] with step > 0")
+    if universe(args).size < 2:
+        raise RuleSpecError(f"{name}: universe needs at least two points")
+    if not isinstance(var['terms'], dict):
+        raise RuleSpecError(f"{name}: terms must be an object of name: points")
+    if not var['terms']:
+        raise RuleSpecError(f"{name}: has no terms")
+    for term, points in var['terms'].items():
+        if not (isinstance(points, list) and len(points) in (3, 4) and all(map(_is_number, points))):
+            raise RuleSpecError(f"{name}[{term}]: expected 3 (triangle) or 4 (trapezoid) numbers")
+        if any(p > q for p, q in zip(points, points[1:])):
+            raise RuleSpecError(f"{name}[{term}]: points must be non-decreasing")
+
+
+def check_spec(spec):
+    """
+    Validate ``spec``. Raises RuleSpecError for anything that cannot be
+    compiled and returns a list of warnings for things that compile but are
+    probably mistakes (unused terms, universe points no term covers, terms
+    that peak at the same point, conflicting rules).
+    """
+    if not isinstance(spec, dict):
+        raise RuleSpecError("Spec must be an object with 'inputs', 'output' and 'rules'")
+    for key in ('inputs', 'output', 'rules'):
+        if key not in spec:
+            raise RuleSpecError(f"Spec is missing '{key}'")
+    inputs, output = spec['inputs'], spec['output']
+    if not isinstance(inputs, dict) or not inputs:
+        raise RuleSpecError("inputs: must be a non-empty object of name: variable")
+    for name, var in inputs.items():
+        _check_variable(name, var)
+    if not isinstance(output, dict) or not isinstance(output.get('name'), str):
+        raise RuleSpecError("output: needs a 'name'")
+    _check_variable(output['name'], output)
+    if not isinstance(spec['rules'], list) or not spec['rules']:
+        raise RuleSpecError("rules: must be a non-empty list")
+
+    used = {name: set() for name in inputs}
+    seen = {}
+    warnings = []
+    for n, rule in enumerate(spec['rules'], start=1):
+        if not isinstance(rule, dict):
+            raise RuleSpecError(f"rule{n}: must be an object with 'if' and 'then'")
+        conditions = rule.get('if') or {}
+        if not isinstance(conditions, dict):
+            raise RuleSpecError(f"rule{n}: 'if' must be an object of input: term")
+        if not conditions:
+            raise RuleSpecError(f"rule{n}: has no conditions")
+        for name, term in conditions.items():
+            if name not in inputs:
+                raise RuleSpecError(f"rule{n}: unknown input '{name}'")
+            if not isinstance(term, str) or term not in inputs[name]['terms']:
+                raise RuleSpecError(f"rule{n}: unknown term {name}[{term}]")
+            used[name].add(term)
+        then = rule.get('then')
+        if not isinstance(then, str) or then not in output['terms']:
+            raise RuleSpecError(f"rule{n}: unknown output term {then!r}")
+        weight = rule.get('weight', 1.0)
+        if not (_is_number(weight) and 0 <= weight <= 1):
+            raise RuleSpecError(f"rule{n}: weight must be a number between 0 and 1")
+        if not isinstance(rule.get('name', ''), str):
+            raise RuleSpecError(f"rule{n}: name must be a string")
+
+        key = tuple(sorted(conditions.items()))
+        if key in seen:
+            other, then = seen[key]
+            kind = "duplicates" if then == rule['then'] else "contradicts"
+            warnings.append(f"rule{n} {kind} rule{other}")
+        else:
+            seen[key] = (n, rule['then'])
+
+    for name, var in inputs.items():
+        x = universe(var['universe'])
+        shapes = {term: membership(x, points) for term, points in var['terms'].items()}
+        if not used[name]:
+            warnings.append(f"{name} is not used by any rule")
+        for term in var['terms']:
+            if used[name] and term not in used[name]:
+                warnings.append(f"{name}[{term}] is not used by any rule")
+        gaps = x[np.max(list(shapes.values()), axis=0) == 0]
+        if gaps.size:
+            warnings.append(f"{name}: no term covers {', '.join(f'{v:g}' for v in gaps)}")
+        peaks = {}
+        for term, shape in shapes.items():
+            peaks.setdefault(float(x[np.argmax(shape)]), []).append(term)
+        for peak, terms in peaks.items():
+            if len(terms) > 1:
+                warnings.append(f"{name}: {', '.join(repr(t) for t in terms)} all peak at {peak:g}")
+    return warnings
+
+
+def compile_spec(spec):
+    """CompiledFuzzySystem for a spec (validated first)."""
+    check_spec(spec)
+    inputs, output = spec['inputs'], spec['output']
+    names = list(inputs)
+
+    universes, term_labels, term_input, term_mfs = [], [], [], []
+    term_index = {}
+    for i, name in enumerate(names):
+        x = universe(inputs[name]['universe'])
+        universes.append(x)
+        for term, points in inputs[name]['terms'].items():
+            term_index[name, term] = len(term_labels)
+            term_labels.append(f"{name}[{term}]")
+            term_input.append(i)
+            term_mfs.append(membership(x, points))
+
+    rules = spec['rules']
+    width = max(len(rule['if']) for rule in rules)
+    pad = len(term_labels)
+    rule_terms = [[term_index[item] for item in rule['if'].items()] for rule in rules]
+    rule_terms = [terms + [pad] * (width - len(terms)) for terms in rule_terms]
+
+    output_terms = list(output['terms'])
+    output_universe = universe(output['universe'])
+    return CompiledFuzzySystem(
+        input_names=names,
+        universes=universes,
+        term_labels=term_labels,
+        term_input=term_input,
+        term_mfs=term_mfs,
+        rule_labels=[rule.get('name', f"rule{n}") for n, rule in enumerate(rules, start=1)],
+        rule_terms=rule_terms,
+        rule_consequent=[output_terms.index(rule['then']) for rule in rules],
+        rule_weight=[rule.get('weight', 1.0) for rule in rules],
+        output_name=output['name'],
+        output_terms=output_terms,
+        output_universe=output_universe,
+        output_mfs=[membership(output_universe, output['terms'][t]) for t in output_terms],
+    )
+
+
+def build_control_system(spec):
+    """The equivalent scikit-fuzzy ControlSystem, for the reference engine."""
+    import skfuzzy as fuzz
+    from skfuzzy import control as ctrl
+
+    check_spec(spec)
+
+    def shaped(var, x, terms):
+        for term, points in terms.items():
+            var[term] = fuzz.trapmf(x, points) if len(points) == 4 else fuzz.trimf(x, points)
+        return var
+
+    antecedents = {name: shaped(ctrl.Antecedent(np.arange(*var['universe']), name),
+                                np.arange(*var['universe']), var['terms'])
+                   for name, var in spec['inputs'].items()}
+    output = spec['output']
+    consequent = shaped(ctrl.Consequent(np.arange(*output['universe']), output['name']),
+                        np.arange(*output['universe']), output['terms'])
+
+    rules = []
+    for rule in spec['rules']:
+        terms = [antecedents[name][term] for name, term in rule['if'].items()]
+        antecedent = terms[0]
+        for term in terms[1:]:
+            antecedent = antecedent & term
+        then = consequent[rule['then']]
+        if 'weight' in rule:
+            then = then % rule['weight']
+        rules.append(ctrl.Rule(antecedent, then))
+    return ctrl.ControlSystem(rules)
+
+
+class SpecWatcher:
+    """
+    Polls a spec file and passes each new, valid version to
+    ``on_change(spec, compiled)``, where ``compiled = compiler(spec)``.
+    Invalid versions are reported on stderr and the previous rule base stays
+    in service.
+    """
+
+    def __init__(self, path, on_change, interval=5.0, compiler=compile_spec):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.compiler = compiler
+        self._stat = self._signature()
+        # A file that does not exist yet counts as changed once it appears
+        self._digest = self._hash() if self._stat else None
+        self._stop = threading.Event()
+
+    def _signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _hash(self):
+        with open(self.path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def check(self):
+        signature = self._signature()
+        if signature is None or signature == self._stat:
+            return False
+        self._stat = signature
+        digest = self._hash()
+        if digest == self._digest:
+            return False
+        try:
+            spec = load_spec(self.path)
+            compiled = self.compiler(spec)
+        except Exception as e:
+            # Anything a bad edit raises is reported, never fatal to the polling thread
+            print(f"Ignoring invalid rule spec {self.path}: {e}", file=sys.stderr)
+            return False
+        self._digest = digest
+        try:
+            self.on_change(spec, compiled)
+        except Exception as e:
+            print(f"Could not swap in rule spec {self.path}: {e}", file=sys.stderr)
+            return False
+        return True
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name='rule-spec-watcher', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                # e.g. the file vanished between stat and read; try again next time
+                print(f"Could not check rule spec {self.path}: {e}", file=sys.stderr)
+
+
+def main():
+    from model_artifact import RULES_SOURCE
+
+    path = sys.argv[1] if len(sys.argv) > 1 else RULES_SOURCE
+    try:
+        spec = load_spec(path)
+        warnings = check_spec(spec)
+    except (OSError, ValueError) as e:
+        print(f"{path}: {e}")
+        sys.exit(1)
+    print(f"{path}: {len(spec['inputs'])} inputs, {len(spec['rules'])} rules")
+    for warning in warnings:
+        print(f"  warning: {warning}")
+
+
+if __name__ == '__main__':
+    main()
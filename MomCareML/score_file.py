@@ -0,0 +1,260 @@
+"""
+Score a survey export (CSV, JSON array or NDJSON) with the risk model.
+
+    python score_file.py survey.csv -o scored.csv [--chunk-size 5000] [--jobs 4]
+                         [--map "Column name=Education_level" ...]
+
+The file is read and scored in chunks and every chunk is written out before
+the next is read, so memory stays flat whatever the file size. Survey columns
+are matched to the ten model inputs by name (case, spacing and punctuation are
+ignored, so both the questionnaire wording and the model field names work);
+--map overrides or adds a mapping. Values must be the numeric survey codes;
+they are checked as on the HTTP routes (see request_schema.py), and with
+--input-range reject a code outside its universe is reported, not clipped.
+Output keeps each input record and adds predicted_risk, risk_value and error.
+"""
+import argparse
+import csv
+import json
+import math
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from model_artifact import FEATURES
+from request_schema import INPUT_RANGE, RequestSchema
+
+# Accepted column names per model input, in order of preference (normalized)
+SURVEY_COLUMNS = {
+    'CurrAgeGroup': ['curragegroup', 'what_is_your_age'],
+    'Place_of_Residence': ['place_of_residence', 'what_is_your_place_of_residence'],
+    'Education_level': ['education_level', 'what_is_your_highest_level_of_education'],
+    'Wealth_index': ['wealth_index', 'what_is_your_wealth_index'],
+    'marital_status': ['marital_status', 'current_marital_status', 'what_is_your_marital_status'],
+    'Distance_to_health': ['distance_to_health',
+                           'how_far_is_the_nearest_healthcare_facility_from_your_residence'],
+    'Frequency_media_use': ['frequency_media_use', 'freq_of_watching_tv',
+                            'how_frequently_do_you_watch_television',
+                            'freq_of_listening_to_radio', 'how_frequently_do_you_listen_to_the_radio'],
+    'Frequency_of_using_internet': ['frequency_of_using_internet', 'freq_use_internet',
+                                    'how_often_do_you_use_the_internet'],
+    'Antenatal_visits': ['antenatal_visits', 'anc',
+                         'how_many_antenatal_care_anc_visits_did_you_attend_during_your_last_pregnancy'],
+    'Postnatal_visits': ['postnatal_visits', 'pnc',
+                         'how_many_postnatal_care_pnc_visits_did_you_attend'],
+}
+
+RESULT_FIELDS = ['predicted_risk', 'risk_value', 'error']
+
+
+def normalize(name):
+    return re.sub(r'[^0-9a-z]+', '_', str(name).lower()).strip('_')
+
+
+def resolve_columns(columns, overrides=None):
+    """Map each model input to a column of the file, or raise ValueError."""
+    by_normal = {}
+    for column in columns:
+        by_normal.setdefault(normalize(column), column)
+    mapping = {}
+    for feature in FEATURES:
+        for candidate in SURVEY_COLUMNS[feature]:
+            if candidate in by_normal:
+                mapping[feature] = by_normal[candidate]
+                break
+    for column, feature in (overrides or {}).items():
+        if feature not in FEATURES:
+            raise ValueError(f"--map target {feature!r} is not a model input")
+        mapping[feature] = column
+    missing = [f for f in FEATURES if f not in mapping]
+    if missing:
+        raise ValueError(f"No column found for: {', '.join(missing)}")
+    return mapping
+
+
+def read_csv(f):
+    reader = csv.DictReader(f)
+    return reader.fieldnames or [], reader
+
+
+def read_ndjson(f):
+    records = (json.loads(line) for line in f if line.strip())
+    first = next(records, None)
+    if first is None:
+        return [], iter(())
+    return list(first), _prepend(first, records)
+
+
+def read_json_array(f, buffer_size=1 << 16):
+    """Stream the objects of a top-level JSON array without loading it all."""
+    decoder = json.JSONDecoder()
+    buffer = f.read(buffer_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("Expected a JSON array of records")
+    buffer = buffer[1:]
+
+    def records():
+        nonlocal buffer
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except ValueError:
+                more = f.read(buffer_size)
+                if not more:
+                    raise ValueError("Truncated JSON array")
+                buffer += more
+                continue
+            buffer = buffer[end:]
+            yield record
+
+    stream = records()
+    first = next(stream, None)
+    if first is None:
+        return [], iter(())
+    return list(first), _prepend(first, stream)
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+_service = None
+
+
+def _init_worker():
+    global _service
+    from fuzzy_grid import load_grid
+    from model_artifact import load_compiled_risk
+    from prediction_service import PredictionService
+
+    compiled = load_compiled_risk()
+    _service = PredictionService(compiled, grid=load_grid(compiled))
+
+
+def score_chunk(records, mapping, input_range=INPUT_RANGE):
+    """
+    Result fields for each record of a chunk, scored in one batch. Values are
+    checked by the same RequestSchema as the HTTP routes, so a code outside
+    its universe is clipped or reported in ``error`` as ``input_range`` says.
+    """
+    if _service is None:
+        _init_worker()
+    schema = RequestSchema.for_system(_service.compiled, input_range)
+    inputs = [{name: record[column] for name, column in mapping.items() if column in record} for record in records]
+    rows, positions, errors = schema.rows(inputs)
+    results = [None] * len(records)
+    for i, message in errors.items():
+        results[i] = {'error': message}
+    if len(rows):
+        for i, value in zip(positions, _service.predict_many(rows).tolist()):
+            if math.isnan(value):
+                results[i] = {'error': "Risk not identified"}
+            else:
+                results[i] = {'predicted_risk': 'Low' if value <= 5 else 'High', 'risk_value': value}
+    return results
+
+
+def detect_format(path, given):
+    if given:
+        return given
+    lowered = path.lower()
+    if lowered.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if lowered.endswith('.json'):
+        return 'json'
+    return 'csv'
+
+
+def parse_overrides(pairs):
+    overrides = {}
+    for pair in pairs or []:
+        column, sep, feature = pair.rpartition('=')
+        if not sep:
+            raise ValueError(f"--map expects 'column=Feature', got {pair!r}")
+        overrides[column] = feature
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream-score a survey export with the risk model.")
+    parser.add_argument('input', help="CSV, JSON array or NDJSON file ('-' for stdin)")
+    parser.add_argument('-o', '--output', default='-', help="output file, CSV or NDJSON by extension (default stdout, NDJSON)")
+    parser.add_argument('--format', choices=['csv', 'json', 'ndjson'], help="input format (default: by extension)")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--jobs', type=int, default=1, help="worker processes")
+    parser.add_argument('--map', action='append', metavar='COLUMN=FEATURE', help="extra column mapping")
+    parser.add_argument('--input-range', choices=['clip', 'reject'], default=INPUT_RANGE,
+                        help="codes outside a universe: clip them, or report them in the error column "
+                             "(default: MOMCARE_INPUT_RANGE, else %(default)s)")
+    args = parser.parse_args()
+
+    fmt = detect_format(args.input, args.format)
+    source = sys.stdin if args.input == '-' else open(args.input, newline='' if fmt == 'csv' else None)
+    sink = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    out_csv = args.output.lower().endswith('.csv')
+
+    start = time.perf_counter()
+    rows = failed = 0
+    try:
+        columns, records = {'csv': read_csv, 'json': read_json_array, 'ndjson': read_ndjson}[fmt](source)
+        mapping = resolve_columns(columns, parse_overrides(args.map))
+        # Columns come from the first record; keys only later JSON records carry are left out of CSV output
+        writer = csv.DictWriter(sink, fieldnames=list(columns) + RESULT_FIELDS, extrasaction='ignore') if out_csv else None
+        if writer:
+            writer.writeheader()
+
+        def write(chunk, results):
+            nonlocal rows, failed
+            for record, result in zip(chunk, results):
+                if writer:
+                    writer.writerow({**record, **result})
+                else:
+                    sink.write(json.dumps({**record, **result}) + '\n')
+                failed += 'error' in result
+            rows += len(chunk)
+
+        if args.jobs > 1:
+            # Keep at most two chunks per worker in flight so memory stays bounded
+            with ProcessPoolExecutor(args.jobs, initializer=_init_worker) as pool:
+                pending = []
+                for chunk in chunks(records, args.chunk_size):
+                    pending.append((chunk, pool.submit(score_chunk, chunk, mapping, args.input_range)))
+                    if len(pending) >= 2 * args.jobs:
+                        chunk, future = pending.pop(0)
+                        write(chunk, future.result())
+                for chunk, future in pending:
+                    write(chunk, future.result())
+        else:
+            for chunk in chunks(records, args.chunk_size):
+                write(chunk, score_chunk(chunk, mapping, args.input_range))
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if sink is not sys.stdout:
+            sink.close()
+        if source is not sys.stdin:
+            source.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Scored {rows} rows ({failed} without a risk) in {elapsed:.2f}s, "
+          f"{rows / elapsed if elapsed else 0:.0f} rows/sec", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
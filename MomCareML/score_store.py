@@ -0,0 +1,156 @@
+"""
+Last inputs and result per record id, for change-driven re-scoring.
+
+/predict/incremental takes records carrying a stable ``id`` and a
+``fingerprint`` of their inputs (any string the client derives from them, for
+example a hash or an updatedAt timestamp). A record whose fingerprint matches
+the stored one is answered from the store; only new and changed records are
+scored. The stored inputs let a new model version re-score unchanged records
+without the client sending them again, so a client may send just
+``{"id", "fingerprint"}`` for records it believes unchanged.
+
+Entries live in a SQLite file (MOMCARE_SCORE_STORE, default
+momcare_score_store.sqlite3 in the system temp directory, which is writable
+even where the code directory is not, as on Vercel), shared by the workers on
+one machine: about 100 bytes per id (inputs as packed float64, the crisp risk
+value, the model version). Past MOMCARE_SCORE_STORE_ROWS ids (default
+1,000,000, 0 for no cap) the least recently scored ones are deleted, every
+PURGE_EVERY rows written; a record whose id was dropped is scored again when
+it next arrives with its inputs. A store that cannot be opened, read or
+written (a locked or full disk, a corrupt file) raises ScoreStoreError, which
+the routes answer with 503.
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+SCORE_STORE = os.environ.get('MOMCARE_SCORE_STORE',
+                             os.path.join(tempfile.gettempdir(), 'momcare_score_store.sqlite3'))
+
+SCORE_STORE_ROWS = int(os.environ.get('MOMCARE_SCORE_STORE_ROWS', '1000000'))
+
+# Ids per SELECT, under SQLite's bound-parameter limit
+LOOKUP_CHUNK = 500
+
+# Rows written between purges of the least recently scored ids
+PURGE_EVERY = 1000
+
+
+def row_fingerprint(row):
+    """Fingerprint of a row of model inputs, for clients that send none."""
+    return hashlib.blake2b(np.asarray(row, dtype=np.float64).tobytes(), digest_size=8).hexdigest()
+
+
+class ScoreStoreError(RuntimeError):
+    """The score store file cannot be opened, read or written."""
+
+
+class StoredScore:
+    __slots__ = ('fingerprint', 'row', 'risk_value', 'version')
+
+    def __init__(self, fingerprint, row, risk_value, version):
+        self.fingerprint = fingerprint
+        self.row = row
+        self.risk_value = risk_value
+        self.version = version
+
+
+class ScoreStore:
+    """Per-id inputs and results in a SQLite file, one connection per thread."""
+
+    def __init__(self, path=SCORE_STORE, max_rows=SCORE_STORE_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._written = 0
+        try:
+            with self._connect() as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS scores (id TEXT PRIMARY KEY, fingerprint TEXT, "
+                             "inputs BLOB, risk REAL, version TEXT, updated REAL) WITHOUT ROWID")
+                conn.execute("CREATE INDEX IF NOT EXISTS scores_updated ON scores (updated)")
+        except sqlite3.Error as e:
+            raise ScoreStoreError(f"Cannot open the score store {path}: {e}") from e
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, ids):
+        """StoredScore for each of ``ids`` that is in the store."""
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        try:
+            conn = self._connect()
+            for start in range(0, len(ids), LOOKUP_CHUNK):
+                chunk = ids[start:start + LOOKUP_CHUNK]
+                rows = conn.execute(
+                    f"SELECT id, fingerprint, inputs, risk, version FROM scores "
+                    f"WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                for key, fingerprint, inputs, risk, version in rows:
+                    found[key] = StoredScore(fingerprint, np.frombuffer(inputs, dtype=np.float64).tolist(),
+                                             math.nan if risk is None else risk, version)
+        except sqlite3.Error as e:
+            raise ScoreStoreError(f"Cannot read the score store {self.path}: {e}") from e
+        return found
+
+    def put_many(self, entries):
+        """Store ``(id, fingerprint, row, risk_value, version)`` entries in one transaction."""
+        now = time.time()
+        conn = None
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO scores (id, fingerprint, inputs, risk, version, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(key, fingerprint, np.asarray(row, dtype=np.float64).tobytes(),
+                  None if math.isnan(risk_value) else risk_value, version, now)
+                 for key, fingerprint, row, risk_value, version in entries])
+            conn.execute("COMMIT")
+            with self._lock:
+                self._written += len(entries)
+                due = self._written >= PURGE_EVERY
+                if due:
+                    self._written = 0
+            if due:
+                self.purge()
+        except BaseException as e:
+            # Also after a failed COMMIT, so this thread's next BEGIN does not fail
+            if conn is not None and conn.in_transaction:
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            if isinstance(e, sqlite3.Error):
+                raise ScoreStoreError(f"Cannot write the score store {self.path}: {e}") from e
+            raise
+
+    def purge(self):
+        """Delete the least recently scored ids beyond ``max_rows``."""
+        if self.max_rows:
+            # Rows written in the same put share a timestamp; a tie at the cutoff is kept
+            self._connect().execute(
+                "DELETE FROM scores WHERE updated < "
+                "(SELECT updated FROM scores ORDER BY updated DESC LIMIT 1 OFFSET ?)", (self.max_rows - 1,))
+
+    def stats(self):
+        try:
+            count, = self._connect().execute("SELECT COUNT(*) FROM scores").fetchone()
+        except sqlite3.Error as e:
+            raise ScoreStoreError(f"Cannot read the score store {self.path}: {e}") from e
+        # Recent writes sit in the write-ahead log until a checkpoint
+        files = [self.path, self.path + '-wal']
+        return {"path": self.path, "records": count, "max_records": self.max_rows or None,
+                "bytes": sum(os.path.getsize(f) for f in files if os.path.exists(f))}
@@ -0,0 +1,406 @@
+"""
+Shadow (champion-challenger) scoring of live /predict traffic.
+
+    MOMCARE_SHADOW=dropout          the XGBoost ANC dropout model being served
+    MOMCARE_SHADOW=risk:<version>   a rule base from the model registry
+
+Every sampled /predict input is put on a bounded queue after its answer has
+been computed and scored again by the challenger on a background thread, in
+batches. Users only ever see the fuzzy Risk answer. If the queue is full the
+input is dropped (and counted), so the request never waits for it.
+
+Both outputs go to an append-only binary log under MOMCARE_SHADOW_LOG (default
+shadow_logs/ next to this file). There is one file per worker and pair of
+model versions, of fixed-size RECORD entries, next to a .json header naming
+the versions. Summarize the logs with:
+
+    python shadow.py [log_dir]
+
+Latency budget: the queue keeps shadow work off the response path, but it
+still competes with requests for the CPU and the GIL. BudgetController groups
+requests into windows of MOMCARE_SHADOW_WINDOW. Every PROBE-th window runs
+with shadow scoring paused, which gives the baseline p99. If a shadowed
+window's p99 exceeds that baseline by more than MOMCARE_SHADOW_P99_BUDGET_MS,
+the share of requests sampled is halved; once it is back well within budget,
+the share grows again. The window results go to windows-<pid>.jsonl in the
+log directory and to /metrics.
+
+For the dropout model, the fuzzy inputs are mapped onto the survey columns
+the model was trained on (by name, as score_file.py matches them). Any other
+training column is taken from the request body when the client sent it, and
+is missing (NaN, which XGBoost treats as missing) otherwise. The two models
+agree when the fuzzy Risk is High and dropout is predicted, or when Risk is
+Low and no dropout is predicted.
+"""
+import glob
+import json
+import math
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+from model_artifact import FEATURES
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SHADOW = os.environ.get('MOMCARE_SHADOW', '')
+SHADOW_LOG = os.environ.get('MOMCARE_SHADOW_LOG', os.path.join(BASE_DIR, 'shadow_logs'))
+QUEUE_SIZE = int(os.environ.get('MOMCARE_SHADOW_QUEUE', '1024'))
+P99_BUDGET = float(os.environ.get('MOMCARE_SHADOW_P99_BUDGET_MS', '1')) / 1000.0
+WINDOW = int(os.environ.get('MOMCARE_SHADOW_WINDOW', '500'))
+
+# Every PROBE-th window is a baseline window without shadow scoring
+PROBE = 5
+
+# Inputs scored per challenger call
+BATCH_SIZE = 64
+
+# One log entry; 'primary' is the crisp Risk (NaN when no rule fired),
+# 'shadow' the challenger's output, 'missing' the challenger inputs not known
+RECORD = np.dtype([('time', '<f8'), ('inputs', '<f4', (len(FEATURES),)), ('primary', '<f4'),
+                   ('shadow', '<f4'), ('primary_seconds', '<f4'), ('shadow_seconds', '<f4'),
+                   ('queued_seconds', '<f4'), ('missing', 'u1')])
+
+
+class DropoutChallenger:
+    """The served dropout model, looked up through ``current()`` on every batch."""
+
+    kind = 'dropout'
+
+    def __init__(self, current):
+        self.current = current
+        self._sources = {}
+
+    @staticmethod
+    def is_high(values):
+        from dropout_model import THRESHOLD
+
+        return values >= THRESHOLD
+
+    def sources(self, model):
+        """``(column, input index or None, numeric)`` for every column the model reads."""
+        if model.version not in self._sources:
+            from score_file import SURVEY_COLUMNS, normalize
+
+            owner = {alias: FEATURES.index(feature)
+                     for feature, aliases in SURVEY_COLUMNS.items() for alias in aliases}
+            if model.encoder is not None:
+                columns = {}
+                for feature in model.encoder.features:
+                    columns[feature[0]] = columns.get(feature[0], False) or len(feature) == 1
+            else:
+                columns = dict.fromkeys(model.feature_names, True)
+            self._sources[model.version] = [(column, owner.get(normalize(column)), numeric)
+                                            for column, numeric in columns.items()]
+        return self._sources[model.version]
+
+    def score(self, rows, records):
+        """``(outputs, missing counts, version)``."""
+        model = self.current()
+        if model is None:
+            raise LookupError("dropout model is not available")
+        sources = self.sources(model)
+        inputs, missing = [], []
+        for row, record in zip(rows, records):
+            values, absent = {}, 0
+            for column, index, numeric in sources:
+                if index is not None:
+                    value = row[index]
+                elif column in record:
+                    value = record[column]
+                    if numeric:
+                        try:
+                            value = float(value)
+                        except (TypeError, ValueError):
+                            value, absent = math.nan, absent + 1
+                else:
+                    value, absent = math.nan, absent + 1
+                values[column] = value
+            inputs.append(values)
+            missing.append(absent)
+        if model.encoder is not None:
+            X = model.encoder.transform_records(inputs)
+        else:
+            X = np.array([[values[name] for name in model.feature_names] for values in inputs], dtype=np.float32)
+        return model.predict_proba(X), missing, model.version
+
+
+class RiskChallenger:
+    """Another version of the rule base, e.g. one registered but not promoted."""
+
+    kind = 'risk'
+
+    def __init__(self, compiled):
+        self.compiled = compiled
+        self.version = compiled.fingerprint()[:12]
+
+    @staticmethod
+    def is_high(values):
+        return values > 5
+
+    def score(self, rows, records):
+        return self.compiled.compute(np.asarray(rows, dtype=np.float64)), [0] * len(rows), self.version
+
+
+class BudgetController:
+    """
+    Decides which requests are shadowed so that shadow scoring adds at most
+    ``budget`` seconds to p99 latency (see the module docstring).
+    """
+
+    def __init__(self, budget, window=WINDOW, probe=PROBE, min_rate=0.01, on_window=None):
+        self.budget = budget
+        self.window = window
+        self.probe = probe
+        self.min_rate = min_rate
+        self.on_window = on_window
+        self.rate = 1.0
+        self.baseline = None
+        self.overhead = None
+        self._baselines = []
+        self._latencies = []
+        # Window 0 is a baseline window, so there is a baseline before any shadowing
+        self._windows = 0
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        """False during baseline windows."""
+        return self._windows % self.probe != 0
+
+    def sample(self):
+        return self.active and self.rate > 0 and (self.rate >= 1 or random.random() < self.rate)
+
+    def record(self, seconds):
+        """Latency of one request; closes the window every ``window`` requests."""
+        with self._lock:
+            self._latencies.append(seconds)
+            if len(self._latencies) < self.window:
+                return
+            latencies, self._latencies = self._latencies, []
+            active = self.active
+            self._windows += 1
+        p99 = float(np.percentile(latencies, 99))
+        if not active:
+            # Median of the last few baselines, so one noisy window does not move it
+            self._baselines = self._baselines[-2:] + [p99]
+            self.baseline = float(np.median(self._baselines))
+        elif self.baseline is not None:
+            self.overhead = p99 - self.baseline
+            if self.overhead > self.budget:
+                self.rate = self.rate / 2 if self.rate / 2 >= self.min_rate else 0.0
+            elif self.overhead < self.budget / 2:
+                self.rate = min(1.0, max(self.rate * 1.25, self.min_rate))
+        if self.on_window is not None:
+            self.on_window({'time': time.time(), 'shadowed': active, 'requests': len(latencies), 'p99': p99,
+                            'baseline_p99': self.baseline, 'rate': self.rate, 'budget': self.budget})
+
+
+class ShadowScorer:
+    """
+    Bounded queue of (input, primary answer) pairs, scored by ``challenger``
+    on a background thread and appended to logs under ``log_dir``.
+    """
+
+    def __init__(self, challenger, log_dir=SHADOW_LOG, queue_size=QUEUE_SIZE, budget=P99_BUDGET,
+                 window=WINDOW, metrics=None):
+        self.challenger = challenger
+        self.log_dir = log_dir
+        self.metrics = metrics
+        self.queue = queue.Queue(queue_size)
+        self.controller = BudgetController(budget, window, on_window=self._window_done)
+        self._files = {}
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def offer(self, row, record, primary, version, seconds):
+        """Queue one answered request for shadow scoring, if it is sampled."""
+        if not self.controller.sample():
+            return
+        self._ensure_started()
+        item = (time.time(), time.perf_counter(), row, record, math.nan if primary is None else primary,
+                version, seconds)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self._count('momcare_shadow_dropped_total', ('reason', 'queue_full'))
+
+    def observe(self, seconds):
+        """Total latency of a /predict request, shadowed or not."""
+        self.controller.record(seconds)
+
+    def _ensure_started(self):
+        # Started on first use, and again in a forked worker (threads do not survive fork)
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._files = {}
+                self._thread = threading.Thread(target=self._run, name='shadow-scorer', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for f in self._files.values():
+            f.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                batch = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Baseline windows measure latency without shadow work
+            while not self.controller.active and not self._stop.wait(0.005):
+                pass
+            self._score(batch)
+
+    def _score(self, batch):
+        start = time.perf_counter()
+        try:
+            outputs, missing, shadow_version = self.challenger.score([item[2] for item in batch],
+                                                                     [item[3] for item in batch])
+        except Exception as e:
+            self._count('momcare_shadow_dropped_total', ('reason', type(e).__name__), len(batch))
+            return
+        seconds = (time.perf_counter() - start) / len(batch)
+        entries = np.zeros(len(batch), dtype=RECORD)
+        for entry, (logged, queued, row, _, primary, _, primary_seconds), absent in zip(entries, batch, missing):
+            entry['time'] = logged
+            entry['inputs'] = row
+            entry['primary'] = primary
+            entry['primary_seconds'] = primary_seconds
+            entry['queued_seconds'] = start - queued
+            entry['missing'] = min(absent, 255)
+        entries['shadow'] = outputs
+        entries['shadow_seconds'] = seconds
+        # A hot swap can change the primary version within a batch
+        versions = np.array([item[5] for item in batch])
+        for version in np.unique(versions):
+            self._log(version, shadow_version).write(entries[versions == version].tobytes())
+        if self.metrics is not None:
+            self.metrics.count('momcare_shadow_records_total', amount=len(batch))
+            self.metrics.observe('momcare_shadow_seconds', None, seconds)
+
+    def _log(self, primary_version, shadow_version):
+        key = (primary_version, shadow_version)
+        if key not in self._files:
+            os.makedirs(self.log_dir, exist_ok=True)
+            base = os.path.join(self.log_dir, f"{primary_version}-{self.challenger.kind}-{shadow_version}-{os.getpid()}")
+            with open(base + '.json', 'w') as f:
+                json.dump({'primary': primary_version, 'kind': self.challenger.kind, 'shadow': shadow_version,
+                           'features': list(FEATURES), 'dtype': RECORD.descr}, f)
+            # Unbuffered appends: each batch is one write
+            self._files[key] = open(base + '.bin', 'ab', buffering=0)
+        return self._files[key]
+
+    def _window_done(self, window):
+        if self.metrics is not None:
+            self.metrics.set('momcare_shadow_rate', self.controller.rate)
+            if self.controller.overhead is not None:
+                self.metrics.set('momcare_shadow_p99_overhead_seconds', self.controller.overhead)
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+            with open(os.path.join(self.log_dir, f"windows-{os.getpid()}.jsonl"), 'a') as f:
+                f.write(json.dumps(window) + '\n')
+        except OSError as e:
+            print(f"Could not log shadow window: {e}", file=sys.stderr)
+
+    def _count(self, name, label=None, amount=1):
+        if self.metrics is not None:
+            self.metrics.count(name, label, amount)
+
+
+def shadow_from_env(registry, current_dropout, metrics=None, spec=SHADOW):
+    """ShadowScorer for MOMCARE_SHADOW, or None when shadow mode is off."""
+    if not spec:
+        return None
+    if spec == 'dropout':
+        challenger = DropoutChallenger(current_dropout)
+    elif spec.startswith('risk:'):
+        version = registry.resolve('risk', spec[len('risk:'):])
+        challenger = RiskChallenger(registry.load_risk(version)[1])
+    else:
+        raise ValueError(f"Unknown MOMCARE_SHADOW {spec!r}, expected 'dropout' or 'risk:<version>'")
+    print(f"Shadow scoring /predict with the {challenger.kind} model", file=sys.stderr)
+    return ShadowScorer(challenger, metrics=metrics)
+
+
+def percentiles(values, points=(50, 99)):
+    return [float(np.percentile(values, p)) * 1000 if len(values) else math.nan for p in points]
+
+
+def summarize(log_dir):
+    """Print agreement and latency per pair of model versions, then the budget windows."""
+    pairs = {}
+    for header_path in sorted(glob.glob(os.path.join(log_dir, '*.json'))):
+        with open(header_path) as f:
+            header = json.load(f)
+        dtype = np.dtype([tuple(field) if len(field) == 2 else (field[0], field[1], tuple(field[2]))
+                          for field in header['dtype']])
+        entries = np.fromfile(header_path[:-len('.json')] + '.bin', dtype=dtype)
+        key = (header['primary'], header['kind'], header['shadow'])
+        pairs.setdefault(key, []).append(entries)
+
+    for (primary_version, kind, shadow_version), parts in sorted(pairs.items()):
+        entries = np.concatenate(parts)
+        is_high = DropoutChallenger.is_high if kind == 'dropout' else RiskChallenger.is_high
+        identified = ~np.isnan(entries['primary'])
+        scored = identified & ~np.isnan(entries['shadow'])
+        primary_high = entries['primary'][scored] > 5
+        shadow_high = is_high(entries['shadow'][scored])
+        print(f"risk {primary_version} vs {kind} {shadow_version}: {len(entries)} requests")
+        if scored.any():
+            agree = float((primary_high == shadow_high).mean())
+            # Agreement expected by chance from the two marginal High rates
+            p, q = primary_high.mean(), shadow_high.mean()
+            chance = p * q + (1 - p) * (1 - q)
+            kappa = (agree - chance) / (1 - chance) if chance < 1 else math.nan
+            print(f"  agreement {agree:.1%} (kappa {kappa:.3f}) over {scored.sum()} with both outputs")
+            print(f"  {'':<14} {kind + ' Low':>14} {kind + ' High':>14}")
+            for label, rows in (('Risk Low', ~primary_high), ('Risk High', primary_high)):
+                print(f"  {label:<14} {int((rows & ~shadow_high).sum()):>14} {int((rows & shadow_high).sum()):>14}")
+        print(f"  risk not identified: {int((~identified).sum())}; "
+              f"challenger inputs missing: {float(entries['missing'].mean()):.2f} per request")
+        if kind == 'dropout':
+            for label, rows in (('Low', ~primary_high), ('High', primary_high)):
+                if rows.any():
+                    print(f"  mean dropout probability when Risk {label}: "
+                          f"{float(entries['shadow'][scored][rows].mean()):.3f}")
+        print("  ms (p50 / p99): request {:.3f} / {:.3f}, shadow per request {:.3f} / {:.3f}, "
+              "queued {:.3f} / {:.3f}".format(*percentiles(entries['primary_seconds']),
+                                             *percentiles(entries['shadow_seconds']),
+                                             *percentiles(entries['queued_seconds'])))
+
+    windows = []
+    for path in glob.glob(os.path.join(log_dir, 'windows-*.jsonl')):
+        with open(path) as f:
+            windows.extend(json.loads(line) for line in f if line.strip())
+    windows.sort(key=lambda w: w['time'])
+    overheads = [w['p99'] - w['baseline_p99'] for w in windows if w['shadowed'] and w['baseline_p99'] is not None]
+    if overheads:
+        budget = windows[-1]['budget']
+        over = sum(o > budget for o in overheads)
+        print(f"p99 overhead over {len(overheads)} shadowed windows: median {np.median(overheads) * 1000:.3f} ms, "
+              f"max {max(overheads) * 1000:.3f} ms, budget {budget * 1000:.3f} ms, {over} over budget; "
+              f"sampling rate now {windows[-1]['rate']:.2f}")
+    elif not pairs:
+        print(f"No shadow logs in {log_dir}")
+
+
+if __name__ == '__main__':
+    summarize(sys.argv[1] if len(sys.argv) > 1 else SHADOW_LOG)
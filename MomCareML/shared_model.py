@@ -0,0 +1,69 @@
+"""
+Model arrays in memory shared by every prefork worker.
+
+Under ``gunicorn -c prefork.py`` the app is imported once, in the master, and
+the workers are forked from it. share_arrays then moves the NumPy arrays of
+the compiled rule base and the lookup grid (membership samples, rule/term
+matrices, consequent shapes, grid tables) into one anonymous shared mapping
+and marks them read-only. Forked workers inherit the mapping, so they attach
+to the same physical pages without copying or unpickling anything. Because
+the pages are mapped shared rather than copy-on-write, a worker can never
+end up with a private copy of them.
+
+An anonymous mmap is used rather than a named multiprocessing.shared_memory
+block: only forked children need it, and it cannot outlive the master as a
+leaked /dev/shm entry.
+"""
+import mmap
+
+import numpy as np
+
+# Every array starts on a cache line
+ALIGN = 64
+
+
+def _aligned(size):
+    return -(-size // ALIGN) * ALIGN
+
+
+def _shareable(value):
+    return isinstance(value, np.ndarray) and value.dtype != object and value.size > 0
+
+
+def _arrays(obj):
+    """``(attribute, index, array)`` for the array attributes of ``obj``, and arrays in list or tuple attributes."""
+    for name, value in vars(obj).items():
+        if _shareable(value):
+            yield name, None, value
+        elif isinstance(value, (list, tuple)):
+            for i, item in enumerate(value):
+                if _shareable(item):
+                    yield name, i, item
+
+
+def share_arrays(*objects):
+    """
+    Replace the array attributes of ``objects`` with read-only views of one
+    shared anonymous mapping, holding the same values (None, e.g. a missing
+    grid, is skipped). Returns the number of bytes mapped.
+    """
+    found = [(obj, name, i, np.ascontiguousarray(array)) for obj in objects if obj is not None
+             for name, i, array in _arrays(obj)]
+    size = sum(_aligned(array.nbytes) for *_, array in found)
+    if not size:
+        return 0
+    buffer = mmap.mmap(-1, size, flags=mmap.MAP_SHARED)
+
+    offset = 0
+    for obj, name, i, array in found:
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=buffer, offset=offset)
+        view[...] = array
+        view.flags.writeable = False
+        offset += _aligned(array.nbytes)
+        if i is None:
+            setattr(obj, name, view)
+        else:
+            items = list(getattr(obj, name))
+            items[i] = view
+            setattr(obj, name, type(getattr(obj, name))(items))
+    return size
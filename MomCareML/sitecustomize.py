@@ -11,9 +11,6 @@ python39_site_packages = '/opt/python3.9/lib/python3.9/site-packages'
 if os.path.isdir(python39_site_packages):
     sys.path.insert(0, python39_site_packages)
 
-# Forcibly try to import and make 'distutils' available
-try:
-    import distutils
-    print("Successfully imported distutils via sitecustomize.py")
-except ImportError:
-    print("Failed to import distutils via sitecustomize.py")
\ No newline at end of file
+# 'distutils' (needed by skfuzzy.image) is resolved from the paths above when
+# skfuzzy is first imported. It is no longer imported eagerly here, since the
+# server only imports skfuzzy when it has to build the model from source.
@@ -0,0 +1,471 @@
+"""
+Sweeps of the risk rule base over its whole input space.
+
+    python sweep.py [--rules risk_rules.json | --version <registry version>]
+                    [--mode grid|sample] [--points N] [--samples N] [--seed 0]
+                    [--splits 2] [--split NAME=K ...] [--chunk 65536] [--jobs N]
+                    [--out sweep_out] [--parquet] [--prune]
+
+--mode grid evaluates every combination of the input universes (the integer
+survey codes, 129.6M rows for the shipped spec; --points N thins each input
+to at most N evenly spaced values). --mode sample draws --samples uniform
+rows instead. Either way the space is cut into blocks: each input's range is
+split into --splits parts (--split overrides it per input) and every
+combination of parts is one block, evaluated in chunks of --chunk rows by a
+pool of --jobs processes. Grid rows read their memberships from a table
+built once per input value and defuzzify each distinct set of cut levels
+once, so the full grid takes about five minutes per core.
+
+A block's cache key hashes only what its risk values depend on: its points,
+the rules that can fire somewhere in it, the membership samples those rules
+read there, and the output terms. Each block is written to
+``<out>/blocks/<key>.npz``; a re-run after a rule change finds the blocks
+whose key is unchanged and only evaluates the rest (the summary reports how
+many were reused). --prune removes block files the current run did not use.
+
+The totals over all blocks are written to <out>:
+
+    summary.json     points, "Risk not identified" (nothing fired) and High
+                     fractions, per-input sensitivity, blocks reused/computed
+    effects.npz      per input: its values, mean risk, High share and
+                     unfired share at each value
+    maps.npz         per input pair: High share and unfired share over the
+                     two inputs' values; the Low/High boundary is where the
+                     High share crosses 0.5
+    *.parquet        the same tables in long form, with --parquet
+
+Sensitivity of an input is its correlation ratio (the share of the risk
+variance over fired rows explained by that input alone), alongside the
+spread of its mean risk and High share across its values.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SWEEP_DIR = os.path.join(BASE_DIR, 'sweep_out')
+
+# Part of every block key; bump when the block contents or statistics change
+SWEEP_FORMAT = 1
+
+
+def _parts(count, splits):
+    # Contiguous index ranges covering range(count)
+    return [(int(p[0]), int(p[-1]) + 1) for p in np.array_split(np.arange(count), min(splits, count))]
+
+
+class SweepPlan:
+    """
+    The blocks of a sweep over ``compiled``'s inputs.
+
+    ``bins`` holds, per input, the values its statistics are grouped by: the
+    grid values in grid mode, the universe points in sample mode (a sampled
+    value counts towards the nearest one).
+    """
+
+    def __init__(self, compiled, mode='grid', points=None, samples=1_000_000, seed=0,
+                 splits=2, split_overrides=None):
+        if mode not in ('grid', 'sample'):
+            raise ValueError(f"Unknown sweep mode {mode!r}, expected 'grid' or 'sample'")
+        self.compiled = compiled
+        self.mode = mode
+        self.seed = seed
+        split_overrides = split_overrides or {}
+        unknown = set(split_overrides) - set(compiled.input_names)
+        if unknown:
+            raise ValueError(f"Unknown inputs in --split: {sorted(unknown)}")
+
+        self.bins = []
+        for u in compiled.universes:
+            if mode == 'grid' and points and u.size > points:
+                u = np.linspace(u[0], u[-1], points)
+            self.bins.append(u)
+        self.parts = [_parts(b.size, split_overrides.get(name, splits))
+                      for name, b in zip(compiled.input_names, self.bins)]
+        self.blocks = list(itertools.product(*[range(len(p)) for p in self.parts]))
+        self.samples_per_block = -(-samples // len(self.blocks))
+        self.points = (int(np.prod([b.size for b in self.bins], dtype=np.int64)) if mode == 'grid'
+                       else self.samples_per_block * len(self.blocks))
+        self.pairs = list(itertools.combinations(range(len(self.bins)), 2))
+        if mode == 'grid':
+            # Every grid row takes its memberships from this table, one row
+            # per bin (the last bin repeated for shorter inputs)
+            width = max(b.size for b in self.bins)
+            X = np.column_stack([np.pad(b, (0, width - b.size), 'edge') for b in self.bins])
+            self._memberships = compiled.memberships(X)
+            self._term_input = np.append(compiled.term_input, 0)
+            self._term_columns = np.arange(len(compiled.term_labels) + 1)
+            # Every cut level a grid row can reach: a membership times a weight
+            self._levels = np.unique(np.append(np.outer(self._memberships, compiled.rule_weight), 0.0))
+
+    def block_ranges(self, block):
+        """Per input, the ``(first, stop)`` bin indices of ``block``."""
+        return [self.parts[i][p] for i, p in enumerate(block)]
+
+    def block_bounds(self, block):
+        """Per input, the lowest and highest value ``block`` can hold."""
+        ranges = self.block_ranges(block)
+        if self.mode == 'grid':
+            return [(b[lo], b[hi - 1]) for b, (lo, hi) in zip(self.bins, ranges)]
+        # Sample blocks tile the continuous range, meeting halfway between bins
+        bounds = []
+        for b, (lo, hi) in zip(self.bins, ranges):
+            low = b[0] if lo == 0 else (b[lo - 1] + b[lo]) / 2
+            high = b[-1] if hi == b.size else (b[hi - 1] + b[hi]) / 2
+            bounds.append((low, high))
+        return bounds
+
+    def block_key(self, block):
+        """Content hash of everything the risk values in ``block`` depend on."""
+        c = self.compiled
+        bounds = self.block_bounds(block)
+        # Universe samples each input interpolates between inside the block
+        windows = []
+        for u, (low, high) in zip(c.universes, bounds):
+            first = max(int(np.searchsorted(u, low, 'right')) - 1, 0)
+            last = min(int(np.searchsorted(u, high, 'left')), u.size - 1)
+            windows.append((first, last + 1))
+        samples = [c.term_mfs[k][slice(*windows[c.term_input[k]])] for k in range(len(c.term_labels))]
+        active = [bool(s.max() > 0) for s in samples] + [True]
+
+        digest = hashlib.sha256(f"{SWEEP_FORMAT}:{self.mode}:{self.seed}".encode())
+        for i, (lo, hi) in enumerate(self.block_ranges(block)):
+            if self.mode == 'grid':
+                digest.update(self.bins[i][lo:hi].tobytes())
+            else:
+                digest.update(np.array(bounds[i] + (lo, hi), dtype=np.float64).tobytes())
+                digest.update(self.bins[i].tobytes())
+        digest.update(str(self.samples_per_block if self.mode == 'sample' else 0).encode())
+
+        pad = len(c.term_labels)
+        rules, terms = [], set()
+        for row, consequent, weight in zip(c.rule_terms, c.rule_consequent, c.rule_weight):
+            used = [k for k in row.tolist() if k != pad]
+            if all(active[k] for k in used):
+                rules.append((sorted(c.term_labels[k] for k in used), c.output_terms[consequent],
+                              float(weight)))
+                terms.update(used)
+        digest.update(json.dumps(sorted(rules)).encode())
+        for k in sorted(terms, key=lambda k: c.term_labels[k]):
+            lo, hi = windows[c.term_input[k]]
+            digest.update(c.term_labels[k].encode() + b'\0')
+            digest.update(c.universes[c.term_input[k]][lo:hi].tobytes() + samples[k].tobytes())
+        digest.update(json.dumps(c.output_terms).encode())
+        digest.update(c.output_universe.tobytes() + c.output_mfs.tobytes())
+        return digest.hexdigest()[:24]
+
+    def risk(self, codes, X):
+        """Crisp values for rows ``X`` (grid rows looked up through their ``codes``)."""
+        c = self.compiled
+        if self.mode == 'sample':
+            return c.compute(X)
+        mu = self._memberships[codes[:, self._term_input], self._term_columns]
+        cuts = c.consequent_activations(c.firing_strengths(mu))
+        # Cut levels on a grid repeat a lot; defuzzify each distinct set once
+        levels = np.minimum(np.searchsorted(self._levels, cuts), self._levels.size - 1)
+        if not np.array_equal(self._levels[levels], cuts):
+            return c.defuzzify(cuts)
+        shape = (self._levels.size,) * cuts.shape[1]
+        distinct, inverse = np.unique(np.ravel_multi_index(tuple(levels.T), shape), return_inverse=True)
+        return c.defuzzify(self._levels[np.column_stack(np.unravel_index(distinct, shape))])[inverse]
+
+    def layout(self):
+        """Offsets of each input's bins and each pair's cells in the packed counts."""
+        sizes = [b.size for b in self.bins]
+        bin_offsets = np.concatenate([[0], np.cumsum(sizes)])
+        pair_offsets = np.concatenate([[0], np.cumsum([sizes[i] * sizes[j] for i, j in self.pairs])])
+        return bin_offsets, pair_offsets
+
+
+class BlockStats:
+    """
+    Counts for one block (or the sum of several), packed into flat arrays so
+    they add up with ``+=``.
+
+    ``totals``: rows, fired rows, High rows, sum and sum of squares of risk.
+    ``effects``: per input bin, rows, fired, High and risk sum.
+    ``maps``: per input pair cell, rows, fired and High.
+    """
+
+    def __init__(self, plan):
+        bin_offsets, pair_offsets = plan.layout()
+        self.totals = np.zeros(5)
+        self.effects = np.zeros((4, bin_offsets[-1]))
+        self.maps = np.zeros((3, pair_offsets[-1]))
+
+    def add(self, plan, codes, risk):
+        """Count rows with per-input bin indices ``codes`` and values ``risk``."""
+        bin_offsets, pair_offsets = plan.layout()
+        fired = ~np.isnan(risk)
+        value = np.where(fired, risk, 0.0)
+        # 0: nothing fired, 1: Low, 2: High; one count per (cell, state)
+        state = fired.astype(np.intp) + (risk > 5)
+        self.totals += (risk.size, fired.sum(), (state == 2).sum(), value.sum(), (value * value).sum())
+        for i, b in enumerate(plan.bins):
+            base = bin_offsets[i]
+            self.effects[:3, base:base + b.size] += _state_counts(codes[:, i], state, b.size)
+            self.effects[3, base:base + b.size] += np.bincount(codes[:, i], value, b.size)
+        for n, (i, j) in enumerate(plan.pairs):
+            base, stop = pair_offsets[n], pair_offsets[n + 1]
+            cell = codes[:, i] * plan.bins[j].size + codes[:, j]
+            self.maps[:, base:stop] += _state_counts(cell, state, stop - base)
+
+    def merge(self, other):
+        self.totals += other.totals
+        self.effects += other.effects
+        self.maps += other.maps
+
+    def save(self, path, risk):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, totals=self.totals, effects=self.effects, maps=self.maps,
+                                risk=risk.astype(np.float16))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, plan, path):
+        stats = cls(plan)
+        with np.load(path) as data:
+            stats.totals, stats.effects, stats.maps = data['totals'], data['effects'], data['maps']
+        return stats
+
+
+def _state_counts(cell, state, cells):
+    # Rows, fired rows and High rows per cell
+    counts = np.bincount(cell * 3 + state, minlength=3 * cells).reshape(cells, 3)
+    return np.stack([counts.sum(axis=1), counts[:, 1] + counts[:, 2], counts[:, 2]])
+
+
+def block_rows(plan, block, chunk):
+    """``(codes, X)`` for the rows of ``block``, ``chunk`` rows at a time."""
+    ranges = plan.block_ranges(block)
+    if plan.mode == 'grid':
+        shape = tuple(hi - lo for lo, hi in ranges)
+        total = int(np.prod(shape, dtype=np.int64))
+        for start in range(0, total, chunk):
+            index = np.unravel_index(np.arange(start, min(start + chunk, total)), shape)
+            codes = np.column_stack([idx + lo for idx, (lo, _) in zip(index, ranges)])
+            X = np.column_stack([b[c] for b, c in zip(plan.bins, codes.T)])
+            yield codes, X
+        return
+    # Seeded by the block's position, so a block draws the same rows every run
+    rng = np.random.default_rng([plan.seed, *block])
+    bounds = np.array(plan.block_bounds(block))
+    midpoints = [(b[1:] + b[:-1]) / 2 for b in plan.bins]
+    left = plan.samples_per_block
+    while left:
+        n = min(chunk, left)
+        X = rng.uniform(bounds[:, 0], bounds[:, 1], (n, len(plan.bins)))
+        codes = np.column_stack([np.searchsorted(m, x) for m, x in zip(midpoints, X.T)])
+        yield codes, X
+        left -= n
+
+
+def evaluate_block(plan, block, path, chunk):
+    """Evaluate ``block``, write it to ``path`` and return its BlockStats."""
+    stats = BlockStats(plan)
+    values = []
+    for codes, X in block_rows(plan, block, chunk):
+        risk = plan.risk(codes, X)
+        stats.add(plan, codes, risk)
+        values.append(risk)
+    stats.save(path, np.concatenate(values))
+    return stats
+
+
+# The plan, set once per pool worker by _init_worker
+_plan = None
+
+
+def _init_worker(plan):
+    global _plan
+    _plan = plan
+
+
+def _evaluate(task):
+    block, path, chunk = task
+    return evaluate_block(_plan, block, path, chunk)
+
+
+def run_sweep(plan, out=SWEEP_DIR, chunk=65536, jobs=1, prune=False):
+    """
+    Evaluate ``plan``, reusing cached blocks in ``out``; returns
+    ``(stats, reused, computed)``.
+    """
+    block_dir = os.path.join(out, 'blocks')
+    os.makedirs(block_dir, exist_ok=True)
+    paths = [os.path.join(block_dir, plan.block_key(block) + '.npz') for block in plan.blocks]
+    results = [BlockStats.load(plan, path) if os.path.exists(path) else None for path in paths]
+    pending = [(block, path, chunk) for block, path, stats in zip(plan.blocks, paths, results)
+               if stats is None]
+    missing = [n for n, stats in enumerate(results) if stats is None]
+
+    if jobs > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(plan,)) as pool:
+            computed = list(pool.map(_evaluate, pending))
+    else:
+        computed = [evaluate_block(plan, *task) for task in pending]
+    for n, stats in zip(missing, computed):
+        results[n] = stats
+    # Summed in block order, so cached and fresh runs agree to the last bit
+    total = BlockStats(plan)
+    for stats in results:
+        total.merge(stats)
+
+    if prune:
+        keep = {os.path.basename(p) for p in paths}
+        for name in os.listdir(block_dir):
+            if name.endswith('.npz') and name not in keep:
+                os.remove(os.path.join(block_dir, name))
+    return total, len(paths) - len(pending), len(pending)
+
+
+def _share(part, whole):
+    return np.divide(part, whole, out=np.full(part.shape, np.nan), where=whole > 0)
+
+
+def report(plan, stats):
+    """``(summary, effects, maps)`` dicts from the summed counts."""
+    names = plan.compiled.input_names
+    bin_offsets, pair_offsets = plan.layout()
+    rows, fired, high, risk_sum, risk_sq = stats.totals
+    mean = risk_sum / fired if fired else np.nan
+    variance = risk_sq / fired - mean * mean if fired else np.nan
+
+    effects, sensitivity = {}, {}
+    for i, name in enumerate(names):
+        n, f, h, s = stats.effects[:, bin_offsets[i]:bin_offsets[i + 1]]
+        mean_risk = _share(s, f)
+        high_share = _share(h, n)
+        effects[name] = {'values': plan.bins[i], 'rows': n, 'mean_risk': mean_risk,
+                         'high_share': high_share, 'unfired_share': _share(n - f, n)}
+        seen = f > 0
+        between = (f[seen] * (mean_risk[seen] - mean) ** 2).sum() / fired if fired else np.nan
+        sensitivity[name] = {
+            'correlation_ratio': float(between / variance) if variance > 0 else 0.0,
+            'mean_risk_range': float(np.ptp(mean_risk[seen])) if seen.any() else 0.0,
+            'high_share_range': float(np.nanmax(high_share) - np.nanmin(high_share)),
+        }
+
+    maps = {}
+    for n_pair, (i, j) in enumerate(plan.pairs):
+        n, f, h = stats.maps[:, pair_offsets[n_pair]:pair_offsets[n_pair + 1]]
+        shape = (plan.bins[i].size, plan.bins[j].size)
+        maps[f"{names[i]}__{names[j]}"] = {'high_share': _share(h, n).reshape(shape),
+                                          'unfired_share': _share(n - f, n).reshape(shape)}
+
+    summary = {
+        'fingerprint': plan.compiled.fingerprint(),
+        'mode': plan.mode,
+        'points': int(rows),
+        'blocks': len(plan.blocks),
+        'unfired_fraction': float((rows - fired) / rows) if rows else 0.0,
+        'high_fraction': float(high / rows) if rows else 0.0,
+        'mean_risk': float(mean),
+        'sensitivity': dict(sorted(sensitivity.items(),
+                                   key=lambda item: -item[1]['correlation_ratio'])),
+    }
+    return summary, effects, maps
+
+
+def write_report(out, summary, effects, maps, parquet=False):
+    with open(os.path.join(out, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    np.savez(os.path.join(out, 'effects.npz'),
+             **{f"{name}/{column}": values for name, table in effects.items()
+                for column, values in table.items()})
+    np.savez(os.path.join(out, 'maps.npz'),
+             **{f"{pair}/{column}": values for pair, table in maps.items()
+                for column, values in table.items()})
+    if not parquet:
+        return
+    import pandas as pd
+
+    pd.DataFrame([{'input': name, **{column: values[k] for column, values in table.items()}}
+                  for name, table in effects.items() for k in range(len(table['values']))]
+                 ).to_parquet(os.path.join(out, 'effects.parquet'), index=False)
+    rows = []
+    for pair, table in maps.items():
+        first, second = pair.split('__')
+        a, b = effects[first]['values'], effects[second]['values']
+        for (x, y), share in np.ndenumerate(table['high_share']):
+            rows.append({'input_a': first, 'value_a': a[x], 'input_b': second, 'value_b': b[y],
+                         'high_share': share, 'unfired_share': table['unfired_share'][x, y]})
+    pd.DataFrame(rows).to_parquet(os.path.join(out, 'maps.parquet'), index=False)
+
+
+def load_system(rules=None, version=None):
+    """The compiled rule base from a spec file, a registry version or the served default."""
+    if version:
+        from model_registry import ModelRegistry
+
+        registry = ModelRegistry()
+        return registry.load_risk(registry.resolve('risk', version))[1]
+    from model_artifact import build_compiled_risk, load_compiled_risk
+
+    return build_compiled_risk(rules) if rules else load_compiled_risk()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the risk rule base over its input space.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--rules', help="rule spec to sweep (default: the served rule base)")
+    source.add_argument('--version', help="registered risk version (or unique prefix)")
+    parser.add_argument('--mode', choices=['grid', 'sample'], default='grid')
+    parser.add_argument('--points', type=int, help="grid mode: at most N values per input")
+    parser.add_argument('--samples', type=int, default=1_000_000, help="sample mode: rows in total")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--splits', type=int, default=2, help="parts per input range")
+    parser.add_argument('--split', action='append', default=[], metavar='NAME=K',
+                        help="parts for one input, overriding --splits")
+    parser.add_argument('--chunk', type=int, default=65536, help="rows per engine call")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--out', default=SWEEP_DIR)
+    parser.add_argument('--parquet', action='store_true', help="also write the tables as Parquet")
+    parser.add_argument('--prune', action='store_true', help="delete cached blocks not used by this run")
+    args = parser.parse_args()
+
+    try:
+        overrides = {name: int(k) for name, k in (item.split('=', 1) for item in args.split)}
+    except ValueError:
+        parser.error("--split takes NAME=K")
+    if args.parquet:
+        try:
+            import pandas as pd
+
+            pd.io.parquet.get_engine('auto')
+        except ImportError as e:
+            parser.error(f"--parquet needs pandas with pyarrow or fastparquet ({e})")
+
+    start = time.perf_counter()
+    try:
+        plan = SweepPlan(load_system(args.rules, args.version), args.mode, args.points, args.samples,
+                         args.seed, args.splits, overrides)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"{plan.points} rows in {len(plan.blocks)} blocks", file=sys.stderr)
+    stats, reused, computed = run_sweep(plan, args.out, args.chunk, args.jobs, args.prune)
+    summary, effects, maps = report(plan, stats)
+    summary.update(reused_blocks=reused, computed_blocks=computed,
+                   seconds=round(time.perf_counter() - start, 2))
+    write_report(args.out, summary, effects, maps, args.parquet)
+
+    print(f"{summary['points']} rows, {computed} blocks computed, {reused} reused, "
+          f"{summary['seconds']}s")
+    print(f"risk not identified: {summary['unfired_fraction']:.2%}, "
+          f"High: {summary['high_fraction']:.2%}, mean risk {summary['mean_risk']:.2f}")
+    print(f"{'input':<30} {'corr. ratio':>11} {'mean range':>10} {'High range':>10}")
+    for name, s in summary['sensitivity'].items():
+        print(f"{name:<30} {s['correlation_ratio']:>11.3f} {s['mean_risk_range']:>10.2f} "
+              f"{s['high_share_range']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()